@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# command line args
+import argparse
+PARSER = argparse.ArgumentParser(description="Compare the time and accuracy of the Laplace-Beltrami "
+        "eigensolvers used by getHKS against shift-invert ARPACK.")
+PARSER.add_argument("mesh_files", nargs='*',
+        help="Mesh files to benchmark on. If none are given synthetic meshes are generated.")
+PARSER.add_argument("--subdivisions", dest='subdivisions', type=int, nargs='+', default=[5, 6],
+        help="Icosphere subdivision levels of the synthetic meshes (5: ~10k, 6: ~41k, 7: ~164k vertices).")
+PARSER.add_argument("--num_components", dest='num_components', type=int, default=50,
+        help="Number of eigenpairs to compute.")
+PARSER.add_argument("--solvers", dest='solvers', nargs='+',
+        default=["lobpcg:amg", "lobpcg:ilu", "coarse_to_fine", "coarse_to_fine:refine"],
+        help="Solver configurations to compare, of the form solver[:preconditioner][:refine].")
+PARSER.add_argument("--coarse_vertices", dest='coarse_vertices', type=int, default=10000,
+        help="Size of the decimated mesh used by the coarse_to_fine solver.")
+PARSER.add_argument("--tol", dest='tol', type=float, default=1e-4,
+        help="LOBPCG convergence tolerance.")
+PARSER.add_argument("--maxiter", dest='maxiter', type=int, default=100,
+        help="Maximum number of LOBPCG iterations.")
+PARSER.add_argument("--output_file", dest='output_file', default=None,
+        help="Write the results to this file in JSON format.")
+ARGS = PARSER.parse_args()
+
+# builtin modules
+import json
+import time
+
+# third party modules
+import numpy as np
+import trimesh
+
+# geobind modules
+from geobind.mesh import Mesh
+from geobind.mesh.get_hks import getLaplaceBeltramiEigs
+
+def syntheticMesh(subdivisions):
+    # a bumpy sphere of roughly protein size
+    sphere = trimesh.creation.icosphere(subdivisions=subdivisions)
+    V = np.array(sphere.vertices)
+    V *= 20*(1 + 0.2*np.sin(3*V[:,[0]])*np.cos(2*V[:,[1]]))
+
+    return Mesh(vertices=V, faces=np.array(sphere.faces), name="icosphere{}".format(subdivisions))
+
+def hks(evals, evecs, num_samples=3):
+    tmin = 1/min(evals.max(), 1e+1)
+    tmax = 1/max(evals.min(), 1e-3)
+    t = np.exp(np.linspace(np.log(tmin), np.log(tmax), num_samples))
+
+    return (evecs**2) @ np.exp(-np.outer(evals, t))
+
+def parseSolver(spec):
+    fields = spec.split(':')
+    kwargs = {"solver": fields[0]}
+    for f in fields[1:]:
+        if(f == "refine"):
+            kwargs["refine"] = True
+        else:
+            kwargs["preconditioner"] = f
+
+    return kwargs
+
+def timeSolver(mesh, **kwargs):
+    # drop spectra cached by previous runs
+    for key in [k for k in mesh.cache if k.startswith("laplace_beltrami")]:
+        del mesh.cache[key]
+    t0 = time.perf_counter()
+    evals, evecs = getLaplaceBeltramiEigs(mesh, num_components=ARGS.num_components, **kwargs)
+
+    return evals, evecs, time.perf_counter() - t0
+
+if(ARGS.mesh_files):
+    meshes = [Mesh(f) for f in ARGS.mesh_files]
+else:
+    meshes = [syntheticMesh(n) for n in ARGS.subdivisions]
+
+results = []
+for mesh in meshes:
+    # make sure the operators are built before timing
+    mesh.cot_matrix
+    mesh.mass_matrix
+
+    ref_evals, ref_evecs, ref_time = timeSolver(mesh, solver='shift_invert')
+    ref_hks = hks(ref_evals, ref_evecs)
+    print("{} ({} vertices)".format(mesh.name, mesh.num_vertices))
+    print("  {:<24s} {:>8.2f}s".format("shift_invert", ref_time))
+    results.append({"mesh": mesh.name, "num_vertices": mesh.num_vertices, "solver": "shift_invert", "time": ref_time})
+
+    for spec in ARGS.solvers:
+        evals, evecs, t = timeSolver(mesh, tol=ARGS.tol, maxiter=ARGS.maxiter,
+            coarse_vertices=ARGS.coarse_vertices, **parseSolver(spec))
+        # skip the zero eigenvalue when computing relative errors
+        eval_err = np.abs(evals[1:] - ref_evals[1:])/ref_evals[1:]
+        hks_err = np.abs(hks(evals, evecs) - ref_hks).max(axis=0)/np.abs(ref_hks).max(axis=0)
+        print("  {:<24s} {:>8.2f}s  eigenvalue error (median/max): {:.2e}/{:.2e}  HKS error (max): {:.2e}".format(
+            spec, t, np.median(eval_err), eval_err.max(), hks_err.max()))
+        results.append({
+            "mesh": mesh.name,
+            "num_vertices": mesh.num_vertices,
+            "solver": spec,
+            "time": t,
+            "speedup": ref_time/t,
+            "eigenvalue_error_median": float(np.median(eval_err)),
+            "eigenvalue_error_max": float(eval_err.max()),
+            "hks_error_max": float(hks_err.max())
+        })
+
+if(ARGS.output_file):
+    with open(ARGS.output_file, "w") as FH:
+        json.dump(results, FH, indent=2)
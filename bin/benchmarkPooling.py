@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# command line args
+import argparse
+PARSER = argparse.ArgumentParser(description="Time the node position and face update of EdgePooling, "
+        "and the full pooling layer, against the previous implementation which built index tensors on the CPU.")
+PARSER.add_argument("--subdivisions", dest='subdivisions', type=int, default=6,
+        help="Icosphere subdivision level of the synthetic meshes (6: ~41k vertices).")
+PARSER.add_argument("--batch_size", dest='batch_size', type=int, default=4,
+        help="Number of meshes in a batch.")
+PARSER.add_argument("--num_features", dest='num_features', type=int, default=32,
+        help="Number of node features.")
+PARSER.add_argument("--edge_dim", dest='edge_dim', type=int, default=9,
+        help="Number of edge features.")
+PARSER.add_argument("--repeats", dest='repeats', type=int, default=20,
+        help="Number of timed repetitions.")
+PARSER.add_argument("--device", dest='device', default=None,
+        help="Torch device to run on, defaults to cuda if available.")
+ARGS = PARSER.parse_args()
+
+# builtin modules
+import time
+
+# third party modules
+import numpy as np
+import torch
+import trimesh
+from torch_geometric.data import Data, Batch
+from torch_geometric.transforms import FaceToEdge
+
+# geobind modules
+from geobind.nn.layers import EdgePooling
+from geobind.mesh.mesh_hierarchy import greedyEdgeMatching
+
+def legacyPoolGeometry(pos, face, cluster, num_nodes):
+    # the update as it was done before, with index tensors built on the cpu
+    ind1 = torch.empty(num_nodes, dtype=torch.long, device=torch.device('cpu'))
+    ind2 = torch.empty(num_nodes, dtype=torch.long, device=torch.device('cpu'))
+
+    N = cluster.size(0)
+    cluster_cpu = cluster.cpu()
+    ind1[cluster_cpu] = torch.arange(N)
+    ind2[cluster_cpu.flip((0))] = torch.arange(N-1, -1, -1)
+    new_pos = (pos[ind1.to(pos.device)] + pos[ind2.to(pos.device)])/2
+
+    new_face = torch.empty_like(face)
+    new_face[0,:] = cluster[face[0,:]]
+    new_face[1,:] = cluster[face[1,:]]
+    new_face[2,:] = cluster[face[2,:]]
+    fi = (new_face[0,:] == new_face[1,:]) + (new_face[0,:] == new_face[2,:]) + (new_face[1,:] == new_face[2,:])
+
+    return new_pos, new_face[:,~fi]
+
+def timeCall(fn, *args):
+    times = []
+    for _ in range(ARGS.repeats):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        out = fn(*args)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t0)
+
+    return np.median(times), out
+
+device = torch.device(ARGS.device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+
+# build a batch of synthetic meshes
+sphere = trimesh.creation.icosphere(subdivisions=ARGS.subdivisions)
+data_list = []
+for i in range(ARGS.batch_size):
+    data = Data(
+        pos=torch.tensor(np.array(sphere.vertices)*20, dtype=torch.float32),
+        face=torch.tensor(np.array(sphere.faces).T, dtype=torch.int64)
+    )
+    data = FaceToEdge(remove_faces=False)(data)
+    data.x = torch.randn(data.num_nodes, ARGS.num_features)
+    data.edge_attr = torch.randn(data.edge_index.size(1), ARGS.edge_dim)
+    data_list.append(data)
+batch = Batch.from_data_list(data_list).to(device)
+
+# contract a matching of the edges, as a pooling layer would, independently of the layer itself
+edges = batch.edge_index[:, batch.edge_index[0] < batch.edge_index[1]].t().cpu().numpy()
+cluster, _ = greedyEdgeMatching(edges, np.random.RandomState(0).rand(len(edges)), batch.num_nodes, check_manifold=False)
+cluster = torch.tensor(cluster, dtype=torch.long, device=device)
+num_nodes = int(cluster.max()) + 1
+
+print("{} meshes of {} vertices on {}, {} nodes after pooling".format(ARGS.batch_size, sphere.vertices.shape[0], device, num_nodes))
+t_old, (pos_old, face_old) = timeCall(legacyPoolGeometry, batch.pos, batch.face, cluster, num_nodes)
+t_new, (pos_new, face_new) = timeCall(EdgePooling.pool_geometry, batch.pos, batch.face, cluster, num_nodes)
+print("  position/face update (before): {:8.2f} ms".format(1000*t_old))
+print("  position/face update (after):  {:8.2f} ms".format(1000*t_new))
+print("  max position difference: {:.2e}, faces equal: {}".format(
+    (pos_old.to(device) - pos_new).abs().max().item(), torch.equal(face_old.to(device), face_new)))
+
+# time the full layer with the previous and the new update
+pool = EdgePooling(ARGS.num_features, edge_dim=ARGS.edge_dim).to(device)
+for label, fn in [("before", legacyPoolGeometry), ("after", EdgePooling.pool_geometry)]:
+    pool.pool_geometry = fn
+    try:
+        with torch.no_grad():
+            t_layer, _ = timeCall(pool, batch.x, batch)
+    except Exception as e:
+        print("  full pooling layer ({}): failed with {}: {}".format(label, type(e).__name__, e))
+        continue
+    print("  full pooling layer ({}):{}{:8.2f} ms".format(label, " "*(7 - len(label)), 1000*t_layer))
@@ -13,6 +13,8 @@ arg_parser.add_argument("-m", "--moieties_file", dest="moieties_file",
                 help="A file in JSON format containing regexes which assign atoms to a class or the name of a built-in label set.")
 arg_parser.add_argument("-r", "--refresh", action='store_true', default=False,
                 help="recompute mesh/features/labels even if present")
+arg_parser.add_argument("-s", "--refresh_stages", nargs="+", default=[],
+                help="recompute the given pipeline stages even if their cached results are current")
 arg_parser.add_argument("-E", "--no_electrostatics", action='store_true',
                 help="do not calculate electrostatic features")
 arg_parser.add_argument("-L", "--no_labels", dest="no_labels", action='store_true', default=False,
@@ -21,6 +23,16 @@ arg_parser.add_argument("-F", "--no_features", dest="no_features", action='store
                 help="do not generate any mesh features for each interface")
 arg_parser.add_argument("-A", "--no_adjacency", dest="no_adjacency", action='store_true', default=False,
                 help="do not write mesh adjacency matrix to file")
+arg_parser.add_argument("-j", "--num_workers", type=int, default=None,
+                help="number of structures to process in parallel (default: all available cores)")
+arg_parser.add_argument("--manifest", default=None,
+                help="file recording the outcome for each structure, completed structures are skipped when rerun (default: <output_file>.manifest)")
+arg_parser.add_argument("--queue", dest="queue_dir", default=None,
+                help="directory on a shared filesystem through which processes on any number of nodes divide the structures between them, records finished structures in place of the manifest")
+arg_parser.add_argument("--lease_time", type=float, default=600.0,
+                help="seconds after which the claim of a structure by a process which stopped renewing it is released (default: 600)")
+arg_parser.add_argument("--profile", dest="profile_dir", default=None,
+                help="directory to write the time and memory used by each feature function, per structure and summarized for the run")
 arg_parser.add_argument("-d", "--debug", action='store_true', default=False,
                 help="write additional information")
 arg_parser.add_argument("-l", "--ligand_list", dest="ligand_list", nargs="+",
@@ -34,20 +46,34 @@ import logging
 import subprocess
 import json
 import os
+import sys
+import time
+import socket
+import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
 from os.path import join as ospj
 import pathlib
 
 # third party modules
 import numpy as np
+import trimesh
 from scipy.sparse import save_npz
 
 # geobind modules
 import geobind
-from geobind import mapStructureFeaturesToMesh, AtomToClassMapper
+from geobind import AtomToClassMapper
 from geobind.structure.data import data as D
 from geobind.structure import StructureData
 from geobind.structure import ResidueMutator
-from geobind.utils import Interpolator
+from geobind.structure.get_atom_sasa import Radius
+from geobind.utils import Interpolator, ThreadScheduler, setThreadScheduler, availableCores, StageCache, FeatureStore
+from geobind.utils import encodeArrays, decodeArrays, summarizePrecisionReport
+from geobind.utils import ToolCache, getToolCache, setToolCache
+from geobind.utils import Profiler, summarizeProfiles, formatProfileSummary
+from geobind.utils import WorkQueue
 
 def getEntities(structure, atom_mapper, regexes, mi=0):
     """Docstring"""
@@ -63,19 +89,37 @@ def getEntities(structure, atom_mapper, regexes, mi=0):
     
     return structure.slice(structure, pro, 'protein'), structure.slice(structure, lig, 'ligand')
 
-def main():
-    ### Load various data files ####################################################################
-    res_mutator = ResidueMutator() # can reuse this for multiple structures
+WORKER = {} # objects reused for every structure a worker process handles, see WORKER_MAX_TASKS
+
+def initWorker(scheduler):
+    """Set up the state shared by every structure processed in this process"""
+    # Limit the threads used by external tools (NanoShaper, APBS) across all workers
+    setThreadScheduler(scheduler)
+    WORKER["res_mutator"] = ResidueMutator() # can reuse this for multiple structures
+    
+    # Reuse the outputs of external tools (pdb2pqr, NanoShaper, APBS, DSSP) for identical inputs
+    if "TOOL_CACHE_PATH" in C:
+        max_size = C.get("TOOL_CACHE_MAX_GB", None)
+        setToolCache(ToolCache(C["TOOL_CACHE_PATH"], max_size=(max_size*1e9 if max_size else None)))
+    
+    # Record every call of the geobind feature functions
+    WORKER["profiler"] = None
+    if ARGS.profile_dir:
+        WORKER["profiler"] = Profiler()
+        WORKER["profiler"].instrument(geobind, geobind.mesh, geobind.structure)
     
     # Get standard surface area
     if(C["AREA_MEASURE"] == "sasa"):
-        classifier = Radius()
-        classifier.initialize()
-        standard_area = D.standard_sasa
+        WORKER["classifier"] = Radius()
+        WORKER["classifier"].initialize()
+        WORKER["standard_area"] = D.standard_sasa
     else:
-        standard_area = D.standard_sesa
+        WORKER["classifier"] = None
+        WORKER["standard_area"] = D.standard_sesa
     
     # Create Atom Mapper object
+    WORKER["atom_mapper"] = None
+    WORKER["label_names"] = None
     if not ARGS.no_labels:
         if ARGS.moieties_file:
             atom_mapper = AtomToClassMapper(ARGS.moieties_file)
@@ -88,181 +132,635 @@ def main():
             atom_mapper = AtomToClassMapper(C["LIGAND_LIST"], default=0, name=C.get("LIGAND_SET_NAME", "LIGANDS"))
         elif "MOIETY_LABEL_SET_NAME" in C:
             atom_mapper = AtomToClassMapper(C["MOIETY_LABEL_SET_NAME"])
-        label_names = "Y_{}".format(atom_mapper.name)
+        WORKER["atom_mapper"] = atom_mapper
+        WORKER["label_names"] = "Y_{}".format(atom_mapper.name)
+
+def atomFeatures(structure, feature_names):
+    """Matrix of the atom-level features stored in atom.xtra, zero where a feature is not set"""
+    X = [[atom.xtra.get(f, 0.0) for f in feature_names] for atom in structure.get_atoms()]
     
-    ### Load the interface file which describes a list of DNA-protein interfaces to process ########
-    listFile = ARGS.structures_file
-    PROCESSED = open(ARGS.output_file, "w")
+    return np.array(X, dtype=np.float64).reshape(-1, len(feature_names))
+
+def setAtomFeatures(structure, feature_names, X):
+    """Store the columns of X as atom-level features in atom.xtra"""
+    for atom, x in zip(structure.get_atoms(), X):
+        for f, v in zip(feature_names, x):
+            atom.xtra[f] = v
+
+def featureStage(cache, name, fn, inputs, params=None):
+    """Run a pipeline stage whose output is a feature matrix and a list of feature names, as
+    returned by `fn`"""
+    def compute():
+        X, names = fn()
+        return {"X": np.asarray(X).reshape(len(X), -1), "names": np.array(names)}
+    out = cache.run(name, compute, inputs=inputs, params=params)
     
-    # main loop
-    for fileName in open(listFile):
-        fileName = fileName.strip()
-        if(fileName[0] == '#'):
-            # skip commented lines
-            continue
-        
-        ### LOAD STRUCTURE #########################################################################
-        protein_id = '.'.join(fileName.split('.')[0:-1]) + '_protein'
-        structure = StructureData(fileName, name=protein_id, path=C["PDB_FILES_PATH"])
-        protein, lig = getEntities(structure, atom_mapper, D.regexes)
-        
-        # Clean the protein entity
-        protein, pqr = geobind.structure.cleanProtein(protein, res_mutator, hydrogens=C['HYDROGENS'])
-        
-        ### MESH GENERATION ########################################################################
-        # Write a PDB file matching chain
-        pdb = protein.save()
-        
-        # Generate a mesh
-        mesh_prefix = "{}_mesh".format(protein_id)
+    return out["X"], [str(n) for n in out["names"]]
+
+def atomStage(cache, name, structure, fn, inputs=("clean",), params=None):
+    """Run a pipeline stage computing atom-level features with `fn`, which returns their names.
+    Cached features are restored into atom.xtra."""
+    def compute():
+        names = fn()
+        return atomFeatures(structure, names), names
+    X, names = featureStage(cache, name, compute, inputs, params)
+    if not cache.updated(name):
+        setAtomFeatures(structure, names, X)
+    
+    return names
+
+def startStage(executor, fn, *args, **kwargs):
+    """Run a pipeline stage in the background with `executor`, or right away if it is None.
+    Returns a future holding its result."""
+    if executor is None:
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+    
+    return executor.submit(fn, *args, **kwargs)
+
+def processStructure(fileName, cleanup):
+    """Compute the mesh, features and labels of one structure and write them to disk. Every step
+    is a stage of a `geobind.utils.StageCache` so that only the stages whose inputs or parameters
+    changed are recomputed. Temporary files and background stages are registered with `cleanup`,
+    an ExitStack, so they are released whether or not the structure succeeds. Returns the name of
+    the data file written."""
+    res_mutator = WORKER["res_mutator"]
+    classifier = WORKER["classifier"]
+    standard_area = WORKER["standard_area"]
+    atom_mapper = WORKER["atom_mapper"]
+    label_names = WORKER["label_names"]
+    
+    ### LOAD STRUCTURE #############################################################################
+    protein_id = '.'.join(fileName.split('.')[0:-1]) + '_protein'
+    structure = StructureData(fileName, name=protein_id, path=C["PDB_FILES_PATH"])
+    protein, lig = getEntities(structure, atom_mapper, D.regexes)
+    cache = StageCache(ospj(C.get("STAGE_CACHE_PATH", ospj(C['FEATURE_DATA_PATH'], "stages")), protein_id),
+        refresh=ARGS.refresh,
+        refresh_stages=ARGS.refresh_stages
+    )
+    
+    # Clean the protein entity. This is always run, its output identifies the structure for the
+    # stages which depend on it.
+    protein, pqr = geobind.structure.cleanProtein(protein, res_mutator, hydrogens=C['HYDROGENS'])
+    cleanup.callback(os.remove, pqr)
+    cache.run("clean", lambda: {
+            "protein": np.array([atom.coord for atom in protein.get_atoms()]),
+            "charge_radius": atomFeatures(protein, ["charge", "radius"]),
+            "ligand": np.array([atom.coord for atom in lig.get_atoms()])
+        },
+        params={"hydrogens": C['HYDROGENS']},
+        cache=False
+    )
+    update_features = not ARGS.no_features
+    update_electrostatics = update_features and not ARGS.no_electrostatics
+    
+    # Write a PDB file matching chain
+    pdb = protein.save()
+    cleanup.callback(os.remove, pdb)
+    
+    ### BACKGROUND TOOLS ###########################################################################
+    # Stages running external tools on the structure alone (APBS, MSMS/SASA, DSSP) do not need the
+    # mesh. With OVERLAP_TOOLS they are started here and run while the mesh and the geometry
+    # features are computed, the results are collected where they are needed. Each stage only
+    # writes its own atom features, so they do not interfere.
+    executor = None
+    if C.get("OVERLAP_TOOLS", False):
+        # on failure, stages which have not started are cancelled and running ones waited for, so
+        # they neither overlap the next structure nor keep their thread reservations
+        executor = ThreadPoolExecutor(max_workers=4)
+        cleanup.callback(executor.shutdown, wait=True, cancel_futures=True)
+    
+    # SESA can be taken from the generated mesh instead of a separate MSMS surface
+    sesa_from_mesh = (C["AREA_MEASURE"] == "sesa" and C.get("SESA_SOURCE", "msms") == "mesh")
+    def area():
+        if(sesa_from_mesh):
+            geobind.structure.getAtomSESAFromMesh(protein, mesh, scale=sesa_scale)
+            if C.get("SESA_VALIDATE", False):
+                geobind.structure.getAtomSESA(protein, protein_id, feature_name="sesa_msms")
+                logging.info("SESA from mesh compared to MSMS for %s: %s", protein_id, geobind.structure.compareAtomAreas(protein, "sesa", "sesa_msms"))
+        elif(C["AREA_MEASURE"] == "sesa"):
+            geobind.structure.getAtomSESA(protein, protein_id)
+        else:
+            geobind.structure.getAtomSASA(protein, classifier=classifier)
+        return [C["AREA_MEASURE"]]
+    
+    if update_features:
+        if not sesa_from_mesh:
+            area_stage = startStage(executor, atomStage, cache, C["AREA_MEASURE"], protein, area)
+        dssp_stage = startStage(executor, atomStage, cache, "dssp", protein, lambda: geobind.structure.getDSSP(protein, pdb))
+    
+    if update_electrostatics:
+        # the potential and accessibility maps depend only on the structure
+        potfile = ospj(C["ELECTROSTATICS_PATH"], protein_id+"_potential.dx")
+        accessfile = ospj(C["ELECTROSTATICS_PATH"], protein_id+"_access.dx")
+        def apbs():
+            geobind.structure.runAPBS(protein, protein_id, pqr=pqr, basedir=C["ELECTROSTATICS_PATH"])
+        apbs_stage = startStage(executor, cache.run, "apbs", apbs, inputs=("clean",), files=[potfile, accessfile])
+    
+    ### MESH GENERATION ############################################################################
+    # Generate a mesh
+    mesh_prefix = "{}_mesh".format(protein_id)
+    mesh_method = C.get("MESH_METHOD", "nanoshaper") # 'builtin' meshes in-process without calling an external program
+    if mesh_method == "nanoshaper":
         mesh_kwargs = dict(op_mode='normal', surface_type='skin', skin_parameter=0.45, grid_scale=C.get("GRID_SCALE", 2.0))
-        if ARGS.refresh:
-            mesh = geobind.mesh.generateMesh(protein, 
-                prefix=mesh_prefix,
-                basedir=C["MESH_FILES_PATH"],
-                clean=(not ARGS.debug),
-                **mesh_kwargs
+    elif mesh_method == "builtin":
+        mesh_kwargs = dict(method=mesh_method, surface_type=C.get("MESH_SURFACE_TYPE", "ses"), probe_radius=C.get("MESH_PROBE_RADIUS", 1.4), grid_scale=C.get("GRID_SCALE", 2.0))
+    else:
+        raise ValueError("Unknown value of option `MESH_METHOD`: {}".format(mesh_method))
+    if sesa_from_mesh and mesh_kwargs["surface_type"] != "ses":
+        # skin and gaussian surfaces are not solvent excluded surfaces
+        raise ValueError("Option `SESA_SOURCE` 'mesh' requires a 'ses' mesh from MESH_METHOD 'builtin'")
+    # mesh areas are high compared with the MSMS areas behind `standard_sesa`, by 6.3% with the
+    # default probe radius (see getAtomSESAFromMesh)
+    sesa_scale = C.get("SESA_MESH_SCALE", 1/1.063)
+    mesh_format = C.get("MESH_FILE_FORMAT", "off") # 'bmesh' stores a memory-mappable binary mesh
+    use_sidecar = C.get("MESH_SIDECAR", True) # keep derived operators and spectra next to the mesh file
+    if "MESH_TARGET_VERTICES" in C:
+        # choose the resolution per structure to keep mesh sizes predictable
+        mesh_kwargs["target_vertices"] = C["MESH_TARGET_VERTICES"]
+    elif "MESH_VERTEX_DENSITY" in C:
+        mesh_kwargs["vertex_density"] = C["MESH_VERTEX_DENSITY"]
+    meshFile = ospj(C['MESH_FILES_PATH'], "{}.{}".format(mesh_prefix, mesh_format))
+    
+    def generate():
+        mesh = geobind.mesh.generateMesh(protein,
+            prefix=mesh_prefix,
+            basedir=C["MESH_FILES_PATH"],
+            clean=(not ARGS.debug),
+            **mesh_kwargs
+        )
+        logging.info("Computed new mesh for: %s", protein_id)
+        mesh.save(C['MESH_FILES_PATH'], file_format=mesh_format, overwrite=True)
+    cache.run("mesh", generate, inputs=("clean",), params=dict(mesh_kwargs, file_format=mesh_format), files=[meshFile])
+    mesh_changed = cache.updated("mesh")
+    
+    # work with the mesh as it is stored, text formats do not round-trip exactly
+    mesh = geobind.mesh.Mesh(meshFile, name=mesh_prefix, single_component=True, sidecar=(use_sidecar or None))
+    if not mesh_changed:
+        logging.info("Loaded existing mesh for: %s", protein_id)
+    
+    if update_features:
+        if sesa_from_mesh:
+            area_stage = startStage(executor, atomStage, cache, C["AREA_MEASURE"], protein, area,
+                inputs=("clean", "mesh"),
+                params={"source": "mesh", "scale": sesa_scale}
             )
-            logging.info("Computed new mesh for: %s", protein_id)
-            meshFile = mesh.save(C['MESH_FILES_PATH'], overwrite=True)
-        else:
-            meshFile = ospj(C['MESH_FILES_PATH'], "{}_mesh.off".format(protein_id))
-            if os.path.exists(meshFile):
-                # found an existing mesh, load it
-                mesh = geobind.mesh.Mesh(meshFile, name=mesh_prefix)
-                logging.info("Loaded existing mesh for: %s", protein_id)
-            else:
-                # couldn't find mesh files, compute from scratch
-                mesh = geobind.mesh.generateMesh(protein, 
-                    prefix=mesh_prefix,
-                    basedir=C["MESH_FILES_PATH"],
-                    clean=(not ARGS.debug),
-                    **mesh_kwargs
-                )
-                logging.info("Computed new mesh for: %s", protein_id)
-                meshFile = mesh.save(C['MESH_FILES_PATH'])
-                ARGS.refresh = True
         
-        ### DATA ARRAYS ############################################################################
-        # Check to see what already exists and what we need to compute
-        fname = ospj(C['FEATURE_DATA_PATH'], "{}_data.npz".format(protein_id))
-        if os.path.exists(fname) and not ARGS.refresh:
-            arrays = dict(np.load(fname, allow_pickle=True))
+        # pocket detection runs NanoShaper on the structure and maps the pockets to the mesh
+        pockets_stage = startStage(executor, featureStage, cache, "pockets",
+            lambda: geobind.mesh.getPockets(protein, mesh, radius_big=3.0),
+            inputs=("clean", "mesh"),
+            params={"radius_big": 3.0}
+        )
+    
+    ### DATA ARRAYS ################################################################################
+    # Check to see what already exists and what we need to compute. A feature store keeps every
+    # array (and every feature column) separately, so only what changed is written.
+    data_format = C.get("DATA_FORMAT", "npz")
+    if data_format == "store":
+        data_file = ospj(C['FEATURE_DATA_PATH'], "{}_data.store".format(protein_id))
+        store = FeatureStore(data_file)
+        if mesh_changed:
+            store.clear()
+        existing = set(store.files)
+        arrays = {}
+    elif data_format == "npz":
+        data_file = ospj(C['FEATURE_DATA_PATH'], "{}_data.npz".format(protein_id))
+        if os.path.exists(data_file) and not mesh_changed:
+            arrays = decodeArrays(np.load(data_file, allow_pickle=True), dtype=np.float64)
         else:
             arrays = {}
-        arrays['V'] = mesh.vertices
-        arrays['F'] = mesh.faces
-        arrays['name'] = protein_id
-        if mesh.vertex_normals is not None:
-            arrays['N'] = mesh.vertex_normals
-            
-        ### FEATURES ###############################################################################
-        update_features = (not ARGS.no_features) and (ARGS.refresh or ('X' not in arrays))
-        if update_features:
-            logging.info("Computing a new set of features for %s" , protein_id)
-            FEATURES = []
-            FEATURE_NAMES = []
-            
-            ### Geometry Features ##################################################################
-            # Compute vertex-level features based only on mesh geometry. Features are stored in the
-            # `mesh.vertex_attributes` property of the mesh object.
-            geobind.mesh.getMeshCurvature(mesh)
-            geobind.mesh.getConvexHullDistance(mesh)
-            geobind.mesh.getHKS(mesh)
-            
-            mk, mv = zip(*mesh.vertex_attributes.items())
-            FEATURE_NAMES += list(mk)
-            FEATURES += list(mv)
+        existing = set(arrays)
+    else:
+        raise ValueError("Unknown value of config option `DATA_FORMAT`: {}".format(data_format))
+    arrays['V'] = mesh.vertices
+    arrays['F'] = mesh.faces
+    arrays['name'] = protein_id
+    if mesh.vertex_normals is not None:
+        arrays['N'] = mesh.vertex_normals
+    
+    # Precompute the mesh pooling hierarchy, it depends only on the mesh geometry
+    if C.get("POOLING_LEVELS", 0) > 0 and (mesh_changed or 'pool{}_cluster'.format(C["POOLING_LEVELS"]) not in existing):
+        arrays.update(geobind.mesh.getMeshHierarchy(mesh, num_levels=C["POOLING_LEVELS"]))
+        logging.info("Computed %d level mesh pooling hierarchy for %s", C["POOLING_LEVELS"], protein_id)
+    
+    # Precompute directed edges and raw geometric edge features so they need not be computed
+    # when the data is loaded
+    if C.get("EDGE_FEATURES", False) and (mesh_changed or 'edge_attr' not in existing):
+        tmesh = trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.faces, process=False)
+        arrays['edge_index'], arrays['edge_attr'] = geobind.mesh.getGeometricEdgeFeatures(tmesh)
+        logging.info("Computed geometric edge features for %s", protein_id)
+    
+    ### FEATURES ###################################################################################
+    if update_features:
+        FEATURES = []
+        FEATURE_NAMES = []
+        
+        ### Geometry Features ######################################################################
+        # Compute vertex-level features based only on mesh geometry
+        def vertexFeatures(feature_names):
+            return np.stack([mesh.vertex_attributes[f] for f in feature_names], axis=1), feature_names
+        
+        for name, fn in [
+                ("curvature", lambda: vertexFeatures(geobind.mesh.getMeshCurvature(mesh) + geobind.mesh.getConvexHullDistance(mesh))),
+                ("hks", lambda: vertexFeatures(geobind.mesh.getHKS(mesh)))
+            ]:
+            X, names = featureStage(cache, name, fn, inputs=("mesh",))
+            FEATURE_NAMES += names
+            FEATURES.append(X)
+        
+        ### Structure Features #####################################################################
+        # Compute atom-level features and store them in atom.xtra of chain. Atom-level features
+        # are computed based only on the protein structure and are independent of the mesh.
+        area_stage.result()
+        
+        features_a = [] # store feature names
+        features_a += atomStage(cache, "sap", protein,
+            lambda: geobind.structure.getSAP(protein, standard_area=standard_area, area_key=C["AREA_MEASURE"], distance=5.0, hydrogens=False),
+            inputs=("clean", C["AREA_MEASURE"]),
+            params={"distance": 5.0}
+        )
+        features_a += atomStage(cache, "cv", protein,
+            lambda: (
+                geobind.structure.getCV(protein, 10.00, feature_name="cv_fine", hydrogens=False) +
+                geobind.structure.getCV(protein, 25.00, feature_name="cv_medium", hydrogens=False) +
+                geobind.structure.getCV(protein, 100.0, feature_name="cv_coarse", hydrogens=False)
+            ),
+            params={"radii": [10.0, 25.0, 100.0]}
+        )
+        features_a += dssp_stage.result()
+        features_a += geobind.structure.getAchtleyFactors(protein)
+        features_a += geobind.structure.getHBondAtoms(protein)
+        FEATURE_NAMES += features_a
+        
+        # Map atom-level features to the mesh, weighted by inverse distance from the atom to
+        # nearby mesh vertices
+        Xa = geobind.mapStructureFeaturesToMesh(mesh, protein, features_a, hydrogens=C["HYDROGENS"])
+        FEATURES.append(Xa)
+        
+        # Collect pocket features
+        Xp, features_p = pockets_stage.result()
+        FEATURE_NAMES += features_p
+        FEATURES.append(Xp)
+        
+        # Compute Electrostatic features
+        if update_electrostatics:
+            apbs_stage.result()
             
-            ### Structure Features #################################################################
-            # Compute atom-level features and store them in atom.xtra of chain. Atom-level features 
-            # are computed based only on the protein structure and are independent of the mesh.
+            def electrostatics():
+                phi = Interpolator(potfile)
+                acc = Interpolator(accessfile)
+                return geobind.mesh.mapElectrostaticPotentialToMesh(mesh, phi, acc, efield=True, diff_method='five_point_stencil')
+            Xe, features_e = featureStage(cache, "electrostatics", electrostatics, inputs=("apbs", "mesh"))
+            FEATURE_NAMES += features_e
+            FEATURES.append(Xe)
+    
+    ### LABELS #####################################################################################
+    update_labels = not ARGS.no_labels
+    if update_labels:
+        # Compute labels
+        label_params = {
+            "smooth": C["SMOOTH_LABELS"],
+            "mask": C["MASK_LABELS"],
+            "distance_cutoff": C["MESH_DISTANCE_CUTOFF"],
+            "mask_cutoff": C.get("MASK_DISTANCE_CUTOFF", 0),
+            "labels": label_names,
+            "classes": atom_mapper.classes
+        }
+        def labels():
+            logging.info("Computing a new set of labels for %s" , protein_id)
+            return {"Y": geobind.assignMeshLabelsFromStructure(lig, mesh, atom_mapper,
+                smooth=label_params["smooth"],
+                mask=label_params["mask"],
+                distance_cutoff=label_params["distance_cutoff"],
+                mask_cutoff=label_params["mask_cutoff"]
+            )}
+        Y = cache.run("labels", labels, inputs=("clean", "mesh"), params=label_params)["Y"]
+    
+    logging.info("Recomputed stages for %s: %s", protein_id, ", ".join(sorted(cache.computed)) or "none")
+    
+    ### OUTPUT #################################################################################
+    # Write features to disk
+    
+    # Vertex features
+    if update_features:
+        FEATURES = [x.reshape(-1, 1) if x.ndim == 1 else x for x in FEATURES]
+        arrays['X'] = np.concatenate(FEATURES, axis=1)
+        arrays['feature_names'] = np.array(FEATURE_NAMES)
+    
+    # Mesh labels
+    if update_labels:
+        arrays[label_names] = Y
+        arrays['{}_classes'.format(label_names)] = atom_mapper.classes
+    
+    # Convert to the storage types given by the precision policy
+    arrays, report = encodeArrays(arrays, C.get("STORAGE_PRECISION", "full"))
+    if report:
+        logging.info("Storage precision for %s: %s", protein_id, summarizePrecisionReport(report))
+    
+    # Write mesh data to disk
+    if data_format == "store":
+        # drop scale/offset metadata of arrays which are now stored unscaled
+        for key in store.files:
+            base = key.rsplit("__", 1)[0]
+            if key != base and base in arrays and key not in arrays:
+                store.remove(key)
+        
+        X = arrays.pop('X', None)
+        for key, value in arrays.items():
+            store.write(key, value)
+        if X is not None:
+            # replace only the feature columns which changed, columns must stay in feature order
+            if 'X' in store:
+                store.removeColumns('X', [f for f in store.columns('X') if f not in FEATURE_NAMES])
+                if store.columns('X') != FEATURE_NAMES[:len(store.columns('X'))]:
+                    store.remove('X')
+            store.writeColumns('X', X, FEATURE_NAMES)
+    else:
+        # write to a temporary file first so a partial file is never read or listed
+        tmp = "{}.{}.tmp.npz".format(data_file, os.getpid())
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, data_file)
+    logging.info("Saved mesh data to disk: %s", data_file)
+    
+    # Write mesh adjacency to disk
+    if not ARGS.no_adjacency:
+        fname = ospj(C['FEATURE_DATA_PATH'], "{}_adj.npz".format(protein_id))
+        tmp = "{}.{}.tmp.npz".format(fname, os.getpid())
+        save_npz(tmp, mesh.vertex_adjacency_matrix)
+        os.replace(tmp, fname)
+        logging.info("Saved adjacency data to disk: %s", fname)
+    
+    # Write derived mesh data to the sidecar
+    if use_sidecar:
+        mesh.saveSidecar()
+    
+    return os.path.basename(data_file)
 
-            if(C["AREA_MEASURE"] == "sesa"):
-                geobind.structure.getAtomSESA(protein, protein_id)
-            else:
-                geobind.structure.getAtomSASA(protein, classifier=classifier)
-            
-            features_a = [] # store feature names
-            features_a += geobind.structure.getSAP(protein, standard_area=standard_area, area_key=C["AREA_MEASURE"], distance=5.0, hydrogens=False)
-            features_a += geobind.structure.getCV(protein, 10.00, feature_name="cv_fine", hydrogens=False)
-            features_a += geobind.structure.getCV(protein, 25.00, feature_name="cv_medium", hydrogens=False)
-            features_a += geobind.structure.getCV(protein, 100.0, feature_name="cv_coarse", hydrogens=False)
-            features_a += geobind.structure.getDSSP(protein, pdb)
-            features_a += geobind.structure.getAchtleyFactors(protein)
-            features_a += geobind.structure.getHBondAtoms(protein)
-            FEATURE_NAMES += features_a
-            
-            # Map atom-level features to the mesh, weighted by inverse distance from the atom to 
-            # nearby mesh vertices
-            Xa = mapStructureFeaturesToMesh(mesh, protein, features_a, hydrogens=C["HYDROGENS"])
-            FEATURES.append(Xa)
+def runStructure(fileName):
+    """Process one structure, catching any error so that it is recorded instead of ending the run.
+    Returns a manifest record."""
+    record = {"structure": fileName, "status": "ok", "data_file": None, "error": None}
+    t0 = time.time()
+    tool_cache = getToolCache()
+    if tool_cache is not None:
+        tool_cache.stats = {}
+    profiler = WORKER["profiler"]
+    if profiler is not None:
+        profiler.reset()
+    try:
+        with ExitStack() as cleanup:
+            record["data_file"] = processStructure(fileName, cleanup)
+    except Exception as e:
+        logging.exception("Failed to process %s", fileName)
+        record["status"] = "failed"
+        record["error"] = "{}: {}".format(type(e).__name__, e)
+    record["time"] = round(time.time() - t0, 2)
+    if tool_cache is not None:
+        record["tool_cache"] = tool_cache.stats
+    if profiler is not None:
+        profiler.write(profileFileName(fileName), structure=fileName, status=record["status"], time=record["time"])
+    
+    return record
+
+def profileFileName(fileName):
+    return ospj(ARGS.profile_dir, "{}.profile.json".format(os.path.basename(fileName)))
+
+def readManifest(file_name):
+    """Latest manifest record of every structure"""
+    records = {}
+    if os.path.exists(file_name):
+        for line in open(file_name):
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records[record["structure"]] = record
+    
+    return records
+
+def failedRecord(fileName, error):
+    """Manifest record of a structure whose worker process did not return a result"""
+    return {"structure": fileName, "status": "failed", "data_file": None, "error": error, "time": None}
+
+def threadScheduler(context=None):
+    return ThreadScheduler(C.get("NUM_THREADS"), max_per_job=C.get("THREADS_PER_JOB"), context=context)
+
+def startWorkers(num_workers):
+    """A pool of worker processes with their own thread budget. Workers are started fresh (rather
+    than forked) so that they can be replaced after a number of tasks."""
+    context = multiprocessing.get_context("spawn")
+    kwargs = {}
+    if sys.version_info >= (3, 11):
+        # replacing workers after a few structures bounds memory growth, while the objects set up
+        # by initWorker are reused for the structures in between
+        kwargs["max_tasks_per_child"] = C.get("WORKER_MAX_TASKS", 10)
+    
+    return ProcessPoolExecutor(num_workers, mp_context=context, initializer=initWorker, initargs=(threadScheduler(context),), **kwargs)
+
+def processStructures(next_structure, num_workers):
+    """Process structures in `num_workers` worker processes, taking the next one from
+    `next_structure()` (None when there is none left) whenever a worker is free. Yields a manifest
+    record as each structure finishes.
+    
+    A worker which dies without returning (killed by the OOM killer, a crash in an external tool
+    binding) breaks the pool. The structures running at that point are then rerun one at a time so
+    that only the one which crashed is recorded as failed, and a new pool takes over the rest."""
+    running = {} # future -> structure
+    suspects = []
+    executor = None
+    try:
+        while True:
+            if suspects:
+                # rerun the structures a dead worker may have been processing in isolation
+                fileName = suspects.pop(0)
+                with startWorkers(1) as isolated:
+                    try:
+                        record = isolated.submit(runStructure, fileName).result()
+                    except BrokenProcessPool:
+                        record = failedRecord(fileName, "worker process died")
+                yield record
+                continue
             
-            # Compute pocket features
-            Xp, features_p = geobind.mesh.getPockets(protein, mesh, radius_big=3.0)
-            FEATURE_NAMES += features_p
-            FEATURES.append(Xp)
+            while len(running) < num_workers:
+                fileName = next_structure()
+                if fileName is None:
+                    break
+                if executor is None:
+                    executor = startWorkers(num_workers)
+                running[executor.submit(runStructure, fileName)] = fileName
+            if not running:
+                return
             
-            # Compute Electrostatic features
-            if not ARGS.no_electrostatics:
-                # get the potential files
-                potfile = ospj(C["ELECTROSTATICS_PATH"], protein_id+"_potential.dx")
-                accessfile = ospj(C["ELECTROSTATICS_PATH"], protein_id+"_access.dx")
-                if (not ARGS.refresh) and os.path.exists(potfile) and os.path.exists(accessfile):
-                    phi = Interpolator(potfile)
-                    logging.info("Loaded potential %s from file.", potfile)
-                    acc = Interpolator(accessfile)
-                    logging.info("Loaded accessibility %s from file.", accessfile)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                fileName = running.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    suspects.append(fileName)
+                except Exception as e:
+                    yield failedRecord(fileName, "{}: {}".format(type(e).__name__, e))
+            if broken:
+                # every structure still running has been lost with the pool
+                suspects += running.values()
+                running = {}
+                executor.shutdown(wait=True)
+                executor = None
+                if len(suspects) == 1:
+                    yield failedRecord(suspects.pop(), "worker process died")
                 else:
-                    phi, acc = geobind.structure.runAPBS(protein, protein_id, pqr=pqr, basedir=C["ELECTROSTATICS_PATH"])
-                
-                Xe, features_e = geobind.mesh.mapElectrostaticPotentialToMesh(mesh, phi, acc, efield=True, diff_method='five_point_stencil')
-                FEATURE_NAMES += features_e
-                FEATURES.append(Xe)
-            
-        ### LABELS #############################################################################
-        update_labels = (not ARGS.no_labels) and (ARGS.refresh or (label_names not in arrays))
-        if update_labels:
-            # Compute labels
-            logging.info("Computing a new set of labels for %s" , protein_id)
-            Y = geobind.assignMeshLabelsFromStructure(lig, mesh, atom_mapper,
-                smooth=C["SMOOTH_LABELS"],
-                mask=C["MASK_LABELS"],
-                distance_cutoff=C["MESH_DISTANCE_CUTOFF"],
-                mask_cutoff=C.get("MASK_DISTANCE_CUTOFF", 0)
-            )
-        
-        ### OUTPUT #############################################################################
-        # Write features to disk
+                    logging.warning("A worker process died, rerunning %d structures one at a time to find which", len(suspects))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
 
-        # Vertex features
-        if update_features:
-            FEATURES = [x.reshape(-1, 1) if x.ndim == 1 else x for x in FEATURES]
-            arrays['X'] = np.concatenate(FEATURES, axis=1)
-            arrays['feature_names'] = np.array(FEATURE_NAMES)
-        
-        # Mesh labels
-        if update_labels:
-            arrays[label_names] = Y
-            arrays['{}_classes'.format(label_names)] = atom_mapper.classes
-        
-        # Write mesh data to disk
-        np.savez_compressed(fname, **arrays)
-        logging.info("Saved mesh data to disk: %s", fname)
-        PROCESSED.write("{}_data.npz\n".format(protein_id))
-        
-        # Write mesh adjacency to disk
-        if not ARGS.no_adjacency:
-            fname = ospj(C['FEATURE_DATA_PATH'], "{}_adj.npz".format(protein_id))
-            save_npz(fname, mesh.vertex_adjacency_matrix)
-            logging.info("Saved adjacency data to disk: %s", fname)
+def claimStructures(work_queue, structures, num_workers):
+    """Claim structures from the shared work queue and process them, at most `num_workers` at a
+    time. Yields a manifest record as each structure finishes, including structures whose worker
+    died, so that their claims are given up. Structures claimed by other processes are waited for
+    until they finish or their claims go stale and can be taken over."""
+    claim = lambda: work_queue.claim(structures)
+    while True:
+        if num_workers > 1:
+            yield from processStructures(claim, num_workers)
+        else:
+            for fileName in iter(claim, None):
+                yield runStructure(fileName)
+        if work_queue.remaining(structures):
+            time.sleep(min(ARGS.lease_time/4, 30))
+        else:
+            return
+
+def replaceFile(file_name, lines):
+    """Write lines to a file which other processes may be reading or writing at the same time"""
+    tmp = "{}.{}.{}.tmp".format(file_name, socket.gethostname(), os.getpid())
+    with open(tmp, "w") as FH:
+        FH.writelines(lines)
+    os.replace(tmp, file_name)
+
+def main():
+    ### Load the interface file which describes a list of DNA-protein interfaces to process ########
+    structures = []
+    for fileName in open(ARGS.structures_file):
+        fileName = fileName.strip()
+        if(fileName == '' or fileName[0] == '#'):
+            # skip blank and commented lines
+            continue
+        structures.append(fileName)
+    
+    # Skip structures the manifest records as completed with the same configuration, unless
+    # stages are being recomputed
+    manifest_file = ARGS.manifest if ARGS.manifest else "{}.manifest".format(ARGS.output_file)
+    # only the options which change the results identify the configuration, so that runs with e.g.
+    # --refresh or a different output file still recognize completed structures
+    result_args = ("no_electrostatics", "no_labels", "no_features", "no_adjacency", "moieties_file", "ligand_list", "ligand_list_name")
+    run_args = {k: getattr(ARGS, k) for k in result_args}
+    # neither do the thread budget, worker recycling, cache locations or validation output
+    runtime_options = ("NUM_THREADS", "THREADS_PER_JOB", "WORKER_MAX_TASKS", "OVERLAP_TOOLS", "TOOL_CACHE_PATH",
+        "TOOL_CACHE_MAX_GB", "STAGE_CACHE_PATH", "MESH_SIDECAR", "SESA_VALIDATE", "ROOT_DIR")
+    result_config = {k: v for k, v in C.items() if k not in runtime_options}
+    config_hash = hashlib.sha1(json.dumps([result_config, run_args], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    completed = {}
+    if not (ARGS.refresh or ARGS.refresh_stages):
+        for s, record in readManifest(manifest_file).items():
+            if record["status"] == "ok" and record.get("config") == config_hash and os.path.exists(ospj(C['FEATURE_DATA_PATH'], record["data_file"])):
+                completed[s] = record
+    todo = [s for s in structures if s not in completed]
+    
+    work_queue = None
+    if ARGS.queue_dir:
+        # Processes sharing the queue claim structures one at a time. Every finished structure is
+        # recorded in its own file in the queue, the data file list and manifest are written at the
+        # end. Only the options which change the results must agree, nodes can differ in e.g. their
+        # thread budget or cache locations.
+        work_queue = WorkQueue(ARGS.queue_dir, lease_time=ARGS.lease_time)
+        work_queue.checkConfig(config_hash)
+        todo = work_queue.remaining(todo)
+    logging.info("%d structures to process, %d already completed", len(todo), len(structures) - len(todo))
+    
+    if work_queue is None:
+        # Data files are listed as soon as they are written
+        PROCESSED = open(ARGS.output_file, "w")
+        for s in structures:
+            if s in completed:
+                PROCESSED.write("{}\n".format(completed[s]["data_file"]))
+        PROCESSED.flush()
+        MANIFEST = open(manifest_file, "a")
+    if ARGS.profile_dir:
+        os.makedirs(ARGS.profile_dir, exist_ok=True)
+    
+    # The thread budget for external tools is shared by all workers
+    num_workers = min(ARGS.num_workers or availableCores(), max(len(todo), 1))
+    
+    if num_workers == 1:
+        initWorker(threadScheduler())
+    
+    # with several workers the structures are run in separate processes, so a structure which
+    # crashes its worker is recorded as failed without affecting the others
+    if work_queue is not None:
+        work_queue.start()
+        results = claimStructures(work_queue, todo, num_workers)
+    elif num_workers > 1:
+        pending = iter(todo)
+        results = processStructures(lambda: next(pending, None), num_workers)
+    else:
+        results = map(runStructure, todo)
+    
+    num_processed = 0
+    num_failed = 0
+    tool_stats = {}
+    for record in results:
+        record["config"] = config_hash
+        for tool, counts in record.get("tool_cache", {}).items():
+            tool_stats.setdefault(tool, {"hits": 0, "misses": 0})
+            tool_stats[tool]["hits"] += counts["hits"]
+            tool_stats[tool]["misses"] += counts["misses"]
+        num_processed += 1
+        if work_queue is not None:
+            work_queue.complete(record["structure"], record, failed=(record["status"] != "ok"))
+        else:
+            MANIFEST.write(json.dumps(record) + "\n")
+            MANIFEST.flush()
+            if record["status"] == "ok":
+                PROCESSED.write("{}\n".format(record["data_file"]))
+                PROCESSED.flush()
+        if record["status"] != "ok":
+            num_failed += 1
+            logging.error("%s failed: %s", record["structure"], record["error"])
+    
+    if work_queue is not None:
+        work_queue.stop()
         
-        ### CLEAN-UP ###########################################################################
-        os.remove(pdb)
-        os.remove(pqr)
+        # Every process rewrites the data file list and manifest when it runs out of work, the last
+        # one to finish lists every structure
+        records = readManifest(manifest_file)
+        records.update({r["structure"]: r for r in work_queue.records()})
+        replaceFile(ARGS.output_file, ["{}\n".format(records[s]["data_file"]) for s in structures if s in records and records[s]["status"] == "ok"])
+        replaceFile(manifest_file, [json.dumps(r) + "\n" for r in records.values()])
+    else:
+        PROCESSED.close()
+        MANIFEST.close()
+    logging.info("Processed %d structures, %d failed", num_processed - num_failed, num_failed)
+    for tool in sorted(tool_stats):
+        logging.info("Tool cache %s: %d hits, %d misses", tool, tool_stats[tool]["hits"], tool_stats[tool]["misses"])
+    
+    # Summarize the profiles of this run, listing the slowest structures to spot pathological inputs
+    if ARGS.profile_dir:
+        profiles = [json.load(open(profileFileName(s))) for s in todo if os.path.exists(profileFileName(s))]
+        summary = formatProfileSummary(summarizeProfiles(profiles))
+        summary += "\n\nslowest structures\n"
+        for profile in sorted(profiles, key=lambda p: -p["time"])[:10]:
+            atoms = max([r.get("atoms", 0) for r in profile["records"]] + [0])
+            vertices = max([r.get("vertices", 0) for r in profile["records"]] + [0])
+            summary += "{:<40s} {:>10.2f} s {:>8d} atoms {:>9d} vertices {}\n".format(profile["structure"], profile["time"], atoms, vertices, profile["status"])
+        replaceFile(ospj(ARGS.profile_dir, "summary.txt"), [summary])
+        logging.info("Profile summary:\n%s", summary)
     
-    PROCESSED.close()
-    return 0
+    return int(num_failed > 0)
+
 
 ### Load the config file
 with open(ARGS.config_file) as FH:
@@ -273,7 +771,10 @@ C['ROOT_DIR'] = file_path.parent.parent
 ### Set up logging
 log_level = logging.INFO
 log_format = '%(levelname)s:    %(message)s'
-logging.basicConfig(format=log_format, filename='run.log', level=log_level)
+# processes may share a directory in queue mode, workers log to the file of the process which started them
+log_pid = os.getpid() if __name__ == '__main__' else os.getppid()
+log_file = 'run.log' if not ARGS.queue_dir else 'run.{}.{}.log'.format(socket.gethostname(), log_pid)
+logging.basicConfig(format=log_format, filename=log_file, level=log_level)
 
 console = logging.StreamHandler()
 console.setLevel(log_level)
@@ -282,4 +783,4 @@ console.setFormatter(formatter)
 logging.getLogger('').addHandler(console)
 
 if __name__ == '__main__':
-    main()
+    exit(main())
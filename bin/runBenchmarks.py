@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+# command line args
+import argparse
+PARSER = argparse.ArgumentParser(description="Time the feature, labelling, layer and data loading code "
+        "on synthetic proteins, meshes and potential grids of several sizes, and compare the timings "
+        "against a stored baseline. No external programs are needed.")
+PARSER.add_argument("--benchmarks", dest='benchmarks', nargs='+', default=None,
+        help="Benchmarks to run, defaults to all of them.")
+PARSER.add_argument("--scales", dest='scales', nargs='+', default=["small", "medium"],
+        help="Sizes of the synthetic proteins to run on, any of: small (100 residues), medium (500) "
+        "and large (2000). The synthetic data of a scale does not depend on the other scales run.")
+PARSER.add_argument("--mesh_type", dest='mesh_type', default="surface", choices=["surface", "icosphere"],
+        help="Build synthetic meshes as the marching cubes surface of the synthetic atoms or as "
+        "bumpy icospheres enclosing them.")
+PARSER.add_argument("--grid_scale", dest='grid_scale', type=float, default=1.0,
+        help="Grid points per angstrom used to build surface meshes.")
+PARSER.add_argument("--repeats", dest='repeats', type=int, default=3,
+        help="Number of timed repetitions of every benchmark, the median is reported.")
+PARSER.add_argument("--warmup", dest='warmup', type=int, default=1,
+        help="Number of untimed runs before the timed ones.")
+PARSER.add_argument("--num_files", dest='num_files', type=int, default=8,
+        help="Number of data files read by the dataset loading benchmark.")
+PARSER.add_argument("--seed", dest='seed', type=int, default=0,
+        help="Random seed of the synthetic data.")
+PARSER.add_argument("--output_file", dest='output_file', default=None,
+        help="Write the results to this file in JSON format. It can be used as a baseline later.")
+PARSER.add_argument("--baseline", dest='baseline', default=None,
+        help="Compare against results previously written with --output_file. Exits with a non-zero "
+        "status if any benchmark regressed.")
+PARSER.add_argument("--threshold", dest='threshold', type=float, default=0.2,
+        help="Relative slow-down over the baseline counted as a regression.")
+PARSER.add_argument("--min_time", dest='min_time', type=float, default=0.01,
+        help="Slow-downs of less than this many seconds are not counted as regressions.")
+PARSER.add_argument("--work_dir", dest='work_dir', default=None,
+        help="Directory for the synthetic grid and data files, defaults to a temporary directory.")
+ARGS = PARSER.parse_args()
+
+# builtin modules
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+# third party modules
+import numpy as np
+import scipy
+import torch
+import trimesh
+from scipy.spatial import cKDTree
+from Bio.PDB.Structure import Structure
+from Bio.PDB.Model import Model
+from Bio.PDB.Chain import Chain
+from Bio.PDB.Residue import Residue
+from Bio.PDB.Atom import Atom
+from gridData import Grid
+from torch_geometric.data import Data
+from torch_geometric.transforms import FaceToEdge
+
+# geobind modules
+import geobind
+from geobind.mesh import Mesh, buildSurfaceMesh
+from geobind.structure import StructureData
+from geobind.utils import Interpolator
+from geobind.nn.layers import MeshPooling, ContinuousCRF
+from geobind.nn.utils import loadDataset
+
+SCALES = {
+    "small": 100,
+    "medium": 500,
+    "large": 2000
+}
+
+# bond lengths of the atoms placed around CA (O is bonded to C) and atom radii by element
+BONDS = [("N", 1.46), ("C", 1.52), ("O", 1.23), ("CB", 1.53)]
+RADII = {"C": 1.70, "N": 1.55, "O": 1.52}
+
+def randomDirections(rng, n):
+    u = rng.normal(size=(n, 3))
+
+    return u/np.linalg.norm(u, axis=1, keepdims=True)
+
+def syntheticStructure(num_residues, rng, density=0.05):
+    """A globular protein of ALA and GLY residues with atoms packed at roughly the density of heavy
+    atoms in proteins (per cubic angstrom). Atom radii and charges are stored in atom.xtra."""
+    num_atoms = 4.8*num_residues
+    R = (3*num_atoms/(4*np.pi*density))**(1/3)
+
+    # residue centers uniformly distributed in a ball
+    CA = randomDirections(rng, num_residues)*R*rng.uniform(size=(num_residues, 1))**(1/3)
+
+    model = Model(0)
+    chain = Chain("A")
+    model.add(chain)
+    serial = 1
+    for i in range(num_residues):
+        resn = "GLY" if rng.uniform() < 0.2 else "ALA"
+        residue = Residue((' ', i+1, ' '), resn, ' ')
+        coords = {"CA": CA[i]}
+        for (name, length), u in zip(BONDS, randomDirections(rng, len(BONDS))):
+            if(name == "CB" and resn == "GLY"):
+                continue
+            parent = coords["C"] if name == "O" else CA[i]
+            coords[name] = parent + length*u
+        for name in ["N", "CA", "C", "O", "CB"]:
+            if(name not in coords):
+                continue
+            atom = Atom(name, coords[name].astype(np.float32), 0.0, 1.0, ' ', " {:<3s}".format(name), serial, element=name[0])
+            atom.xtra["radius"] = RADII[atom.element]
+            atom.xtra["charge"] = rng.normal(scale=0.3)
+            atom.xtra["sesa"] = max(rng.normal(loc=5.0, scale=5.0), 0.0)
+            residue.add(atom)
+            serial += 1
+        chain.add(residue)
+    structure = Structure("synthetic")
+    structure.add(model)
+
+    return StructureData(structure, name="synthetic{}".format(num_residues))
+
+def syntheticMesh(structure, name):
+    atoms = structure.atom_list
+    if(ARGS.mesh_type == "surface"):
+        return buildSurfaceMesh(atoms, name=name, grid_scale=ARGS.grid_scale)
+
+    # a bumpy sphere enclosing the atoms, with about one vertex per square angstrom
+    coords = np.array([a.coord for a in atoms])
+    R = np.linalg.norm(coords - coords.mean(axis=0), axis=1).max() + 2.0
+    subdivisions = int(np.clip(np.round(np.log(4*np.pi*R**2/10)/np.log(4)), 1, 7))
+    sphere = trimesh.creation.icosphere(subdivisions=subdivisions)
+    V = np.array(sphere.vertices)
+    V = coords.mean(axis=0) + V*R*(1 + 0.1*np.sin(3*V[:,[0]])*np.cos(2*V[:,[1]]))
+
+    return Mesh(vertices=V, faces=np.array(sphere.faces), name=name)
+
+def syntheticGrids(structure, prefix, spacing=1.0, pad=10.0):
+    """Write a potential and an accessibility map in DX format on a grid enclosing the structure, as
+    APBS would. The potential is a screened Coulomb potential of the atom charges, the accessibility
+    is 1 outside the solvent accessible surface."""
+    coords = np.array([a.coord for a in structure.get_atoms()], dtype=np.float64)
+    charges = np.array([a.xtra["charge"] for a in structure.get_atoms()])
+    radii = np.array([a.xtra["radius"] for a in structure.get_atoms()])
+    origin = coords.min(axis=0) - pad
+    shape = tuple(np.ceil((coords.max(axis=0) + pad - origin)/spacing).astype(int) + 1)
+    axes = [origin[i] + spacing*np.arange(shape[i]) for i in range(3)]
+    points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    # potential of the nearest atoms within the screening cutoff
+    kappa, cutoff = 1/8.0, 24.0
+    phi = np.zeros(len(points))
+    kdt = cKDTree(coords)
+    for i in range(0, len(points), 100000):
+        d, j = kdt.query(points[i:i+100000], k=32, distance_upper_bound=cutoff)
+        valid = np.isfinite(d)
+        d = np.maximum(d, 1.0)
+        phi[i:i+100000] = np.where(valid, charges[np.minimum(j, len(coords)-1)]*np.exp(-kappa*d)/d, 0.0).sum(axis=1)
+
+    # accessibility, judged by the nearest atom
+    d, j = kdt.query(points, k=1)
+    acc = (d > radii[j] + 1.4).astype(np.float64)
+
+    files = []
+    for name, values in [("potential", phi), ("access", acc)]:
+        fname = "{}_{}.dx".format(prefix, name)
+        Grid(values.reshape(shape), origin=origin, delta=spacing).export(fname, file_format="dx")
+        files.append(fname)
+
+    return files
+
+def syntheticDataFiles(mesh, prefix, rng, num_files, num_features=64):
+    """Write data files in the format of bin/processInterfaces.py with random features and labels"""
+    files = []
+    for i in range(num_files):
+        fname = "{}_{}_data.npz".format(prefix, i)
+        np.savez_compressed(fname,
+            V=mesh.vertices,
+            F=mesh.faces,
+            N=mesh.vertex_normals,
+            X=rng.normal(size=(mesh.num_vertices, num_features)),
+            Y=rng.integers(0, 2, size=mesh.num_vertices),
+            feature_names=np.array(["f{}".format(j) for j in range(num_features)]),
+            name=os.path.basename(prefix)
+        )
+        files.append(os.path.basename(fname))
+
+    return files
+
+def meshData(mesh, num_features=32):
+    data = Data(
+        pos=torch.tensor(mesh.vertices, dtype=torch.float32),
+        face=torch.tensor(mesh.faces.T, dtype=torch.int64)
+    )
+    data = FaceToEdge(remove_faces=False)(data)
+    data.x = torch.randn(mesh.num_vertices, num_features)
+    data.batch = torch.zeros(mesh.num_vertices, dtype=torch.int64)
+
+    return data
+
+def clearSpectra(case):
+    for key in [k for k in case["mesh"].cache if k.startswith("laplace_beltrami")]:
+        del case["mesh"].cache[key]
+
+# benchmark name: (function run on a test case, function run before every repetition)
+BENCHMARKS = {
+    "getCV": (
+        lambda case: geobind.structure.getCV(case["structure"], 10.0, hydrogens=False),
+        None
+    ),
+    "getSAP": (
+        lambda case: geobind.structure.getSAP(case["structure"], distance=5.0, area_key="sesa", hydrogens=False),
+        None
+    ),
+    "mapPointFeaturesToMesh": (
+        lambda case: geobind.mesh.mapPointFeaturesToMesh(case["mesh"], case["coords"], case["atom_features"], distance_cutoff=3.0),
+        None
+    ),
+    "assignMeshLabelsFromStructure": (
+        lambda case: geobind.assignMeshLabelsFromStructure(case["structure"], case["mesh"], case["atom_mapper"], distance_cutoff=4.0),
+        None
+    ),
+    "getHKS": (
+        lambda case: geobind.mesh.getHKS(case["mesh"]),
+        clearSpectra
+    ),
+    "mapElectrostaticPotentialToMesh": (
+        lambda case: geobind.mesh.mapElectrostaticPotentialToMesh(case["mesh"], case["phi"], case["acc"], efield=True, diff_method='five_point_stencil'),
+        None
+    ),
+    "MeshPooling": (
+        lambda case: case["pool"](case["data"].x, case["data"]),
+        None
+    ),
+    "ContinuousCRF": (
+        lambda case: case["crf"](case["crf_x"], case["data"].edge_index),
+        None
+    ),
+    "loadDataset": (
+        lambda case: loadDataset(case["data_files"], 2, "Y", case["work_dir"]),
+        None
+    )
+}
+
+def makeCase(scale, work_dir):
+    """Build the synthetic inputs of every benchmark for one scale"""
+    rng = np.random.default_rng([ARGS.seed, list(SCALES).index(scale)])
+    structure = syntheticStructure(SCALES[scale], rng)
+    mesh = syntheticMesh(structure, "{}_mesh".format(structure.name))
+    prefix = os.path.join(work_dir, structure.name)
+    potfile, accessfile = syntheticGrids(structure, prefix)
+    data = meshData(mesh)
+    torch.manual_seed(ARGS.seed)
+    case = {
+        "structure": structure,
+        "mesh": mesh,
+        "coords": np.array([a.coord for a in structure.atom_list], dtype=np.float64),
+        "atom_features": rng.normal(size=(len(structure.atom_list), 16)),
+        "atom_mapper": geobind.AtomToClassMapper(["GLY"], default=0),
+        "phi": Interpolator(potfile),
+        "acc": Interpolator(accessfile),
+        "data": data,
+        "pool": MeshPooling(data.x.size(1), 0, alpha=None),
+        "crf": ContinuousCRF(),
+        "crf_x": torch.softmax(torch.randn(mesh.num_vertices, 2), dim=1),
+        "data_files": syntheticDataFiles(mesh, prefix, rng, ARGS.num_files),
+        "work_dir": work_dir
+    }
+
+    # build cached spatial indices up front so they are not part of the first timing
+    structure.atom_KDTree
+    mesh.vertex_kdtree
+
+    return case
+
+def timeBenchmark(fn, setup, case):
+    times = []
+    with torch.no_grad():
+        for i in range(ARGS.warmup + ARGS.repeats):
+            if(setup):
+                setup(case)
+            t0 = time.perf_counter()
+            fn(case)
+            t = time.perf_counter() - t0
+            if(i >= ARGS.warmup):
+                times.append(t)
+
+    return times
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads()
+    }
+
+def compareToBaseline(results, baseline):
+    """Print the change of every benchmark relative to the baseline. Returns the regressed ones."""
+    reference = {(r["benchmark"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    print("\n{:<34s} {:<8s} {:>10s} {:>10s} {:>8s}".format("benchmark", "scale", "base (s)", "time (s)", "ratio"))
+    for r in results:
+        b = reference.get((r["benchmark"], r["scale"]))
+        if(b is None):
+            print("{:<34s} {:<8s} {:>10s} {:>10.4f} {:>8s}".format(r["benchmark"], r["scale"], "-", r["median"], "new"))
+            continue
+        ratio = r["median"]/max(b["median"], 1e-12)
+        status = ""
+        if(ratio > 1 + ARGS.threshold and r["median"] - b["median"] > ARGS.min_time):
+            status = "REGRESSION"
+            regressions.append(r)
+        elif(ratio < 1/(1 + ARGS.threshold)):
+            status = "faster"
+        print("{:<34s} {:<8s} {:>10.4f} {:>10.4f} {:>8.2f} {}".format(r["benchmark"], r["scale"], b["median"], r["median"], ratio, status))
+    env = dict(environment(), commit=None)
+    if(dict(baseline["info"]["environment"], commit=None) != env):
+        print("Warning: the baseline was recorded in a different environment, timings may not be comparable.")
+
+    return regressions
+
+# check arguments
+benchmarks = ARGS.benchmarks or list(BENCHMARKS.keys())
+for name in benchmarks:
+    if(name not in BENCHMARKS):
+        raise ValueError("Unknown benchmark: {}".format(name))
+for scale in ARGS.scales:
+    if(scale not in SCALES):
+        raise ValueError("Unknown scale: {}".format(scale))
+
+work_dir = ARGS.work_dir or tempfile.mkdtemp(prefix="geobind_benchmarks_")
+os.makedirs(work_dir, exist_ok=True)
+
+results = []
+try:
+    for scale in ARGS.scales:
+        case = makeCase(scale, work_dir)
+        print("{} ({} atoms, {} vertices)".format(scale, len(case["structure"].atom_list), case["mesh"].num_vertices))
+        for name in benchmarks:
+            fn, setup = BENCHMARKS[name]
+            times = timeBenchmark(fn, setup, case)
+            print("  {:<34s} {:>8.4f}s".format(name, np.median(times)))
+            results.append({
+                "benchmark": name,
+                "scale": scale,
+                "num_atoms": len(case["structure"].atom_list),
+                "num_vertices": case["mesh"].num_vertices,
+                "times": times,
+                "median": float(np.median(times)),
+                "min": float(np.min(times))
+            })
+finally:
+    if(ARGS.work_dir is None):
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+info = {
+    "environment": environment(),
+    "arguments": {k: v for k, v in vars(ARGS).items() if k not in ("output_file", "baseline", "work_dir")}
+}
+if(ARGS.output_file):
+    with open(ARGS.output_file, "w") as FH:
+        json.dump({"info": info, "results": results}, FH, indent=2)
+
+if(ARGS.baseline):
+    with open(ARGS.baseline) as FH:
+        baseline = json.load(FH)
+    regressions = compareToBaseline(results, baseline)
+    if(regressions):
+        print("{} benchmark(s) are more than {:.0%} slower than the baseline.".format(len(regressions), ARGS.threshold))
+        sys.exit(1)
@@ -10,7 +10,7 @@ from pickle import load
 # third party packages
 import torch
 import numpy as np
-from torch_geometric.transforms import Compose, FaceToEdge
+from torch_geometric.transforms import Compose
 from torch_geometric.data import DataLoader
 
 # geobind packages
@@ -61,7 +61,8 @@ dataset, transforms, info = loadDataset(datafiles, C["nc"], C["labels_key"], C["
         balance=C.get("balance", ARGS.balance),
         remove_mask=remove_mask,
         scale=True,
-        pre_transform=Compose([FaceToEdge(remove_faces=False), GeometricEdgeFeatures(), ScaleEdgeFeatures(method=C["model"]["kwargs"].get("scale_edge_features", None))])
+        feature_columns=C.get("feature_columns", None),
+        pre_transform=Compose([GeometricEdgeFeatures(skip_precomputed=True), ScaleEdgeFeatures(method=C["model"]["kwargs"].get("scale_edge_features", None))])
     )
 
 # prepate data for CPU
@@ -148,12 +148,13 @@ train_datafiles = [_.strip() for _ in open(ARGS.train_file).readlines()]
 valid_datafiles = [_.strip() for _ in open(ARGS.valid_file).readlines()]
 
 remove_mask = (C["balance"] == 'all')
-transform = Compose([GeometricEdgeFeatures(), ScaleEdgeFeatures(method=C["model"]["kwargs"].get("scale_edge_features", None))])
+transform = Compose([GeometricEdgeFeatures(skip_precomputed=True), ScaleEdgeFeatures(method=C["model"]["kwargs"].get("scale_edge_features", None))])
 train_dataset, transforms, train_info = loadDataset(train_datafiles, C["nc"], C["labels_key"], C["data_dir"],
         cache_dataset=C.get("cache_dataset", False),
         balance=C["balance"],
         remove_mask=remove_mask,
         scale=True,
+        feature_columns=C.get("feature_columns", None),
         pre_transform=transform
     )
 valid_dataset, _, valid_info = loadDataset(valid_datafiles, C["nc"], C["labels_key"], C["data_dir"],
@@ -161,6 +162,7 @@ valid_dataset, _, valid_info = loadDataset(valid_datafiles, C["nc"], C["labels_k
         balance='unmasked',
         remove_mask=False,
         scale=True,
+        feature_columns=C.get("feature_columns", None),
         **transforms
     )
 
@@ -288,7 +290,7 @@ if C["write"] and C["write_test_predictions"]:
     
     val_out = evaluator.eval(DL_vl, use_masks=False, batchwise=True, return_masks=True, return_predicted=True, return_batches=True, xtras=['pos', 'face'], threshold=threshold)
     for i in range(val_out['num_batches']):
-        name = valid_datafiles[i].replace("_protein_data.npz", "")
+        name = valid_datafiles[i].replace("_protein_data.npz", "").replace("_protein_data.store", "")
         
         # compute metrics
         y, prob, mask = val_out['y'][i], val_out['output'][i], val_out['masks'][i]
@@ -13,6 +13,8 @@ PARSER.add_argument("--smooth", action='store_true',
         help="Turn on smooth shading")
 PARSER.add_argument("--point_cloud", action='store_true',
         help="Render Point Clouds")
+PARSER.add_argument("--mesh_file", dest='mesh_file', default=None,
+        help="Load vertices and faces from a binary mesh file (.bmesh) instead of the data file.")
 ARGS = PARSER.parse_args()
 
 # builtin modules
@@ -127,15 +129,26 @@ def getDataFields(data, key_name=None):
     
     return feature_list
 
-# Read in data files
-data = np.load(ARGS.data_file, allow_pickle=True)
+# Read in data files, undoing any reduced storage precision
+from geobind.utils import FeatureStore, decodeArrays
+if FeatureStore.isStore(ARGS.data_file):
+    data = decodeArrays(FeatureStore(ARGS.data_file))
+else:
+    data = decodeArrays(np.load(ARGS.data_file, allow_pickle=True))
+data = {key: (value.astype(np.int64) if value.dtype == np.int32 else value) for key, value in data.items()}
 if ARGS.extras_file:
     extras = np.load(ARGS.extras_file, allow_pickle=True)
 
+if ARGS.mesh_file:
+    from geobind.mesh.mesh_io import readBinaryMesh
+    V, F, _, _ = readBinaryMesh(ARGS.mesh_file)
+else:
+    V, F = data['V'], data['F']
+
 if ARGS.point_cloud:
-    mesh = trimesh.PointCloud(vertices=data['V'], process=False)
+    mesh = trimesh.PointCloud(vertices=V, process=False)
 else:
-    mesh = trimesh.Trimesh(vertices=data['V'], faces=data['F'], process=False)
+    mesh = trimesh.Trimesh(vertices=V, faces=F, process=False)
 
 # list of features in data file
 feature_list = ""
@@ -2,6 +2,8 @@ from .mesh import Mesh
 from .generate_mesh import generateMesh
 from .run_msms import runMSMS
 from .run_nanoshaper import runNanoShaper
+from .build_surface_mesh import buildSurfaceMesh, estimateSurfaceArea
+from .decimate_mesh import decimateMesh
 from .get_pockets import getPockets
 from .map_point_features_to_mesh import mapPointFeaturesToMesh
 from .get_geometric_edge_features import getGeometricEdgeFeatures
@@ -11,12 +13,16 @@ from .get_mesh_curvature import getMeshCurvature
 from .get_convex_hull_distance import getConvexHullDistance
 from .get_hks import getHKS
 from .smooth_mesh_labels import smoothMeshLabels
+from .mesh_hierarchy import getMeshHierarchy
 
 __all__ = [
     "Mesh",
     "generateMesh",
     "runMSMS",
     "runNanoShaper",
+    "buildSurfaceMesh",
+    "estimateSurfaceArea",
+    "decimateMesh",
     "getPockets",
     "mapPointFeaturesToMesh",
     "getGeometricEdgeFeatures",
@@ -25,5 +31,6 @@ __all__ = [
     "getMeshCurvature",
     "getConvexHullDistance",
     "getHKS",
-    "smoothMeshLabels"
+    "smoothMeshLabels",
+    "getMeshHierarchy"
 ]
@@ -0,0 +1,123 @@
+# third party modules
+import numpy as np
+import trimesh
+from scipy.ndimage import distance_transform_edt
+
+# geobind modules
+from .mesh import Mesh
+from .decimate_mesh import decimateMesh
+
+def getAtomCoordsRadii(atoms, hydrogens=True):
+    """Return arrays of atom coordinates and radii (taken from atom.xtra['radius'])"""
+    if(not isinstance(atoms, list)):
+        atoms = atoms.get_atoms()
+    coords = []
+    radii = []
+    for atom in atoms:
+        if((not hydrogens) and atom.element == "H"):
+            continue
+        coords.append(atom.get_coord())
+        radii.append(atom.xtra["radius"])
+
+    return np.array(coords, dtype=np.float64), np.array(radii, dtype=np.float64)
+
+def atomNeighborhoods(coords, cutoffs, origin, spacing, shape, max_entries=2000000):
+    """Iterate over chunks of atoms, yielding the flat grid indices of every grid point within
+    `cutoffs` of each atom, the index of that atom and the squared distance. Only grid points
+    near atoms are ever visited."""
+    m = int(np.ceil(cutoffs.max()/spacing))
+    r = np.arange(-m, m+1)
+    offsets = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape(-1, 3) # [K, 3]
+    chunk = max(1, max_entries//len(offsets))
+
+    for i in range(0, len(coords), chunk):
+        c = coords[i:i+chunk]
+        idx = np.round((c - origin)/spacing).astype(np.int64)[:,np.newaxis] + offsets # [C, K, 3]
+        d2 = ((origin + idx*spacing - c[:,np.newaxis])**2).sum(axis=2) # [C, K]
+        mask = d2 < (cutoffs[i:i+chunk, np.newaxis]**2)
+
+        atom_idx = np.broadcast_to(np.arange(i, i+len(c))[:,np.newaxis], mask.shape)[mask]
+        flat = np.ravel_multi_index(tuple(idx[mask].T), shape)
+
+        yield flat, atom_idx, d2[mask]
+
+def gridBounds(coords, pad, spacing):
+    """Origin and shape of a grid with the given spacing enclosing `coords` padded by `pad`"""
+    origin = coords.min(axis=0) - pad - 2*spacing
+    shape = tuple(np.ceil((coords.max(axis=0) + pad + 2*spacing - origin)/spacing).astype(np.int64) + 1)
+
+    return origin, shape
+
+def sesDepth(coords, radii, probe_radius, spacing):
+    """Distance from every grid point inside the solvent accessible volume to the solvent. The
+    solvent excluded surface is the `probe_radius` level set of this field."""
+    cutoffs = radii + probe_radius
+    origin, shape = gridBounds(coords, cutoffs.max(), spacing)
+    sas = np.zeros(int(np.prod(shape)), dtype=bool)
+    for flat, ai, d2 in atomNeighborhoods(coords, cutoffs, origin, spacing, shape):
+        sas[flat] = True
+
+    return distance_transform_edt(sas.reshape(shape))*spacing, origin
+
+def estimateSurfaceArea(atoms, probe_radius=1.4, grid_scale=1.0, hydrogens=True):
+    """Cheaply estimate the solvent excluded surface area from a coarse voxelization. The number of
+    exposed voxel faces over-counts the area of a randomly oriented surface by a factor of about
+    3/2, calibrated against 'ses' meshes from `buildSurfaceMesh` at a grid scale of 2 the factor is
+    1.53 (within 2% on five proteins)."""
+    coords, radii = getAtomCoordsRadii(atoms, hydrogens=hydrogens)
+    spacing = 1.0/grid_scale
+    ses = sesDepth(coords, radii, probe_radius, spacing)[0] > probe_radius
+    num_faces = sum(np.count_nonzero(np.diff(ses, axis=i)) for i in range(3))
+
+    return num_faces*spacing*spacing/1.53
+
+def buildSurfaceMesh(atoms, name="mesh", grid_scale=2.0, surface_type="gaussian", hydrogens=True,
+        blobbyness=-2.5, isovalue=1.0, probe_radius=1.4, smooth_iterations=0, target_faces=None,
+        mesh_kwargs={}, **kwargs
+    ):
+    """Build a molecular surface mesh in-process, without calling an external program.
+
+    A scalar field is computed on a grid with `grid_scale` points per angstrom and triangulated
+    with marching cubes. `surface_type` selects the field:
+        'gaussian' - sum of atomic Gaussians exp(B*(d^2/r^2 - 1)) with B = `blobbyness`, the
+                     surface being the `isovalue` level set
+        'ses'      - solvent excluded surface, obtained by eroding the solvent accessible volume
+                     by `probe_radius` with a Euclidean distance transform
+    The mesh can optionally be Taubin smoothed and decimated to `target_faces` faces. Any extra
+    keyword arguments (e.g. NanoShaper options passed through `generateMesh`) are ignored.
+    """
+    from skimage.measure import marching_cubes
+
+    coords, radii = getAtomCoordsRadii(atoms, hydrogens=hydrogens)
+    spacing = 1.0/grid_scale
+
+    # compute the scalar field
+    if(surface_type == "gaussian"):
+        cutoffs = radii*np.sqrt(1 + np.log(1e-4)/blobbyness) # where atom densities become negligible
+        origin, shape = gridBounds(coords, cutoffs.max(), spacing)
+        size = int(np.prod(shape))
+        field = np.zeros(size)
+        for flat, ai, d2 in atomNeighborhoods(coords, cutoffs, origin, spacing, shape):
+            field += np.bincount(flat, weights=np.exp(blobbyness*(d2/radii[ai]**2 - 1)), minlength=size)
+        field = field.reshape(shape)
+        level = isovalue
+    elif(surface_type == "ses"):
+        field, origin = sesDepth(coords, radii, probe_radius, spacing)
+        level = probe_radius
+    else:
+        raise ValueError("Unknown value of argument `surface_type`: {}".format(surface_type))
+
+    # triangulate the level set
+    V, F, _, _ = marching_cubes(field, level=level, spacing=(spacing, spacing, spacing))
+    V += origin
+    F = F[:,::-1] # the field increases inwards, flip the winding so normals point outwards
+    mesh = trimesh.Trimesh(vertices=V, faces=F, process=True)
+
+    if(smooth_iterations > 0):
+        trimesh.smoothing.filter_taubin(mesh, iterations=smooth_iterations)
+
+    mesh = Mesh(vertices=np.array(mesh.vertices), faces=np.array(mesh.faces), name=name, **mesh_kwargs)
+    if(target_faces is not None):
+        mesh = decimateMesh(mesh, num_faces=target_faces, **mesh_kwargs)
+
+    return mesh
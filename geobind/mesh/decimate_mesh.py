@@ -0,0 +1,27 @@
+# third party modules
+import numpy as np
+import igl
+
+# geobind modules
+from .mesh import Mesh
+
+def decimateMesh(mesh, num_vertices=None, num_faces=None, name=None, **kwargs):
+    """Reduce a mesh to `num_faces` faces (or about `num_vertices` vertices) using quadric error
+    edge collapses, which preserve sharp features better than collapsing the shortest edges."""
+    if(num_faces is None):
+        if(num_vertices is None):
+            raise ValueError("One of `num_vertices` or `num_faces` must be given.")
+        num_faces = 2*int(num_vertices) - 4 # Euler characteristic of a closed genus zero surface
+    if(name is None):
+        name = getattr(mesh, "name", "mesh")
+    
+    V = np.array(mesh.vertices, dtype=np.float64)
+    F = np.array(mesh.faces, dtype=np.int64)
+    if(num_faces >= len(F)):
+        return Mesh(vertices=V, faces=F, name=name, **kwargs)
+    
+    # the return value of qslim is (U, G, J, I), prefixed by a success flag in older releases
+    result = igl.qslim(V, F, int(num_faces))
+    U, G = result[-4], result[-3]
+    
+    return Mesh(vertices=U, faces=G, name=name, **kwargs)
@@ -1,5 +1,6 @@
 # builtin modules
 import os
+import logging
 
 # third party modules
 import numpy as np
@@ -8,12 +9,62 @@ import numpy as np
 import geobind
 from .run_nanoshaper import runNanoShaper
 from .run_msms import runMSMS
+from .run_edtsurf import runEDTSurf
+from .build_surface_mesh import buildSurfaceMesh, estimateSurfaceArea
+from .decimate_mesh import decimateMesh
 from geobind.structure.structure import StructureData 
+from geobind.utils import tempWorkDir
+
+def setResolution(method, kwargs, area, target_vertices, vertices_per_area, grid_scale_range):
+    """Set the mesher resolution in `kwargs` for `target_vertices` vertices on a surface of the given
+    area. Returns the expected number of vertices, which is lower if the grid scale is clipped."""
+    grid_scale = float(np.clip(np.sqrt(target_vertices/(vertices_per_area*area)), *grid_scale_range))
+    if(method == 'msms'):
+        kwargs['density'] = target_vertices/area
+        return target_vertices
+    elif(method == 'edtsurf'):
+        kwargs['-f'] = "{:.3f}".format(grid_scale)
+    else:
+        kwargs['grid_scale'] = grid_scale
+    
+    return vertices_per_area*area*grid_scale**2
+
+def buildMesh(structure, method, prefix, basedir, clean, hydrogens, quiet, **kwargs):
+    if(method == 'nanoshaper'):
+        # Run NanoShaper
+        mesh = runNanoShaper(structure.atom_list, prefix, basedir, clean=clean, hydrogens=hydrogens, quiet=quiet, **kwargs)
+    elif(method == 'msms'):
+        # Run MSMS
+        mesh = runMSMS(structure.atom_list, prefix, basedir, clean=clean, hydrogens=hydrogens, quiet=quiet, **kwargs)
+    elif(method == 'builtin'):
+        # Build the mesh in-process with marching cubes, nothing is written to disk
+        mesh = buildSurfaceMesh(structure.atom_list, name=prefix, hydrogens=hydrogens, **kwargs)
+    elif(method == 'edtsurf'):
+        # Run EDTSurf on a PDB file written to a private directory
+        with tempWorkDir(prefix="edtsurf_") as wdir:
+            pdbfile = structure.save(os.path.join(wdir, "{}.pdb".format(prefix)))
+            mesh = runEDTSurf(pdbfile, prefix, basedir, clean=clean, quiet=quiet, **kwargs)
+    else:
+        raise ValueError("Unknown value of argument `method`: {}".format(method))
+    
+    return mesh
 
 def generateMesh(structure, 
         prefix=None, basedir=None, clean=True, hydrogens=True, quiet=True, 
-        method='nanoshaper', selection=None, **kwargs
+        method='nanoshaper', selection=None, target_vertices=None, vertex_density=None,
+        decimate=True, grid_scale_range=(0.5, 3.0), vertices_per_area=1.5, remesh_below=0.9, **kwargs
     ):
+    """Generate a molecular surface mesh of a structure using the given `method`.
+    
+    The mesh size can be controlled per structure with `target_vertices` or `vertex_density`
+    (vertices per square angstrom). The surface area is estimated from the atoms and the grid
+    scale (or MSMS density) chosen to hit the target, assuming marching cubes type meshers produce
+    about `vertices_per_area` vertices per square angstrom at a grid scale of 1. The estimate is
+    that of the solvent excluded surface, other surfaces (skin, gaussian) can differ in area by 20%
+    or more, so a mesh with fewer than `remesh_below` times the expected vertices is generated once
+    more at a corrected resolution. If the resulting mesh exceeds the target and `decimate` is set
+    it is reduced with quadric decimation.
+    """
     # Check what we have been given
     if(isinstance(structure, str)):
         # Check if PQR file exists
@@ -24,9 +75,9 @@ def generateMesh(structure,
         if(prefix is None):
             prefix = ".".join(os.path.basename(structure).split('.')[:-1]) # strip the file extension
         structure = StructureData(structure, name=prefix)
-        if(entity_id):
+        if(selection):
             # Choose which part of the structure we want to use to generate a mesh
-            structure = structure.slice(structure, selection)
+            structure = StructureData.slice(structure, selection, name=prefix)
         
         # add charge/radius
         for atom in structure.atom_list:
@@ -48,15 +99,26 @@ def generateMesh(structure,
     if(basedir == '.' or basedir is None):
         basedir = os.getcwd()
     
-    if(method == 'nanoshaper'):
-        # Run NanoShaper
-        mesh = runNanoShaper(structure.atom_list, prefix, basedir, clean=clean, hydrogens=hydrogens, quiet=quiet, **kwargs)
-    elif(method == 'msms'):
-        # Run MSMS
-        mesh = runMSMS(structure.atom_list, prefix, basedir, clean=clean, hydrogens=hydrogens, quiet=quiet, **kwargs)
-    elif(method == 'edtsurf'):
-        # Run EDTSurf
-        pdbfile = structure.save('tmp.pdb')
-        mesh = runEDTSurf(pdbfile, prefix, basedir, clean=clean, quiet=quiet, **kwargs)
+    # choose a mesh resolution which meets the vertex budget
+    if(target_vertices is not None or vertex_density is not None):
+        area = estimateSurfaceArea(structure.atom_list, hydrogens=hydrogens)
+        if(target_vertices is None):
+            target_vertices = vertex_density*area
+        target_vertices = int(target_vertices)
+        expected = setResolution(method, kwargs, area, target_vertices, vertices_per_area, grid_scale_range)
+        logging.info("Estimated surface area %.1f A^2, expecting %d vertices for %d target vertices", area, expected, target_vertices)
+    
+    mesh = buildMesh(structure, method, prefix, basedir, clean, hydrogens, quiet, **kwargs)
+    if(target_vertices is not None and mesh.num_vertices < remesh_below*expected):
+        # the surface is smaller than estimated, correct the area by the observed vertex count
+        area *= mesh.num_vertices/expected
+        previous = dict(kwargs)
+        expected = setResolution(method, kwargs, area, target_vertices, vertices_per_area, grid_scale_range)
+        if(kwargs != previous):
+            logging.info("Mesh has %d vertices, remeshing for a surface area of %.1f A^2", mesh.num_vertices, area)
+            mesh = buildMesh(structure, method, prefix, basedir, clean, hydrogens, quiet, **kwargs)
+    
+    if(decimate and target_vertices is not None and mesh.num_vertices > target_vertices):
+        mesh = decimateMesh(mesh, num_vertices=target_vertices, name=prefix)
     
     return mesh
@@ -1,17 +1,145 @@
+# builtin modules
+import warnings
+
 # third party modules
 from scipy.sparse.linalg import eigsh as sp_eigs
+from scipy.sparse.linalg import lobpcg, spilu, LinearOperator
+from scipy.linalg import eigh
+import scipy.sparse as sp
 import numpy as np
+import igl
 
 # geobind modules
 from geobind.utils import clipOutliers
 
-def getHKS(mesh, num_samples=3, num_components=50, feature_name='hks', tau=1, **kwargs):
+def getPreconditioner(L, M, method='amg', shift=None):
+    """Build an approximate inverse of the shifted Laplacian L + shift*M for use with LOBPCG. The
+    shift makes the (singular) Laplacian definite, by default it is 1e-4 of the average diagonal
+    ratio of L and M.
+
+    method:
+        'amg' - smoothed aggregation algebraic multigrid V-cycle (requires pyamg)
+        'ilu' - incomplete LU factorization, scipy's closest analogue to incomplete Cholesky
+    """
+    if(shift is None):
+        shift = 1e-4*(L.diagonal()/M.diagonal()).mean()
+    A = (L + shift*M).tocsr()
+    if(method == 'amg'):
+        import pyamg
+        return pyamg.smoothed_aggregation_solver(A, symmetry='symmetric').aspreconditioner(cycle='V')
+    elif(method == 'ilu'):
+        ilu = spilu(A.tocsc(), drop_tol=1e-4, fill_factor=10)
+        return LinearOperator(A.shape, matvec=ilu.solve, dtype=A.dtype)
+    elif(method is None):
+        return None
+    else:
+        raise ValueError("Unknown value of argument `preconditioner`: {}".format(method))
+
+def rayleighRitz(L, M, X):
+    """Best approximation of the eigenpairs of (L, M) in the span of the columns of X"""
+    evals, C = eigh(X.T @ (L @ X), X.T @ (M @ X))
+
+    return evals, X @ C
+
+def solveLOBPCG(L, M, X, preconditioner='amg', tol=1e-6, maxiter=200, shift=None):
+    """Smallest eigenpairs of L x = lambda M x by LOBPCG, starting from the block X. Iteration
+    stops at `maxiter` whether or not `tol` was reached."""
+    P = getPreconditioner(L, M, method=preconditioner, shift=shift)
+    with warnings.catch_warnings():
+        # lobpcg warns when it stops at maxiter
+        warnings.simplefilter("ignore", UserWarning)
+        evals, evecs = lobpcg(L, X, B=M, M=P, largest=False, tol=tol, maxiter=maxiter)
+
+    return evals, evecs
+
+def prolongationMatrix(fine_vertices, coarse_vertices, coarse_faces):
+    """Sparse matrix linearly interpolating values on the vertices of a coarse mesh to the fine
+    vertices, using barycentric coordinates of the closest point on the coarse surface"""
+    _, fi, C = igl.point_mesh_squared_distance(fine_vertices, coarse_vertices, coarse_faces)
+    T = coarse_faces[fi] # [N, 3] closest triangle for each fine vertex
+    A, B, D = coarse_vertices[T[:,0]], coarse_vertices[T[:,1]], coarse_vertices[T[:,2]]
+
+    # barycentric coordinates of the closest points
+    v0, v1, v2 = B - A, D - A, C - A
+    d00 = (v0*v0).sum(axis=1)
+    d01 = (v0*v1).sum(axis=1)
+    d11 = (v1*v1).sum(axis=1)
+    d20 = (v2*v0).sum(axis=1)
+    d21 = (v2*v1).sum(axis=1)
+    denom = d00*d11 - d01*d01
+    denom[denom == 0] = 1.0
+    w1 = (d11*d20 - d01*d21)/denom
+    w2 = (d00*d21 - d01*d20)/denom
+    W = np.clip(np.stack([1 - w1 - w2, w1, w2], axis=1), 0, 1)
+    W /= W.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(len(fine_vertices)), 3)
+
+    return sp.csr_matrix((W.reshape(-1), (rows, T.reshape(-1))), shape=(len(fine_vertices), len(coarse_vertices)))
+
+def getLaplaceBeltramiEigs(mesh, num_components=50, solver='shift_invert', preconditioner='amg',
+        tol=1e-6, maxiter=200, coarse_vertices=5000, refine=False, seed=0, **kwargs
+    ):
+    """Compute the smallest eigenpairs of the cotangent Laplace-Beltrami operator of a mesh.
+
+    solver:
+        'shift_invert'   - ARPACK in shift-invert mode about zero. Exact but factorizes the full
+                           matrix, which becomes slow past ~100k vertices.
+        'lobpcg'         - preconditioned LOBPCG (see `getPreconditioner`), no factorization of
+                           the full matrix is needed.
+        'coarse_to_fine' - solve on a mesh decimated to `coarse_vertices` vertices, interpolate
+                           the eigenvectors back to the mesh and apply a Rayleigh-Ritz step,
+                           followed by LOBPCG iterations if `refine` is set. Without refinement
+                           eigenvalues are typically within ~1% of the exact ones.
+    Eigenvalues are returned in increasing order with M-orthonormal eigenvectors. Results are stored
+    in the mesh cache (and hence its sidecar file) keyed by the solver and every option which
+    changes its result.
+    """
+    if(solver == 'lobpcg'):
+        options = [preconditioner, tol, maxiter, seed]
+    elif(solver == 'coarse_to_fine'):
+        options = [coarse_vertices] + ([preconditioner, tol, maxiter] if refine else [])
+    else:
+        options = []
+    options += ["{}={}".format(k, kwargs[k]) for k in sorted(kwargs)]
+    key = "_".join(["laplace_beltrami", solver, str(num_components)] + [str(o) for o in options])
+    if(key+"_evals" in mesh.cache):
+        return mesh.cache[key+"_evals"], mesh.cache[key+"_evecs"]
     
-    # compute eigenvalues and eigenvectors of Laplace-Beltrami operator
     L = -mesh.cot_matrix
     M = mesh.mass_matrix
+
+    if(solver == 'shift_invert'):
+        evals, evecs = sp_eigs(L, k=num_components, M=M,  which='LM', sigma=0, **kwargs)
+    elif(solver == 'lobpcg'):
+        X = np.random.RandomState(seed).normal(size=(L.shape[0], num_components))
+        evals, evecs = solveLOBPCG(L, M, X, preconditioner=preconditioner, tol=tol, maxiter=maxiter)
+    elif(solver == 'coarse_to_fine'):
+        from .decimate_mesh import decimateMesh
+        coarse = decimateMesh(mesh, num_vertices=coarse_vertices)
+
+        # use a few extra vectors on the coarse mesh to improve the fine subspace
+        nc = min(num_components + 10, coarse.num_vertices - 1)
+        _, evecs_c = getLaplaceBeltramiEigs(coarse, num_components=nc, solver='shift_invert', **kwargs)
+        X = prolongationMatrix(np.asarray(mesh.vertices), np.asarray(coarse.vertices), np.asarray(coarse.faces)) @ evecs_c
+
+        if(refine):
+            evals, evecs = solveLOBPCG(L, M, X, preconditioner=preconditioner, tol=tol, maxiter=maxiter)
+        else:
+            evals, evecs = rayleighRitz(L, M, X)
+        evals, evecs = evals[:num_components], evecs[:,:num_components]
+    else:
+        raise ValueError("Unknown value of argument `solver`: {}".format(solver))
+
+    order = np.argsort(evals)
+    mesh.cache[key+"_evals"] = evals[order]
+    mesh.cache[key+"_evecs"] = evecs[:,order]
+
+    return mesh.cache[key+"_evals"], mesh.cache[key+"_evecs"]
+
+def getHKS(mesh, num_samples=3, num_components=50, feature_name='hks', tau=1, solver='shift_invert', **kwargs):
     
-    evals, evecs = sp_eigs(L, k=num_components, M=M,  which='LM', sigma=0, **kwargs)
+    # compute eigenvalues and eigenvectors of Laplace-Beltrami operator
+    evals, evecs = getLaplaceBeltramiEigs(mesh, num_components=num_components, solver=solver, **kwargs)
     
     # determine time samples
     tmin = tau/min(evals.max(), 1e+1)
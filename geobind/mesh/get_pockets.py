@@ -1,47 +1,34 @@
-# standard packages
-import glob
-import os
-
 # third party packages
 import numpy as np
 
 # geobind packages
+from geobind.utils import tempWorkDir
 from .run_nanoshaper import runNanoShaper
 from .mesh import Mesh
 from .map_point_features_to_mesh import mapPointFeaturesToMesh
 
 def getPockets(atoms, mesh, nn_cutoff=1.5, radius_big=3.0, clean=True, feature_name='pocket', formatstr="{}_{}", **kwargs):
-    # run NanoShaper
-    runNanoShaper(atoms, "pockets", ".", pockets_only=True, kwargs=dict(radius_big=radius_big))
-    
     # gather info in mesh
     points = []
     features = []
-    pockets = glob.glob("cav_tri*.off")
-    if(len(pockets) > 0):
-        for p in pockets:
-            pocket = Mesh(p, process=False, remove_disconnected_components=False)
-            points.append(pocket.vertices)
-            features.append(
-                np.tile([
-                    pocket.volume,
-                    pocket.area,
-                    pocket.volume/pocket.area,
-                    pocket.aspect_ratio],
-                    (pocket.num_vertices, 1)
-            ))
-        points = np.concatenate(points)
-        features = np.concatenate(features)
     
-    if(clean):
-        # remove all the stuff NanoShaper generated
-        files = ["numcav.txt", "cavities.txt", "cavitiesSize.txt", "cavAtomsSerials.txt" "triangulatedSurf.off"]
-        files += glob.glob("all_cav*.txt")
-        files += glob.glob("cav*.txt")
-        files += glob.glob("cav_tri*.off")
-        for f in files:
-            if(os.path.exists(f)):
-                os.remove(f)
+    # run NanoShaper, pocket meshes are collected in a private directory which is removed afterwards
+    with tempWorkDir(prefix="pockets_") as wdir:
+        pockets = runNanoShaper(atoms, "pockets", wdir, pockets_only=True, clean=clean, radius_big=radius_big)
+        if(len(pockets) > 0):
+            for p in pockets:
+                pocket = Mesh(p, process=False, remove_disconnected_components=False)
+                points.append(pocket.vertices)
+                features.append(
+                    np.tile([
+                        pocket.volume,
+                        pocket.area,
+                        pocket.volume/pocket.area,
+                        pocket.aspect_ratio],
+                        (pocket.num_vertices, 1)
+                ))
+            points = np.concatenate(points)
+            features = np.concatenate(features)
     
     feature_names = [
         formatstr.format(feature_name, "volume"),
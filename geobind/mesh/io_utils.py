@@ -3,10 +3,12 @@ import os
 import shutil
 
 def __move(fileName, dest):
-    path = os.path.join(dest, fileName)
+    """Move a file into the directory `dest`, replacing any existing file, and return the new path"""
+    path = os.path.join(dest, os.path.basename(fileName))
+    if(os.path.abspath(path) == os.path.abspath(fileName)):
+        return path
     if(os.path.exists(path)):
-        if(os.path.abspath(dest) != os.getcwd()):
-            os.remove(path)
-            shutil.move(fileName, dest)
-    else:
-        shutil.move(fileName, dest)
+        os.remove(path)
+    shutil.move(fileName, path)
+    
+    return path
@@ -9,6 +9,11 @@ import os
 import numpy as np
 import trimesh
 import igl
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# geobind modules
+from .mesh_io import readBinaryMesh, writeBinaryMesh, meshHash, readMeshSidecar, writeMeshSidecar
 
 #import networkx as nx
 #from matplotlib import cm
@@ -96,11 +101,28 @@ import igl
             #self.__aspect_ratio = ar
 
 class Mesh(object):
-    """Wrapper class for storing a trimesh mesh and peforming some basic operations"""
-    def __init__(self, handle=None, vertices=None, faces=None, name="mesh", process=True, remove_disconnected_components=True, smoothing=None, **kwargs):
+    """Wrapper class for storing a trimesh mesh and peforming some basic operations
+    
+    Derived data stored in `cache` (Laplacian and mass matrices, adjacency, spectra) can be 
+    persisted to a sidecar file with `saveSidecar` and is loaded from it on construction if the
+    `sidecar` argument is given. A sidecar is only used if it was computed from a mesh with
+    identical vertices and faces. Passing `sidecar=True` with a file handle uses the file name
+    with a '.cache.npz' suffix."""
+    def __init__(self, handle=None, vertices=None, faces=None, name="mesh", process=True, remove_disconnected_components=True, single_component=False, smoothing=None, sidecar=None, **kwargs):
         self.name = name
+        self.single_component = single_component # set if the mesh is known to have one component
+        if(sidecar is True):
+            if(not isinstance(handle, str)):
+                raise ValueError("A sidecar file name must be given when not loading from a file.")
+            sidecar = Mesh.sidecarFileName(handle)
+        self.sidecar_file = sidecar
         if(handle is not None):
-            if(isinstance(handle, str)):
+            if(isinstance(handle, str) and handle.endswith(".bmesh")):
+                # memory-mapped binary mesh, see `writeBinaryMesh`
+                V, F, N, attributes = readBinaryMesh(handle)
+                self.mesh = trimesh.Trimesh(vertices=V, faces=F, vertex_normals=N, process=process, **kwargs)
+                self.mesh.vertex_attributes.update(attributes)
+            elif(isinstance(handle, str)):
                 self.mesh = trimesh.load(handle, process=process, **kwargs)
             else:
                 raise TypeError("Mesh file handle must be a string.")
@@ -120,6 +142,20 @@ class Mesh(object):
             self.remove_disconnected_components()
         else:
             self.__reset()
+        
+        if(self.sidecar_file is not None):
+            self.loadSidecar()
+    
+    @staticmethod
+    def sidecarFileName(mesh_file):
+        """Default sidecar file name for a mesh file"""
+        return "{}.cache.npz".format(os.path.splitext(mesh_file)[0])
+    
+    @property
+    def hash(self):
+        if(self._hash is None):
+            self._hash = meshHash(self.vertices, self.faces)
+        return self._hash
     
     @property
     def areas_faces(self):
@@ -227,16 +263,72 @@ class Mesh(object):
         
         # cached properties
         self.cache = {}
+        self._hash = None
+        self._sidecar_keys = set() # cache entries which are already stored in the sidecar
     
     def remove_disconnected_components(self):
-        """Remove disconnected subcomponents keeping the largest"""
-
-        components = self.mesh.split()
-        sizes = [len(c.vertices) for c in components]
+        """Remove disconnected subcomponents keeping the largest watertight one, or the largest
+        one if none is watertight"""
+        if(self.single_component or len(self.mesh.faces) == 0):
+            # nothing to remove
+            self.__reset()
+            return
+        
+        # label faces by connected component using the face adjacency graph
+        nF = len(self.mesh.faces)
+        adj = self.mesh.face_adjacency
+        A = coo_matrix((np.ones(len(adj), dtype=np.int8), (adj[:,0], adj[:,1])), shape=(nF, nF))
+        nc, labels = connected_components(A, directed=False)
+        
+        if(nc > 1):
+            # count the unique vertices of each component and keep the largest
+            nV = len(self.mesh.vertices)
+            pairs = np.unique(np.repeat(labels, 3)*nV + self.mesh.faces.reshape(-1))
+            sizes = np.bincount(pairs//nV, minlength=nc)
+            
+            # a component is watertight if every one of its edges is shared by exactly two faces
+            _, inverse, counts = np.unique(self.mesh.edges_sorted, axis=0, return_inverse=True, return_counts=True)
+            open_edges = np.bincount(labels[self.mesh.edges_face], weights=(counts[inverse.reshape(-1)] != 2), minlength=nc)
+            watertight = (open_edges == 0)
+            if(watertight.any()):
+                sizes[~watertight] = -1
+            
+            # mask faces of the other components and reindex the remaining vertices
+            self.mesh.update_faces(labels == np.argmax(sizes))
+            self.mesh.remove_unreferenced_vertices()
         
-        self.mesh = components[np.argmax(sizes)]
+        self.single_component = True
         self.__reset()
     
+    def loadSidecar(self, file_name=None):
+        """Load cached derived data from a sidecar file. Returns False if the file does not exist or
+        belongs to a different mesh."""
+        if(file_name is None):
+            file_name = self.sidecar_file
+        arrays = readMeshSidecar(file_name, self.hash)
+        if(arrays is None):
+            return False
+        
+        self.cache.update(arrays)
+        self._sidecar_keys.update(arrays.keys())
+        
+        return True
+    
+    def saveSidecar(self, file_name=None, overwrite=False):
+        """Write the cached derived data to a sidecar file. The file is only rewritten if the cache
+        holds entries which were not loaded from it, or if `overwrite` is set."""
+        if(file_name is None):
+            file_name = self.sidecar_file
+        if(file_name is None):
+            raise ValueError("No sidecar file name given.")
+        
+        if(overwrite or file_name != self.sidecar_file or not set(self.cache.keys()) <= self._sidecar_keys):
+            writeMeshSidecar(file_name, self.hash, self.cache)
+            self._sidecar_keys = set(self.cache.keys())
+            self.sidecar_file = file_name
+        
+        return file_name
+    
     def nearestVertex(self, x):
         """Returns the distance and vertex index which is nearest the given point x"""
         d, i = self.vertex_kdtree.query(x)
@@ -285,4 +377,9 @@ class Mesh(object):
             return path
         
         # save mesh to file
-        self.mesh.export(file_name, file_format)
+        if(file_format == "bmesh"):
+            writeBinaryMesh(path, self.vertices, self.faces, self.vertex_normals, attributes=self.vertex_attributes)
+        else:
+            self.mesh.export(path, file_format)
+        
+        return path
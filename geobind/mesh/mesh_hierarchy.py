@@ -0,0 +1,216 @@
+# third party modules
+import numpy as np
+import trimesh
+from scipy.sparse import coo_matrix
+
+# geobind modules
+from .get_geometric_edge_features import getGeometricEdgeFeatures
+
+def quadricErrorMetrics(V, F):
+    """Sum of the plane quadrics of the faces adjacent to each vertex [V, 4, 4]"""
+    N = np.cross(V[F[:,1]] - V[F[:,0]], V[F[:,2]] - V[F[:,0]])
+    norm = np.linalg.norm(N, axis=1, keepdims=True)
+    N = N/np.where(norm > 0, norm, 1)
+
+    # plane (n, -n*v) of each face and its outer product
+    P = np.concatenate([N, -(N*V[F[:,0]]).sum(axis=1, keepdims=True)], axis=1) # [F, 4]
+    K = np.einsum('ij,ik->ijk', P, P).reshape(-1, 16) # [F, 16]
+
+    # add to each vertex of the face
+    fi = np.repeat(np.arange(len(F)), 3)
+    Q = np.stack([np.bincount(F.reshape(-1), weights=K[fi, k], minlength=len(V)) for k in range(16)], axis=1)
+
+    return Q.reshape(-1, 4, 4)
+
+def collapseCosts(E, Q, V, min_det=1e-9):
+    """Optimal position and quadric error of contracting each edge in E. The position minimizing
+    the error is found with one batched solve; edges whose summed quadric is (nearly) singular,
+    i.e. det(A) < min_det*(tr(A)/3)^3 for its upper 3x3 block A, fall back to the edge midpoint."""
+    Qij = Q[E[:,0]] + Q[E[:,1]] # [E, 4, 4]
+    A = Qij[:,:3,:3]
+    b = -Qij[:,:3,3]
+
+    # detect singular systems relative to the scale of each quadric
+    scale = (np.trace(A, axis1=1, axis2=2)/3)**3
+    regular = np.abs(np.linalg.det(A)) > min_det*scale
+
+    vopt = (V[E[:,0]] + V[E[:,1]])/2
+    if regular.any():
+        vopt[regular] = np.linalg.solve(A[regular], b[regular][:,:,np.newaxis])[:,:,0]
+
+    # compute cost v'*(Qi + Qj)*v for every pair
+    vh = np.concatenate([vopt, np.ones((len(E), 1))], axis=1)
+    costs = np.einsum('ij,ijk,ik->i', vh, Qij, vh)
+
+    return vopt, costs
+
+def _rowEntries(indptr, rows):
+    """Positions of the entries of the given rows of a CSR matrix and the row each belongs to"""
+    counts = indptr[rows+1] - indptr[rows]
+    owner = np.repeat(np.arange(len(rows)), counts)
+    pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - indptr[rows], counts)
+
+    return owner, pos
+
+def _uniqueSorted(x):
+    """Sorted unique values of an integer array"""
+    x = np.sort(x)
+    
+    return x[np.concatenate([[True], x[1:] != x[:-1]])]
+
+def _pairProduct(s_owner, t_owner, num_groups):
+    """Given two sorted arrays of group labels, return the index pairs (i, j) of every combination
+    of entries which belong to the same group"""
+    ct = np.bincount(t_owner, minlength=num_groups)
+    st = np.cumsum(ct) - ct
+    n = ct[s_owner]
+    pi = np.repeat(np.arange(len(s_owner)), n)
+    pj = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + st[s_owner[pi]]
+
+    return pi, pj
+
+def greedyEdgeMatching(E, costs, num_vertices, check_manifold=True):
+    """Greedily contract edges in order of increasing cost such that every vertex is contracted at
+    most once. If `check_manifold` is set, an edge is only contracted if its endpoints share
+    exactly two neighbors (counting already contracted pairs as one vertex). Returns a cluster
+    index for every vertex, numbering contracted pairs first in order of cost, and the indices of
+    the contracted edges.
+
+    Rather than visiting edges one at a time, every round decides all edges which have the lowest
+    cost among the undecided edges at both of their endpoints. With the manifold check an edge also
+    waits while a cheaper undecided edge joins the neighborhoods of its endpoints in a way that
+    would change the outcome of the check. This gives the same result as visiting the edges in
+    sorted order, in far fewer rounds."""
+    E = np.asarray(E, dtype=np.int64)
+    num_edges = len(E)
+
+    # rank edges by cost, ties are broken by edge order
+    rank = np.empty(num_edges, dtype=np.int64)
+    rank[np.argsort(costs, kind='stable')] = np.arange(num_edges)
+
+    if check_manifold:
+        # vertex adjacency and a lookup of the vertex pair joined by each edge
+        A = coo_matrix((np.ones(num_edges, dtype=bool), (E[:,0], E[:,1])), shape=(num_vertices, num_vertices))
+        A = (A + A.T).tocsr()
+        A.sort_indices()
+        indptr, indices = A.indptr.astype(np.int64), A.indices.astype(np.int64)
+        pair_keys = np.repeat(np.arange(num_vertices), np.diff(indptr))*num_vertices + indices # sorted
+
+        def lookup(a, b):
+            # index of the vertex pair (a, b) or -1 if they are not adjacent
+            k = np.minimum(a, b)*num_vertices + np.maximum(a, b)
+            i = np.minimum(np.searchsorted(pair_keys, k), len(pair_keys) - 1)
+            return np.where(pair_keys[i] == k, i, -1)
+        pair_of = lookup(E[:,0], E[:,1])
+
+    rep = np.arange(num_vertices) # current vertex each original vertex belongs to
+    matched = np.zeros(num_vertices, dtype=bool)
+    discarded = (E[:,0] == E[:,1])
+    ai = np.arange(num_edges) # undecided edges
+    contracted = []
+    while True:
+        ai = ai[~(matched[E[ai,0]] | matched[E[ai,1]] | discarded[ai])]
+        if len(ai) == 0:
+            break
+        r = rank[ai]
+
+        # edges with the lowest rank at both endpoints
+        m = np.full(num_vertices, num_edges, dtype=np.int64)
+        np.minimum.at(m, E[ai,0], r)
+        np.minimum.at(m, E[ai,1], r)
+        ci = ai[r == np.minimum(m[E[ai,0]], m[E[ai,1]])]
+
+        if check_manifold:
+            s, t = E[ci,0], E[ci,1]
+            s_owner, s_pos = _rowEntries(indptr, s)
+            t_owner, t_pos = _rowEntries(indptr, t)
+
+            # Contracting an undecided edge (a, b) with a in N(s) and b in N(t) changes the number
+            # of neighbors s and t share when a and b are both or neither shared (and contracting
+            # (s, t) affects the check of (a, b) in the same way). Wait for any such edge which is
+            # cheaper.
+            pair_rank = np.full(len(pair_keys), num_edges, dtype=np.int64)
+            np.minimum.at(pair_rank, pair_of[ai], r)
+            pi, pj = _pairProduct(s_owner, t_owner, len(ci))
+            k = s_owner[pi]
+            a, b = indices[s_pos[pi]], indices[t_pos[pj]]
+            valid = (a != t[k]) & (b != s[k]) & (a != b)
+            k, a, b = k[valid], a[valid], b[valid]
+            f = lookup(a, b)
+            block = (f >= 0)
+            k, a, b, f = k[block], a[block], b[block], f[block]
+            block = ((lookup(a, t[k]) >= 0) == (lookup(b, s[k]) >= 0)) & (pair_rank[f] < rank[ci[k]])
+            wait = np.zeros(len(ci), dtype=bool)
+            wait[k[block]] = True
+
+            # count the neighbors the endpoints share, in terms of current vertices
+            key = num_vertices + num_edges
+            ns = _uniqueSorted(s_owner*key + rep[indices[s_pos]])
+            nt = _uniqueSorted(t_owner*key + rep[indices[t_pos]])
+            shared = np.bincount(np.intersect1d(ns, nt, assume_unique=True)//key, minlength=len(ci))
+
+            # edges failing the check are discarded
+            discarded[ci[~wait & (shared != 2)]] = True
+            ci = ci[~wait & (shared == 2)]
+
+        matched[E[ci,0]] = matched[E[ci,1]] = True
+        rep[E[ci,0]] = rep[E[ci,1]] = num_vertices + ci
+        contracted.append(ci)
+
+    contracted = np.concatenate(contracted) if contracted else np.zeros(0, dtype=np.int64)
+    contracted = contracted[np.argsort(rank[contracted])]
+
+    # contracted pairs come first, the remaining vertices are kept
+    cluster = np.full(num_vertices, -1, dtype=np.int64)
+    cluster[E[contracted,0]] = cluster[E[contracted,1]] = np.arange(len(contracted))
+    remaining = (cluster < 0)
+    cluster[remaining] = len(contracted) + np.arange(remaining.sum())
+
+    return cluster, contracted
+
+def poolMesh(V, F, check_manifold=True, **kwargs):
+    """Coarsen a mesh by one level of quadric error edge contractions (see `greedyEdgeMatching`).
+    Returns the cluster index of every vertex and the coarse vertices and faces."""
+    E = trimesh.Trimesh(vertices=V, faces=F, process=False).edges_unique
+    Q = quadricErrorMetrics(V, F)
+    vopt, costs = collapseCosts(E, Q, V, **kwargs)
+    cluster, contracted = greedyEdgeMatching(E, costs, len(V), check_manifold=check_manifold)
+
+    # contracted pairs move to their optimal position, other vertices are kept
+    new_V = np.empty((cluster.max() + 1, 3))
+    new_V[cluster] = V
+    new_V[:len(contracted)] = vopt[contracted]
+
+    # remove faces which collapsed
+    new_F = cluster[F]
+    degenerate = (new_F[:,0] == new_F[:,1]) | (new_F[:,0] == new_F[:,2]) | (new_F[:,1] == new_F[:,2])
+
+    return cluster, new_V, new_F[~degenerate]
+
+def getMeshHierarchy(mesh, num_levels=2, check_manifold=True, edge_features=True, **kwargs):
+    """Precompute the mesh pooling hierarchy used by `geobind.nn.layers.MeshPooling` when pooling
+    depends only on geometry. For each level l = 1..num_levels the returned dict holds
+        pool<l>_cluster    - cluster index at level l of every vertex of level l-1
+        pool<l>_pos        - vertex positions of level l
+        pool<l>_face       - faces of level l
+        pool<l>_edge_index - directed edges of level l
+        pool<l>_edge_attr  - geometric edge features of level l (if `edge_features` is set)
+    """
+    V = np.asarray(mesh.vertices, dtype=np.float64)
+    F = np.asarray(mesh.faces, dtype=np.int64)
+
+    arrays = {}
+    for level in range(1, num_levels+1):
+        cluster, V, F = poolMesh(V, F, check_manifold=check_manifold, **kwargs)
+        key = "pool{}_".format(level)
+        arrays[key+"cluster"] = cluster
+        arrays[key+"pos"] = V
+        arrays[key+"face"] = F
+
+        tmesh = trimesh.Trimesh(vertices=V, faces=F, process=False)
+        if edge_features:
+            arrays[key+"edge_index"], arrays[key+"edge_attr"] = getGeometricEdgeFeatures(tmesh)
+        else:
+            arrays[key+"edge_index"] = np.concatenate([tmesh.edges_unique, np.flip(tmesh.edges_unique, axis=1)])
+
+    return arrays
@@ -1,5 +1,13 @@
+# builtin modules
+import json
+import struct
+import hashlib
+import os
+
+# third party modules
 import numpy as np
 import trimesh
+import scipy.sparse as sp
 
 def loadMesh(fileName, smoothing=None, process=True, **kwargs):
     
@@ -28,80 +36,242 @@ class Scaler(object):
 
 def writeOFF(file_prefix, vertexs, faces, data=None, colorby="vertex", data_range=[None, None], cmap=None):
     # save mesh as a .OFF file - 
-    OUT = open("{}.off".format(file_prefix), "w")
     nv = vertexs.shape[0]
     nf = faces.shape[0]
     
     if(data is not None):
         # get vertex colors
         if(cmap is None):
+            from matplotlib import cm
             cmap = cm.get_cmap('seismic')
             scale = Scaler(data, data_range=data_range)
             rgba = cmap(scale(data))
         else:
             rgba = np.array(list(map(lambda d: cmap(d), data)))
     
-    # write vertexes
+    OUT = open("{}.off".format(file_prefix), "w")
+    
+    # write vertexs
     if(data is not None and colorby == 'vertex'):
-        OUT.write("COFF\n{} {} 0".format(nv, nf))
-        for i in range(nv):
-            OUT.write("\n{:.6f} {:.6f} {:.6f} {:>.5f} {:>.5f} {:>.5f} 1.0".format(vertexs[i][0], vertexs[i][1], vertexs[i][2], rgba[i][0], rgba[i][1], rgba[i][2]))
+        OUT.write("COFF\n{} {} 0\n".format(nv, nf))
+        np.savetxt(OUT, np.concatenate([vertexs[:,0:3], rgba[:,0:3], np.ones((nv, 1))], axis=1),
+            fmt=["%.6f"]*3 + ["%.5f"]*3 + ["%.1f"]
+        )
     else:
-        OUT.write("OFF\n{} {} 0".format(nv, nf))
-        for i in range(nv):
-            OUT.write("\n{:.6f} {:.6f} {:.6f}".format(vertexs[i][0], vertexs[i][1], vertexs[i][2]))
+        OUT.write("OFF\n{} {} 0\n".format(nv, nf))
+        np.savetxt(OUT, vertexs[:,0:3], fmt="%.6f")
     
     # write faces
     if(data is not None and colorby == 'face'):
-        for i in range(nf):
-            #data_value = (data[faces[i][0]] + data[faces[i][1]] + data[faces[i][2]])/3.0
-            #rgba = cmap(scale(data_value))
-            color = (rgba[faces[i][0]] + rgba[faces[i][1]] + rgba[faces[i][2]])/3.0
-            OUT.write("\n{:<4d} {:>5d} {:>5d} {:>5d} {:>.5f} {:>.5f} {:>.5f} 1.0".format(3, faces[i][0], faces[i][1], faces[i][2], color[0], color[1], color[2]))
+        color = (rgba[faces[:,0]] + rgba[faces[:,1]] + rgba[faces[:,2]])/3.0
+        OUT.write("\n".join(
+            "{:<4d} {:>5d} {:>5d} {:>5d} {:>.5f} {:>.5f} {:>.5f} 1.0".format(3, *f, *c) for f, c in zip(faces.tolist(), color[:,0:3].tolist())
+        ))
     else:
-        # write faces
-        for i in range(nf):
-            OUT.write("\n{:<4d} {:>5d} {:>5d} {:>5d}".format(3, faces[i][0], faces[i][1], faces[i][2]))
+        np.savetxt(OUT, np.concatenate([np.full((nf, 1), 3), faces], axis=1), fmt=["%-4d", "%5d", "%5d", "%5d"])
 
     OUT.close()
 
+def _readArray(lines, num_rows, dtype=np.float32):
+    """Parse a block of whitespace delimited lines into a 2D array in a single pass"""
+    if(num_rows == 0):
+        return np.empty((0, 0), dtype=dtype)
+    
+    return np.fromstring(" ".join(lines), dtype=dtype, sep=" ").reshape(num_rows, -1)
+
+def _readFaces(lines, num_faces):
+    """Parse the vertex indices of OFF face records. Records may carry a colour or differ in their
+    number of tokens, only the three indices following the count are kept."""
+    if(num_faces == 0):
+        return np.empty((0, 3), dtype=np.int64)
+    
+    # fast path, every record has the same number of fields. Records with colours do not parse as
+    # integers and are parsed as floats.
+    block = " ".join(lines)
+    try:
+        data = np.fromstring(block, dtype=np.int64, sep=" ")
+    except ValueError:
+        data = np.fromstring(block, dtype=np.float64, sep=" ")
+    if(data.size % num_faces == 0 and data.size//num_faces >= 4):
+        data = data.reshape(num_faces, -1)
+        if((data[:,0] == 3).all()):
+            return data[:,1:4].astype(np.int64)
+    
+    # records of differing lengths, tokenise each one
+    return np.array([line.split(None, 4)[1:4] for line in lines], dtype=np.int64)
+
 def readOFF(file_name):
-    FH = open(file_name)
-    # Skip first line
-    FH.readline()
+    with open(file_name) as FH:
+        lines = FH.read().splitlines()
+    
+    # Skip first line and any comments
+    i = 1
+    while(len(lines[i].strip()) == 0 or lines[i].strip()[0] == '#'):
+        i += 1
     
     # Get number of vertices and faces
-    Nv = None
-    Nf = None
-    while(True):
-        line = FH.readline().strip()
-        if(len(line) == 0):
-            continue
-        if(line[0] == '#'):
-            continue
+    Nv, Nf = lines[i].split()[0:2]
+    Nv = int(Nv)
+    Nf = int(Nf)
+    i += 1
+    
+    # Read in vertexs and faces
+    verts = _readArray(lines[i:i+Nv], Nv, dtype=np.float32)[:,0:3]
+    faces = _readFaces(lines[i+Nv:i+Nv+Nf], Nf)
+    
+    return verts, faces.astype(np.int32)
+
+def readMSMS(file_prefix):
+    """Read the .vert and .face files produced by MSMS, returning vertices, faces and vertex normals"""
+    # Get vertices - three header lines are followed by 'x y z nx ny nz ...' records
+    with open("{}.vert".format(file_prefix)) as FH:
+        vertData = FH.read().splitlines()[3:]
+    vertData = _readArray(vertData, len(vertData), dtype=np.float32)
+    vertexs = vertData[:,0:3]
+    normals = vertData[:,3:6]
+    
+    # Get faces - three header lines are followed by 'i j k ...' records indexed from one
+    with open("{}.face".format(file_prefix)) as FH:
+        faceData = FH.read().splitlines()[3:]
+    faces = _readArray(faceData, len(faceData), dtype=np.int64)[:,0:3] - 1
+    
+    return vertexs, faces.astype(np.int32), normals
+
+BINARY_MESH_MAGIC = b"GBMESH01"
+
+def writeBinaryMesh(file_name, vertices, faces, normals=None, attributes=None, alignment=64):
+    """Write a mesh to a binary container which can be memory-mapped by `readBinaryMesh`.
+    
+    The file consists of a magic string, the length of a JSON header, the JSON header describing
+    the name, dtype, shape and byte offset of every array, followed by the raw array data. Vertex 
+    attributes are stored under the key 'attributes/<name>'.
+    """
+    arrays = [
+        ("vertices", np.ascontiguousarray(vertices)),
+        ("faces", np.ascontiguousarray(faces))
+    ]
+    if(normals is not None):
+        arrays.append(("normals", np.ascontiguousarray(normals)))
+    if(attributes is not None):
+        for key in attributes:
+            arrays.append(("attributes/{}".format(key), np.ascontiguousarray(attributes[key])))
+    
+    # build header, aligning each array so it can be mapped directly
+    header = {}
+    offsets = {}
+    offset = 0
+    for key, array in arrays:
+        offset = int(np.ceil(offset/alignment)*alignment)
+        header[key] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset
+        }
+        offsets[key] = offset
+        offset += array.nbytes
+    header = json.dumps(header).encode('utf-8')
+    
+    # data starts after the header, aligned as well
+    start = len(BINARY_MESH_MAGIC) + 8 + len(header)
+    pad = int(np.ceil(start/alignment)*alignment) - start
+    header += b" "*pad
+    start += pad
+    
+    with open(file_name, "wb") as FH:
+        FH.write(BINARY_MESH_MAGIC)
+        FH.write(struct.pack("<Q", len(header)))
+        FH.write(header)
+        for key, array in arrays:
+            FH.seek(start + offsets[key])
+            FH.write(array.tobytes())
+    
+    return file_name
+
+def readBinaryMesh(file_name, mmap=True):
+    """Read a mesh written by `writeBinaryMesh`, returning vertices, faces, normals (or None) and a
+    dict of vertex attributes. If `mmap` is set the arrays are read-only memory maps of the file."""
+    with open(file_name, "rb") as FH:
+        if(FH.read(len(BINARY_MESH_MAGIC)) != BINARY_MESH_MAGIC):
+            raise ValueError("Not a binary mesh file: {}".format(file_name))
+        size = struct.unpack("<Q", FH.read(8))[0]
+        header = json.loads(FH.read(size).decode('utf-8'))
+        start = FH.tell()
+        
+        arrays = {}
+        for key, info in header.items():
+            dtype = np.dtype(info["dtype"])
+            shape = tuple(info["shape"])
+            if(mmap and np.prod(shape) > 0):
+                arrays[key] = np.memmap(file_name, dtype=dtype, mode='r', offset=start + info["offset"], shape=shape)
+            else:
+                FH.seek(start + info["offset"])
+                count = int(np.prod(shape))
+                arrays[key] = np.frombuffer(FH.read(count*dtype.itemsize), dtype=dtype).reshape(shape)
+    
+    attributes = {}
+    for key in arrays:
+        if(key.startswith("attributes/")):
+            attributes[key[len("attributes/"):]] = arrays[key]
+    
+    return arrays["vertices"], arrays["faces"], arrays.get("normals"), attributes
+
+def meshHash(vertices, faces):
+    """Hash identifying a mesh by its vertex coordinates and faces"""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(vertices, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(faces, dtype=np.int64).tobytes())
+    
+    return h.hexdigest()
+
+def writeMeshSidecar(file_name, mesh_hash, arrays):
+    """Write derived mesh data (dense arrays and scipy sparse matrices) to a npz file tagged with
+    the hash of the mesh it was computed from. Sparse matrices are stored in coordinate form under
+    the keys '<name>/row', '<name>/col', '<name>/data', '<name>/shape' and '<name>/format'."""
+    data = {"__hash__": np.array(mesh_hash)}
+    for key, value in arrays.items():
+        if(sp.issparse(value)):
+            coo = value.tocoo()
+            data[key+"/row"] = coo.row
+            data[key+"/col"] = coo.col
+            data[key+"/data"] = coo.data
+            data[key+"/shape"] = np.array(coo.shape)
+            data[key+"/format"] = np.array(value.format)
         else:
-            Nv, Nf, _ = line.split()
-            Nv = int(Nv)
-            Nf = int(Nf)
-            break
-    
-    # Read in vertexs
-    i = 0
-    verts = []
-    while(i < Nv):
-        line = FH.readline().strip()
-        verts.append([float(_) for _ in line.split()])
-        i += 1
+            data[key] = np.asarray(value)
     
-    # Read in faces
-    i = 0
-    faces = []
-    while(i < Nf):
-        line = FH.readline().strip()
-        faces.append([float(_) for _ in line.split()[1:4]])
-        i += 1
+    # write to a temporary file first so readers never see a partial sidecar
+    tmp = "{}.{}.tmp.npz".format(file_name, os.getpid())
+    np.savez(tmp, **data)
+    os.replace(tmp, file_name)
+    
+    return file_name
+
+def readMeshSidecar(file_name, mesh_hash=None):
+    """Read a file written by `writeMeshSidecar`, returning a dict of arrays and sparse matrices. 
+    Returns None if the file does not exist or if it was computed from a different mesh than the 
+    one identified by `mesh_hash`."""
+    if(not os.path.exists(file_name)):
+        return None
+    
+    with np.load(file_name) as FH:
+        if(mesh_hash is not None and str(FH["__hash__"]) != mesh_hash):
+            return None
+        
+        arrays = {}
+        for key in FH.files:
+            if(key == "__hash__"):
+                continue
+            elif("/" in key):
+                name, field = key.rsplit("/", 1)
+                if(field == "format"):
+                    arrays[name] = sp.coo_matrix(
+                        (FH[name+"/data"], (FH[name+"/row"], FH[name+"/col"])),
+                        shape=tuple(FH[name+"/shape"])
+                    ).asformat(str(FH[key]))
+            else:
+                arrays[key] = FH[key]
     
-    return np.array(verts, dtype=np.float32), np.array(faces, dtype=np.int32)
+    return arrays
 
 def readPLY(file_name):
     pass
@@ -3,52 +3,59 @@ import os
 import subprocess
 
 # geobind modules
+from geobind.utils import tempWorkDir, runCached
 from .io_utils import __move
 from .mesh import Mesh
 
 def runEDTSurf(pdbfile, file_prefix='mesh', basedir='.', clean=True, quiet=True, mesh_kwargs={}, **kwargs):
-    # run EDTSurf and generate .PLY file
-    edtsurf_args = {
-        "-t": "2",
-        "-s": "3",
-        "-c": "1",
-        "-p": "1.4",
-        "-f": "2.0",
-        "-h": "2",
-        "-o": file_prefix
-    }
-    edtsurf_args.update(kwargs)
-    
-    args = [
-        "EDTSurf",
-        "-i",
-        pdbfile
-    ]
-    for key in edtsurf_args:
-        args.append(key)
-        args.append(edtsurf_args[key])
-    if(quiet):
-        FNULL = open(os.devnull, 'w')
-        subprocess.call(args, stdout=FNULL, stderr=FNULL)
-        FNULL.close()
-    else:
-        subprocess.call(args)
-    
-    meshfile = "{}.ply".format(file_prefix)
-    mesh = Mesh(handle=meshfile, name=file_prefix, **mesh_kwargs)
-    # clean up EDTSurf files
-    files = [
-        "{}-cav.pdb".format(file_prefix),
-        meshfile,
-        pdbfile
-    ]
-    if clean:
-        for f in files:
-            if os.path.exists(f):
-                os.remove(f)
-    else:
-        for f in files:
-            __move(f, basedir)
+    # run EDTSurf in a private directory and generate .PLY file
+    with tempWorkDir(prefix="edtsurf_") as wdir:
+        edtsurf_args = {
+            "-t": "2",
+            "-s": "3",
+            "-c": "1",
+            "-p": "1.4",
+            "-f": "2.0",
+            "-h": "2",
+            "-o": os.path.join(wdir, file_prefix)
+        }
+        edtsurf_args.update(kwargs)
+        
+        args = [
+            "EDTSurf",
+            "-i",
+            os.path.abspath(pdbfile)
+        ]
+        for key in edtsurf_args:
+            args.append(key)
+            args.append(edtsurf_args[key])
+        def runTool():
+            if(quiet):
+                FNULL = open(os.devnull, 'w')
+                subprocess.call(args, stdout=FNULL, stderr=FNULL, cwd=wdir)
+                FNULL.close()
+            else:
+                subprocess.call(args, cwd=wdir)
+        
+        # reuse the output of an earlier run on the same file with the same options
+        params = {k: v for k, v in edtsurf_args.items() if k != "-o"}
+        runCached(["EDTSurf"], runTool, wdir, inputs=[pdbfile], params=params, outputs=["{}.ply".format(file_prefix)])
+        
+        out_prefix = edtsurf_args["-o"]
+        meshfile = "{}.ply".format(out_prefix)
+        mesh = Mesh(handle=meshfile, name=file_prefix, **mesh_kwargs)
+        # clean up EDTSurf files
+        files = [
+            "{}-cav.pdb".format(out_prefix),
+            meshfile,
+            pdbfile
+        ]
+        if clean:
+            if os.path.exists(pdbfile):
+                os.remove(pdbfile)
+        else:
+            for f in files:
+                if os.path.exists(f):
+                    __move(f, basedir)
     
     return mesh
-    
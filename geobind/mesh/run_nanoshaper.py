@@ -1,29 +1,17 @@
 # builtin modules
+import glob
 import os
 import subprocess
 
 # geobind modules
+from geobind.utils import tempWorkDir, getThreadScheduler, runCached
 from .io_utils import __move
 from .mesh import Mesh
 
 def runNanoShaper(atoms, file_prefix, basedir, 
         clean=True, quiet=True, hydrogens=True, pockets_only=False, mesh_kwargs={}, **kwargs
     ):
-    # generate coordinate file
-    if(not isinstance(atoms, list)):
-        atoms = atoms.get_atoms()
-    coordFile = "{}.xyzr".format(file_prefix)
-    FH = open(coordFile, "w")
-    for atom in atoms:
-        if((not hydrogens) and atom.element == "H"):
-            continue
-        atmn = atom.name
-        acoords = atom.get_coord()
-        radius = atom.xtra["radius"]
-        FH.write("{:7.4f} {:7.4f} {:7.4f} {:3.2f} {}\n".format(acoords[0], acoords[1], acoords[2], radius, atom.serial_number))
-    FH.close()
-    
-    # run NanoShaper and generate .OFF file
+    # NanoShaper parameters
     nanoshaper_args = {
         "grid_scale": 2.0,
         "grid_perfil": 90.0,
@@ -35,7 +23,8 @@ def runNanoShaper(atoms, file_prefix, basedir,
         "accurate_triangulation": "true",
         "smooth_mesh": "true",
         "blobbyness": -2.5,
-        "radius_big": 3.0
+        "radius_big": 3.0,
+        "num_threads": None # reserved from the global thread budget if None
     }
     nanoshaper_args.update(kwargs)
     if(pockets_only):
@@ -46,7 +35,7 @@ def runNanoShaper(atoms, file_prefix, basedir,
 Operative_Mode = {op_mode}
 Grid_scale = {grid_scale}
 Grid_perfil = {grid_perfil}
-Number_thread = 32 
+Number_thread = {num_threads}
 # Map Settings
 Build_epsilon_maps = false
 Build_status_map = {build_status_map}
@@ -68,47 +57,66 @@ Num_Wat_Pocket = 2
 Pocket_Radius_Big = {radius_big}
 Pocket_Radius_Small = 1.4
 # I/O Settings
-XYZR_FileName = {file_prefix}.xyzr
+XYZR_FileName = {xyzr_file}
 Save_Cavities = false
 Save_Status_map = false
 Vertex_Atom_Info = false"""
 
-    PRM = open("{}.prm".format(file_prefix), 'w')
-    PRM.write(prm_template.format(file_prefix=file_prefix, **nanoshaper_args))
-    PRM.close()
-    args = [
-        "NanoShaper",
-        "{}.prm".format(file_prefix)
-    ]
-    if(quiet):
-        FNULL = open(os.devnull, 'w')
-        subprocess.call(args, stdout=FNULL, stderr=FNULL)
-        FNULL.close()
-    else:
-        subprocess.call(args)
-    
-    if(pockets_only):
-        # Do not return a mesh, exit from here
-        if(clean):
-            os.remove("{}.prm".format(file_prefix))
-            os.remove("{}.xyzr".format(file_prefix))
-        return
-    
-    # rename mesh file
-    os.rename("triangulatedSurf.off", "{}.off".format(file_prefix))
-    
-    # clean up NanoShaper files
-    if(clean):
-        os.remove("{}.prm".format(file_prefix))
-        os.remove("{}.xyzr".format(file_prefix))
-    else:
-        __move("{}.prm".format(file_prefix), basedir)
-        __move("{}.xyzr".format(file_prefix), basedir)
-    
-    # move meshfile to base dir
-    meshfile = "{}.off".format(file_prefix)
-    if(basedir != os.getcwd()):
-        __move(meshfile, basedir)
-        meshfile = os.path.join(basedir, meshfile)
+    # run NanoShaper in a private directory, it writes its output to fixed file names
+    with tempWorkDir(prefix="nanoshaper_") as wdir:
+        # generate coordinate file
+        if(not isinstance(atoms, list)):
+            atoms = atoms.get_atoms()
+        coordFile = os.path.join(wdir, "{}.xyzr".format(file_prefix))
+        FH = open(coordFile, "w")
+        for atom in atoms:
+            if((not hydrogens) and atom.element == "H"):
+                continue
+            atmn = atom.name
+            acoords = atom.get_coord()
+            radius = atom.xtra["radius"]
+            FH.write("{:7.4f} {:7.4f} {:7.4f} {:3.2f} {}\n".format(acoords[0], acoords[1], acoords[2], radius, atom.serial_number))
+        FH.close()
+        
+        prmFile = os.path.join(wdir, "{}.prm".format(file_prefix))
+        def runTool():
+            # reserve threads from the global budget for the duration of the run
+            with getThreadScheduler().threads(nanoshaper_args["num_threads"]) as num_threads:
+                PRM = open(prmFile, 'w')
+                PRM.write(prm_template.format(xyzr_file=coordFile, **dict(nanoshaper_args, num_threads=num_threads)))
+                PRM.close()
+                args = [
+                    "NanoShaper",
+                    prmFile
+                ]
+                if(quiet):
+                    FNULL = open(os.devnull, 'w')
+                    subprocess.call(args, stdout=FNULL, stderr=FNULL, cwd=wdir)
+                    FNULL.close()
+                else:
+                    subprocess.call(args, cwd=wdir)
+        
+        # reuse the output of an earlier run on the same atoms with the same parameters
+        params = {k: v for k, v in nanoshaper_args.items() if k != "num_threads"}
+        runCached(["NanoShaper"], runTool, wdir,
+            inputs=[coordFile],
+            params=dict(params, template=prm_template),
+            outputs=(["cav_tri*.off"] if pockets_only else ["triangulatedSurf.off"])
+        )
+        
+        # keep NanoShaper input files if requested
+        if(not clean):
+            if(os.path.exists(prmFile)):
+                __move(prmFile, basedir)
+            __move(coordFile, basedir)
+        
+        if(pockets_only):
+            # Do not return a mesh, move the pocket meshes to basedir and return their paths
+            return [__move(p, basedir) for p in sorted(glob.glob(os.path.join(wdir, "cav_tri*.off")))]
+        
+        # rename mesh file and move it to basedir
+        meshfile = os.path.join(wdir, "{}.off".format(file_prefix))
+        os.rename(os.path.join(wdir, "triangulatedSurf.off"), meshfile)
+        meshfile = __move(meshfile, basedir)
     
     return Mesh(handle=meshfile, name=file_prefix, **mesh_kwargs)
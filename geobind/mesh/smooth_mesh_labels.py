@@ -1,55 +1,69 @@
 import numpy as np
-import trimesh
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
-def smoothMeshLabels(edges, labels, num_classes, threshold=16.0, faces=None, area_faces=None):
-    nodes = np.arange(len(labels))
+def labelClusters(edges, labels, num_nodes):
+    """Find clusters of connected nodes that share the same label. Returns the cluster index of
+    every node, the label of every cluster and a mask of edges which join different clusters."""
+    edge_mask = (labels[edges[:,0]] == labels[edges[:,1]]) # edges where both nodes agree on class
+    e = edges[edge_mask]
+    A = coo_matrix((np.ones(len(e), dtype=bool), (e[:,0], e[:,1])), shape=(num_nodes, num_nodes))
+    num_clusters, cluster_idx = connected_components(A, directed=False)
+
+    cluster_label = np.empty(num_clusters, dtype=np.int32)
+    cluster_label[cluster_idx] = labels
+
+    return cluster_idx, cluster_label, ~edge_mask
+
+def smoothMeshLabels(edges, labels, num_classes, threshold=16.0, faces=None, area_faces=None, max_iterations=1):
+    """Re-assign clusters of same-class nodes whose area is below `threshold` to the class with the
+    largest total area among neighboring clusters. Each pass relabels all small clusters at once;
+    passes are repeated until no label changes or `max_iterations` is reached. Clusters with no
+    neighbors keep their label. `labels` is modified in place and returned."""
+    num_nodes = len(labels)
     # compute an area for each node
     if faces is not None and area_faces is not None:
         # use face areas to assign node weights
-        node_areas = np.zeros(len(nodes))
-        np.add.at(node_areas, faces[:, 0], area_faces/3)
-        np.add.at(node_areas, faces[:, 1], area_faces/3)
-        np.add.at(node_areas, faces[:, 2], area_faces/3)
+        node_areas = np.bincount(faces.reshape(-1), weights=np.repeat(area_faces/3, 3), minlength=num_nodes)
     else:
         # equal weighting for every node
-        node_areas = np.ones(len(nodes))
-    
-    # determine connected components based on class and adjacency and assign each cluster to a 
-    # class label
-    edge_mask = (labels[edges[:,0]] == labels[edges[:,1]]) # edges where both nodes agree on class 
-    clusters = trimesh.graph.connected_components(edges[edge_mask], nodes=nodes) # clusters of connected vertices that have same class
-    num_clusters = len(clusters)
-    cluster_idx = np.zeros_like(nodes) # map each node to its cluster
-    cluster_label = np.zeros(num_clusters, dtype=np.int32) # the class label for each cluster
-    for i in range(num_clusters):
-        cluster = clusters[i]
-        cluster_idx[cluster] = i
-        cluster_label[i] = labels[cluster[0]]
-    
-    # compute an area for each cluster
-    cluster_areas = np.zeros(num_clusters)
-    np.add.at(cluster_areas, cluster_idx, node_areas)
-    
-    # determine cluster adjancency
-    e0 = cluster_idx[edges[~edge_mask, 0]]
-    e1 = cluster_idx[edges[~edge_mask, 1]]
-    c_edges = np.stack((e0,  e1), axis=1)
-    unq, _ = trimesh.grouping.unique_rows(c_edges)
-    c_edges = c_edges[unq]
-    
-    # for each cluster, compute total area of neighboring clusters by class
-    cluster_neighbor_areas = np.zeros((num_clusters, num_classes))
-    ind = (c_edges[:,0], cluster_label[c_edges[:,1]])
-    np.add.at(cluster_neighbor_areas, ind, cluster_areas[c_edges[:,1]])
-    
-    # for clusters below threshold, re-assign class to that of max neighboring class area
-    small = (cluster_areas < threshold)
-    small_labels = np.argmax(cluster_neighbor_areas[small], axis=1)
-    cluster_label[small] = small_labels
-    
-    # map cluster labels back to vertex labels
-    for i in range(num_clusters):
-        cluster = clusters[i]
-        labels[cluster] = cluster_label[i]
-    
+        node_areas = np.ones(num_nodes)
+
+    for _ in range(max_iterations):
+        # determine connected components based on class and adjacency and assign each cluster to
+        # a class label
+        cluster_idx, cluster_label, cross = labelClusters(edges, labels, num_nodes)
+        num_clusters = len(cluster_label)
+
+        # compute an area for each cluster
+        cluster_areas = np.bincount(cluster_idx, weights=node_areas, minlength=num_clusters)
+        small = (cluster_areas < threshold)
+        if(not small.any()):
+            break
+
+        # determine cluster adjacency, converting to csr merges duplicate edges
+        c_adj = coo_matrix(
+            (np.ones(cross.sum(), dtype=bool), (cluster_idx[edges[cross,0]], cluster_idx[edges[cross,1]])),
+            shape=(num_clusters, num_clusters)
+        ).tocsr().tocoo()
+        c0, c1 = c_adj.row, c_adj.col
+
+        # for each cluster, compute total area of neighboring clusters by class
+        cluster_neighbor_areas = np.bincount(c0*num_classes + cluster_label[c1],
+            weights=cluster_areas[c1],
+            minlength=num_clusters*num_classes
+        ).reshape(num_clusters, num_classes)
+
+        # for clusters below threshold, re-assign class to that of max neighboring class area
+        small &= (cluster_neighbor_areas.sum(axis=1) > 0)
+        new_label = cluster_label.copy()
+        new_label[small] = np.argmax(cluster_neighbor_areas[small], axis=1)
+        changed = (new_label != cluster_label)
+        if(not changed.any()):
+            break
+
+        # map cluster labels back to node labels
+        update = changed[cluster_idx]
+        labels[update] = new_label[cluster_idx[update]]
+
     return labels
@@ -1,5 +1,6 @@
 import torch
 import torch.nn.functional as F
+from torch_scatter import scatter_mean
 from torch_geometric.nn import EdgePooling as EdgePoolingBase
 from torch_geometric.data import Data
 
@@ -25,6 +26,19 @@ class EdgePooling(EdgePoolingBase):
         
         self.reset_parameters()
     
+    @staticmethod
+    def pool_geometry(pos, face, cluster, num_nodes):
+        """Positions and faces of the pooled mesh, computed on the device of `cluster`. Every
+        cluster holds one or two nodes and is placed at their mean position, faces which collapse
+        are removed."""
+        pos = pos.to(cluster.device)
+        new_pos = scatter_mean(pos, cluster, dim=0, dim_size=num_nodes)
+        
+        new_face = cluster[face.to(cluster.device)]
+        fi = (new_face[0,:] == new_face[1,:]) | (new_face[0,:] == new_face[2,:]) | (new_face[1,:] == new_face[2,:])
+        
+        return new_pos, new_face[:,~fi]
+    
     def forward(self, x, data):
         r"""Forward computation which computes the raw edge score, normalizes
         it, and merges the edges.
@@ -51,7 +65,7 @@ class EdgePooling(EdgePoolingBase):
         
         # compute edge score
         if self.edge_dim is None:
-            torch.cat([x[edge_index[0]], x[edge_index[1]]], dim=-1)
+            e = torch.cat([x[edge_index[0]], x[edge_index[1]]], dim=-1)
         else:
             e = torch.cat([x[edge_index[0]], x[edge_index[1]], edge_attr], dim=-1)
         
@@ -64,20 +78,7 @@ class EdgePooling(EdgePoolingBase):
             x, edge_index, batch, e)
         
         # update the node positions and faces
-        ind1 = torch.empty_like(batch, device=torch.device('cpu'))
-        ind2 = torch.empty_like(batch, device=torch.device('cpu'))
-        
-        N = unpool_info.cluster.size(0)
-        ind1[unpool_info.cluster] = torch.arange(N)
-        ind2[unpool_info.cluster.flip((0))] = torch.arange(N-1, -1, -1)
-        new_pos = (data.pos[ind1] + data.pos[ind2])/2
-        
-        new_face = torch.empty_like(data.face)
-        new_face[0,:] = unpool_info.cluster[data.face[0,:]]
-        new_face[1,:] = unpool_info.cluster[data.face[1,:]]
-        new_face[2,:] = unpool_info.cluster[data.face[2,:]]
-        fi = (new_face[0,:] == new_face[1,:]) + (new_face[0,:] == new_face[2,:]) + (new_face[1,:] == new_face[2,:])
-        new_face = new_face[:,~fi]
+        new_pos, new_face = self.pool_geometry(data.pos, data.face, unpool_info.cluster, x.size(0))
         
         new_data = Data(edge_index=edge_index, pos=new_pos, face=new_face, batch=batch)
         new_data.unpool_info = unpool_info
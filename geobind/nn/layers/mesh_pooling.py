@@ -1,6 +1,3 @@
-# built-in modules
-import heapq as hq
-
 # third party modules
 import numpy as np
 import torch
@@ -11,6 +8,9 @@ from torch_geometric.utils import softmax
 from torch_geometric.nn import EdgePooling
 from torch_geometric.data import Data
 
+# geobind modules
+from geobind.mesh.mesh_hierarchy import greedyEdgeMatching
+
 #import trimesh
 
 class Decimator(object):
@@ -39,23 +39,23 @@ class Decimator(object):
         return Q # [V, 4, 4]
     
     @staticmethod
-    def computePairCost(E, Q, V, edge_scores=None, normalize_costs=False, alpha=-1):
-        Ne = len(E)
-        
+    def computePairCost(E, Q, V, edge_scores=None, normalize_costs=False, alpha=-1, min_det=1e-9):
         # first we must compute the solution of v(Qi + Qj) = [0,0,0,1]
         Qij = Q[E[:,0]] + Q[E[:,1]] # [E, 4, 4]
+        q = Qij.copy()
+        q[:,3,:] = 0
+        q[:,3,3] = 1
         
-        vij = np.empty((Ne, 4)) # optimal v for pair vi and vj
-        for ei in range(Ne):
-            try:
-                # attempt to solve for optimal position
-                q = Qij[ei].copy()
-                q[3,:] = 0
-                q[3,3] = 1
-                vij[ei] = np.dot(np.linalg.inv(q), _b)
-            except:
-                # the matrix q is not invertable, fall back to mean of vertex positions
-                vij[ei] = (V[E[ei,0]] + V[E[ei,1]])/2
+        # systems where det(q) is small relative to the scale of the quadric are singular (e.g.
+        # all adjacent faces are coplanar), these fall back to the mean of the vertex positions
+        scale = (np.trace(Qij[:,:3,:3], axis1=1, axis2=2)/3)**3
+        regular = np.abs(np.linalg.det(q)) > min_det*scale
+        
+        vij = (V[E[:,0]] + V[E[:,1]]).astype(np.float64)/2 # optimal v for pair vi and vj
+        if regular.any():
+            b = np.zeros((regular.sum(), 4, 1))
+            b[:,3] = 1
+            vij[regular] = np.linalg.solve(q[regular], b)[:,:,0]
         
         # compute cost vij'*(Qi + Qj)*vij - sij for every pair
         costs = (vij*(Qij*vij[:,np.newaxis]).sum(axis=2)).sum(axis=1)
@@ -68,7 +68,7 @@ class Decimator(object):
         
         return vij, costs
     
-    def __init__(self, data, edge_scores, check_manifold=True, normalize_costs=True, alpha=None):
+    def __init__(self, data, edge_scores, normalize_costs=True, alpha=None):
         # Get basic numpy arrays we will need
         self.V = data.pos.cpu().numpy()
         self.F = data.face.cpu().numpy().T
@@ -93,165 +93,32 @@ class Decimator(object):
         
         # Compute costs of edges
         self.Vopt, self.edge_costs = self.computePairCost(self.E, self.Q, self.V, edge_scores, normalize_costs=normalize_costs, alpha=alpha)
-        
-        if check_manifold:
-            # construct vertex-vertex adjacency
-            vertex_adjacency = [set() for _ in range(self.num_vertices)]
-            for i in range(self.num_edges):
-                source, target = self.E[i]
-                vertex_adjacency[source].add(target)
-                vertex_adjacency[target].add(source)
-            self.vertex_adjacency = vertex_adjacency
-            
-            # construct vertex-edge adjacency
-            vertex_edges = [{"i": [], "j": []} for _ in range(self.num_vertices)]
-            for i in range(self.num_edges):
-                source, target = self.E[i]
-                vertex_edges[source]["i"].append(i)
-                vertex_edges[source]["j"].append(0)
-                vertex_edges[target]["i"].append(i)
-                vertex_edges[target]["j"].append(1)
-            self.vertex_edges = vertex_edges
-        
-        # Other parameters
-        self.check_manifold = check_manifold
-        self._vi = self.num_vertices - 1 # vertex index counter
     
-    @property
-    def vertex_index(self):
-        self._vi += 1
-        return self._vi
-        
-    def mergeVertices(self, source, target):
-        # replace source and target with a new vertex index
-        v = self.vertex_index
-        
-        # update source edges
-        ei = self.vertex_edges[source]["i"]
-        ej = self.vertex_edges[source]["j"]
-        self.E[ei, ej] = v
-        
-        # update target edges
-        ei = self.vertex_edges[target]["i"]
-        ej = self.vertex_edges[target]["j"]
-        self.E[ei, ej] = v
-        
-        # update vertex adjacency
-        neighbors_source = self.vertex_adjacency[source]
-        neighbors_source.remove(target)
-        for n in neighbors_source:
-            self.vertex_adjacency[n].remove(source)
-            self.vertex_adjacency[n].add(v)
-        
-        neighbors_target = self.vertex_adjacency[target]
-        neighbors_target.remove(source)
-        for n in neighbors_target:
-            self.vertex_adjacency[n].remove(target)
-            self.vertex_adjacency[n].add(v)
-        
-        self.vertex_adjacency.append(neighbors_source.union(neighbors_target))
-    
-    def manifoldEdge(self, source, target):
-        # check size of the one-ring of the edge [source, target]
-        one_ring_intersection = self.vertex_adjacency[source].intersection(self.vertex_adjacency[target])
+    def contractEdges(self, check_manifold=True):
+        """Greedily contract edges in order of cost (see `geobind.mesh.mesh_hierarchy.greedyEdgeMatching`).
+        Returns the cluster index of every vertex, the contracted edges and the new vertex positions."""
+        cluster, contracted = greedyEdgeMatching(self.E, self.edge_costs, self.num_vertices, check_manifold=check_manifold)
         
-        return len(one_ring_intersection) == 2
-    
-    def contractEdge(self, ei):
-        source, target = self.E[ei]
-        # check if this contraction is valid
-        #if check_normals and checkNormalsFlip(ei, E, F, N, vopt, V):
-            # invalid, return empty list
-            #print("triangle flip!", E[ei])
-            #mesh = trimesh.Trimesh(vertices=V, faces=F, process=False)
-            #fmask = (F == E[ei][0]).any(axis=1) + (F == E[ei][1]).any(axis=1)
-            #mesh.update_faces(fmask)
-            #mesh.export("debug.off")
-            #exit(0)
-            #return [], []
-            #return False
-        
-        if self.check_manifold and not self.manifoldEdge(source, target):
-            # invalid, return empty list
-            #return [], []
-            #print(self.vertex_adjacency[source])
-            #print(self.vertex_adjacency[target])
-            #print(one_ring_intersection)
-            #print(self.V[list(one_ring_intersection)])
-            #print("non-manifold contraction!", self.E[ei])
-            #mesh = trimesh.Trimesh(vertices=self.V[:,0:3], faces=self.F, process=False)
-            #fmask = (self.F == target).any(axis=1) + (self.F == source).any(axis=1)
-            #mesh.update_faces(fmask)
-            #mesh.export("debug.off")
-            #exit(0)
-            return False
-        
-        # move source and target to optimal position
-        self.V[target] = self.Vopt[ei]
-        #V[source] = 0.0#vopt[ei]
-        
-        # update error metric
-        #q = Q[source] + Q[target]
-        #Q[target] = q
-        #Q[source] = q
-        
-        # update all edges containing source to now point to target
-        #emask = (E == source)
-        #E[emask[:,0], 0] = target
-        #E[emask[:,1], 1] = target
-        if self.check_manifold:
-            self.mergeVertices(source, target)
-        
-        #ei = np.argwhere(np.bitwise_or.reduce(emask, axis=1)).flatten()
-        #ei, fi = mesh.mergeNodes(source, target)
-        
-        # update costs and optimal positions of the updated edges containing target
-        #vij, costs = MeshPooling.computePairCost(E[ei], scores[ei], Q, V)
-        #vopt[ei] = vij
-        
-        #return ei, costs
-        return True
+        # contracted pairs move to their optimal position, the remaining vertices are kept
+        V = np.empty((cluster.max() + 1, 3), dtype=self.V.dtype)
+        V[cluster] = self.V[:,0:3]
+        V[:len(contracted)] = self.Vopt[contracted,0:3]
+        
+        return cluster, contracted, V
 
-class PriorityQueue(object):
-    def __init__(self, data):
-        self.heap = [] # list of entries arranged in a heap
-        self.entry_finder = {} # mapping of items to entries in heap
-        
-        # initialize the heap
-        for priority, item in data:
-            self.addItem(item, priority)
-    
-    def __len__(self):
-        return len(self.heap)
-    
-    def addItem(self, item, priority=0):
-        """Add a new item or update the priority of an existing item"""
-        if item in self.entry_finder:
-            self.removeItem(item)
-        entry = [priority, item, True]
-        self.entry_finder[item] = entry
-        hq.heappush(self.heap, entry)
+class MeshPooling(EdgePooling):
+    """Pool a mesh by quadric error edge contractions.
     
-    def removeItem(self, item):
-        """Mark an existing task as REMOVED.  Raise KeyError if not found."""
-        if item in self.entry_finder:
-            entry = self.entry_finder.pop(item)
-            entry[-1] = False
+    When `alpha` is None pooling depends only on the mesh geometry. If the data then holds a
+    precomputed hierarchy (see `geobind.mesh.getMeshHierarchy`) for this layer's `level`, it is 
+    used instead of decimating the mesh and `hierarchy_transform` is applied to the result in place
+    of `post_transform` (the latter is still used if no edge attributes were precomputed)."""
+    HIERARCHY_KEYS = ("cluster", "pos", "face", "edge_index", "edge_attr")
     
-    def popItem(self):
-        """Remove and return the lowest priority item. Return None if empty."""
-        while self.heap:
-            priority, item, valid = hq.heappop(self.heap)
-            if valid:
-                del self.entry_finder[item]
-                return item
-        
-        return None # heap is empty
-
-class MeshPooling(EdgePooling):
     def __init__(self, in_channels, edge_dim,
             dropout=0.0, pre_transform=None, post_transform=None, aggr="diff", alpha=-1.0,
-            check_normals=False, check_manifold=False, edge_score_method=None, add_to_edge_score=0.5
+            check_normals=False, check_manifold=False, edge_score_method=None, add_to_edge_score=0.5,
+            level=None, hierarchy_transform=None
         ):
         super().__init__(in_channels,
             add_to_edge_score=add_to_edge_score,
@@ -265,10 +132,12 @@ class MeshPooling(EdgePooling):
         self.check_normals = check_normals
         self.check_manifold = check_manifold
         self.alpha = alpha
+        self.level = level
         
         # edge feature transforms
         self.pre_transform = pre_transform
         self.post_transform = post_transform
+        self.hierarchy_transform = hierarchy_transform
         
         # learnable parameters
         if alpha is not None:
@@ -282,6 +151,17 @@ class MeshPooling(EdgePooling):
         if self.pre_transform:
             data = self.pre_transform(data)
         
+        if self.alpha is None and self.level is not None and getattr(data, "pool{}_cluster".format(self.level), None) is not None:
+            # pooling is fixed by geometry and was computed in advance
+            new_x, new_data = self.__pool_hierarchy__(x, data)
+            if new_data.edge_attr is None:
+                if self.post_transform:
+                    new_data = self.post_transform(new_data)
+            elif self.hierarchy_transform:
+                new_data = self.hierarchy_transform(new_data)
+            
+            return new_x, new_data
+        
         edge_index, edge_attr = data.edge_index, data.edge_attr
         
         if self.alpha is not None:
@@ -313,57 +193,61 @@ class MeshPooling(EdgePooling):
         
         return new_x, new_data
     
+    def __pool_hierarchy__(self, x, data):
+        key = "pool{}_".format(self.level)
+        cluster = data[key+"cluster"]
+        batch = data.batch
+        N = data[key+"pos"].size(0)
+        
+        # pooling reduces to index operations
+        new_x = scatter_add(x, cluster, dim=0, dim_size=N)
+        new_edge_score = x.new_ones((N, ))
+        new_batch = batch.new_empty(N).scatter_(0, cluster, batch)
+        
+        unpool_info = self.unpool_description(
+            edge_index=data.edge_index,
+            cluster=cluster,
+            batch=batch,
+            new_edge_score=new_edge_score
+        )
+        
+        new_data = Data(
+            edge_index=data[key+"edge_index"],
+            edge_attr=getattr(data, key+"edge_attr", None),
+            batch=new_batch,
+            pos=data[key+"pos"],
+            face=data[key+"face"]
+        )
+        new_data.unpool_info = unpool_info
+        
+        # pass on the remaining levels of the hierarchy
+        level = self.level + 1
+        while getattr(data, "pool{}_cluster".format(level), None) is not None:
+            for k in self.HIERARCHY_KEYS:
+                k = "pool{}_{}".format(level, k)
+                new_data[k] = getattr(data, k, None)
+            level += 1
+        
+        return new_x, new_data
+    
     def __merge_edges__(self, x, data, edge_score):
         # Torch tensors
         batch = data.batch
         edge_index = data.edge_index
         
-        # Get mesh decimator object
-        decimator = Decimator(data, edge_score, check_manifold=self.check_manifold, alpha=self.alpha)
-
-        # Build a priority queue to store edge costs and store which nodes are still valid
-        PQ = PriorityQueue([(decimator.edge_costs[i], i) for i in range(decimator.num_edges)])
-        
-        # Loop over edges, contracting edges and updating node positions
-        nodes_remaining = set(range(decimator.num_vertices))
-        cluster = torch.empty_like(batch, device=torch.device('cpu'))
-        new_edge_indices = []
-        i = 0
-        while len(PQ) > 0:
-            ei = PQ.popItem()
-            
-            # check if nodes have already been merged
-            source, target = decimator.E[ei]
-            if (source not in nodes_remaining) or (target not in nodes_remaining):
-                continue
-            
-            contracted = decimator.contractEdge(ei)
-            if contracted:
-                # this edge was successfully contracted
-                nodes_remaining.remove(source)
-                cluster[source] = i
-                if source != target:
-                    nodes_remaining.remove(target)
-                    cluster[target] = i
-                
-                ## update edge costs
-                #for j in range(len(updated_edges)):
-                    #PQ.addItem(updated_edges[j], updated_costs[j])
-                
-                i += 1
-                new_edge_indices.append(ei)
-        
-        # The remaining nodes are simply kept.
-        for node_idx in nodes_remaining:
-            cluster[node_idx] = i
-            i += 1
-        cluster = cluster.to(x.device)
+        # Get mesh decimator object and contract edges
+        decimator = Decimator(data, edge_score, alpha=self.alpha)
+        cluster, new_edge_indices, new_pos = decimator.contractEdges(check_manifold=self.check_manifold)
+        i = int(cluster.max()) + 1 # number of new vertices
+        num_remaining = i - len(new_edge_indices) # vertices which are simply kept
+        cluster = torch.as_tensor(cluster, device=x.device)
+        new_edge_indices = torch.as_tensor(new_edge_indices, device=x.device)
         
         # We compute the new features as an addition of the old ones.
         new_x = scatter_add(x, cluster, dim=0, dim_size=i)
         if edge_score is not None:
             new_edge_score = edge_score[new_edge_indices]
-            if len(nodes_remaining) > 0:
+            if num_remaining > 0:
                 remaining_score = x.new_ones(
                     (new_x.size(0) - len(new_edge_indices), )
                 )
@@ -386,12 +270,7 @@ class MeshPooling(EdgePooling):
         )
         
         # update mesh vertices
-        #vi = torch.empty_like(new_batch, device=torch.device('cpu'))
-        #vi[cluster] = torch.arange(cluster.size(0))
-        #new_pos = data.pos[vi][:,0:3]
-        vi = np.empty(i, dtype=np.int64)
-        vi[cluster.cpu().numpy()] = np.arange(decimator.num_vertices)
-        new_pos = torch.tensor(decimator.V[vi][:,0:3])
+        new_pos = torch.as_tensor(new_pos, dtype=data.pos.dtype, device=data.pos.device)
         
         # update faces
         new_face = torch.empty_like(data.face)
@@ -68,6 +68,9 @@ class NetConvPool(torch.nn.Module):
         
         if scale_edge_features:
             transforms.append(ScaleEdgeFeatures(method=scale_edge_features))
+            self.hierarchy_transform = ScaleEdgeFeatures(method=scale_edge_features) # applied to precomputed edge features
+        else:
+            self.hierarchy_transform = None
         self.transforms = Compose(transforms)
         
         # containers to hold the layers
@@ -102,7 +105,7 @@ class NetConvPool(torch.nn.Module):
         for i in range(depth):
             nout = level_hidden_size_down[i+1]
             # pooling
-            self.down_pools.append(self.makePool(nin, **pool_args))
+            self.down_pools.append(self.makePool(nin, level=i+1, **pool_args))
             
             # convolution
             for j in range(num_pool_convs):
@@ -130,14 +133,15 @@ class NetConvPool(torch.nn.Module):
             self.lin3 = nn.Linear(nout, nout)
             self.lin4 = nn.Linear(nout, nOut)
     
-    def makePool(self, nin, name=None, **kwargs):
+    def makePool(self, nin, name=None, level=None, **kwargs):
         if name == "EdgePool":
             # Edge Pooling
             return EdgePooling(nin, self.edge_dim, post_transform=self.transforms, **kwargs)
         
         if name == "MeshPool":
-            # Mesh pooling
-            return MeshPooling(nin, self.edge_dim, post_transform=self.transforms, check_manifold=True, **kwargs)
+            # Mesh pooling, uses the hierarchy stored with the data if one was precomputed
+            return MeshPooling(nin, self.edge_dim, post_transform=self.transforms, check_manifold=True,
+                level=level, hierarchy_transform=self.hierarchy_transform, **kwargs)
     
     def forward(self, data):
         skip_connections = []
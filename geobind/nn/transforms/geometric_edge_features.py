@@ -1,35 +1,164 @@
+# builtin modules
+import math
+
 # third party modules
 import torch
-from torch_geometric.utils import to_trimesh 
+from torch_geometric.utils import to_trimesh
 
 # geobind modules
 from geobind.mesh import getGeometricEdgeFeatures
 
+def unitize(v, threshold=1e-12):
+    norm = v.norm(dim=1, keepdim=True)
+
+    return torch.where(norm > threshold, v/norm.clamp(min=threshold), v)
+
+def vectorAngle(v1, v2):
+    return torch.atan2(torch.cross(v1, v2, dim=1).norm(dim=1), (v1*v2).sum(dim=1))
+
+def faceAngles(pos, face):
+    """Interior angle of each face [F, 3] at each of its vertices, zero for degenerate faces"""
+    u = unitize(pos[face[:,1]] - pos[face[:,0]])
+    v = unitize(pos[face[:,2]] - pos[face[:,0]])
+    w = unitize(pos[face[:,2]] - pos[face[:,1]])
+    a0 = vectorAngle(u, v)
+    a1 = vectorAngle(-u, w)
+    angles = torch.stack([a0, a1, math.pi - a0 - a1], dim=1)
+
+    return angles.masked_fill((angles < 1e-8).any(dim=1, keepdim=True), 0.0)
+
+def vertexNormals(pos, face, face_normals):
+    """Vertex normals as the sum of adjacent face normals weighted by the angle each face makes at
+    the vertex (the same weighting trimesh uses)"""
+    valid = (face_normals**2).sum(dim=1) > 0.5
+    face, face_normals = face[valid], face_normals[valid]
+    weights = faceAngles(pos, face)
+
+    normals = torch.zeros_like(pos)
+    for i in range(3):
+        normals.index_add_(0, face[:,i], weights[:,i:i+1]*face_normals)
+
+    return unitize(normals)
+
+def faceAdjacency(face, num_nodes):
+    """Unique undirected edges [E, 2], the pair of faces [E, 2] sharing each edge and the vertex of
+    each face not on the edge [E, 2]. Edges are ordered by their larger and then their smaller
+    vertex index, which is the order of `trimesh.Trimesh.edges_unique`."""
+    # every edge of every face
+    edges = torch.cat([face[:,[0,1]], face[:,[1,2]], face[:,[2,0]]], dim=0)
+    edges = torch.sort(edges, dim=1)[0]
+    edge_face = torch.arange(face.size(0), device=face.device).repeat(3)
+
+    # group the two faces of each edge
+    key = edges[:,1]*num_nodes + edges[:,0]
+    key, order = torch.sort(key, stable=True)
+    assert key.size(0) % 2 == 0 and torch.all(key[0::2] == key[1::2]), "every edge must be shared by exactly two faces"
+    edges = edges[order[0::2]]
+    adjacency = torch.sort(edge_face[order].view(-1, 2), dim=1)[0]
+
+    # the third vertex of each face
+    unshared = face[adjacency].sum(dim=2) - edges.sum(dim=1, keepdim=True)
+
+    return edges, adjacency, unshared
+
+def geometricEdgeFeatures(pos, face, directed_edges=True):
+    """Torch implementation of `geobind.mesh.getGeometricEdgeFeatures` acting on a (batched) mesh
+    given by vertex positions [N, 3] and faces [3, F]. Returns edge_index [2, E] and edge_attr
+    [E, D] in the same order and with the same columns as the numpy version."""
+    face = face.t()
+    v0, v1, v2 = pos[face[:,0]], pos[face[:,1]], pos[face[:,2]]
+    cross = torch.cross(v1 - v0, v2 - v0, dim=1)
+    face_normals = unitize(cross)
+    area_faces = cross.norm(dim=1)/2
+
+    edges, adjacency, unshared = faceAdjacency(face, pos.size(0))
+
+    # angle between face normals
+    edge_attr = [vectorAngle(face_normals[adjacency[:,0]], face_normals[adjacency[:,1]])]
+
+    # span of unshared vertices perpendicular to the edge
+    vec = pos[unshared[:,1]] - pos[unshared[:,0]]
+    ev = unitize(pos[edges[:,1]] - pos[edges[:,0]])
+    edge_attr.append((vec - (vec*ev).sum(dim=1, keepdim=True)*ev).norm(dim=1))
+
+    # area of the adjacent faces
+    edge_attr.append(area_faces[adjacency].sum(dim=1))
+
+    # sum of the angles <aub + <avb and <uav + <ubv that edge vertices make with 1 ring neighbors
+    vec_ua = pos[unshared[:,0]] - pos[edges[:,0]]
+    vec_ub = pos[unshared[:,1]] - pos[edges[:,0]]
+    vec_va = pos[unshared[:,0]] - pos[edges[:,1]]
+    vec_vb = pos[unshared[:,1]] - pos[edges[:,1]]
+    edge_attr.append(vectorAngle(vec_ua, vec_ub) + vectorAngle(vec_va, vec_vb))
+    edge_attr.append(vectorAngle(vec_ua, vec_va) + vectorAngle(vec_ub, vec_vb))
+
+    edge_attr = torch.stack(edge_attr, dim=1)
+    edge_index = edges.t()
+
+    if directed_edges:
+        edge_index = torch.cat([edge_index, edge_index.flip(0)], dim=1)
+        edge_attr = torch.cat([edge_attr, edge_attr], dim=0)
+
+        # point pair features
+        normals = vertexNormals(pos, face, face_normals)
+        n1, n2 = normals[edge_index[0]], normals[edge_index[1]]
+        e = pos[edge_index[1]] - pos[edge_index[0]]
+        edge_attr = torch.cat([
+            edge_attr,
+            torch.stack([
+                e.norm(dim=1), # length of edge
+                vectorAngle(n1, e), # angle between edge and n1
+                vectorAngle(n2, e), # angle between edge and n2
+                vectorAngle(n1, n2) # angle between normal 1 and normal 2
+            ], dim=1)
+        ], dim=1)
+
+    return edge_index, edge_attr
+
 class GeometricEdgeFeatures(object):
-    r"""docstring
+    r"""Compute geometric edge features (see `geobind.mesh.getGeometricEdgeFeatures`) from the
+    faces and positions of a mesh.
+
+    backend:
+        'torch'   - computed on the device of `pos` with batched tensor operations
+        'trimesh' - convert to a trimesh object and use the numpy implementation
+    If `skip_precomputed` is set, data which already holds edge_index and edge_attr (e.g. stored by
+    bin/processInterfaces.py) is passed through unchanged.
     """
 
-    def __init__(self, assign_edges=True):
+    def __init__(self, assign_edges=True, backend='torch', skip_precomputed=False):
         self.assign_edges=assign_edges
+        self.backend = backend
+        self.skip_precomputed = skip_precomputed
+        if backend not in ('torch', 'trimesh'):
+            raise ValueError("Unknown value of argument `backend`: {}".format(backend))
 
     def __call__(self, data):
+        if self.skip_precomputed and data.edge_index is not None and data.edge_attr is not None:
+            return data
         assert data.face is not None
         assert data.pos is not None
         assert data.pos.size(-1) == 3
-        assert data.face.size(0) == 3 
-        
-        mesh = to_trimesh(data)
-        edge_index, edge_attr = getGeometricEdgeFeatures(mesh)
-        
+        assert data.face.size(0) == 3
+
         if data.x is not None:
             device = data.x.device
         else:
             device = data.edge_index.device
-        data.edge_attr = torch.tensor(edge_attr, dtype=torch.float32).to(device)
-        if self.assign_edges:
-            data.edge_index = torch.tensor(edge_index.T, dtype=torch.int64).to(device)
-        
+
+        if self.backend == 'torch':
+            edge_index, edge_attr = geometricEdgeFeatures(data.pos.to(device), data.face.to(device))
+            data.edge_attr = edge_attr.to(torch.float32)
+            if self.assign_edges:
+                data.edge_index = edge_index
+        else:
+            mesh = to_trimesh(data)
+            edge_index, edge_attr = getGeometricEdgeFeatures(mesh)
+            data.edge_attr = torch.tensor(edge_attr, dtype=torch.float32).to(device)
+            if self.assign_edges:
+                data.edge_index = torch.tensor(edge_index.T, dtype=torch.int64).to(device)
+
         return data
-    
+
     def __repr__(self):
-        return '{}()'.format(self.__class__.__name__)
+        return '{}(backend={})'.format(self.__class__.__name__, self.backend)
@@ -11,6 +11,7 @@ from sklearn.preprocessing import StandardScaler
 
 # geobind modules
 from geobind.nn.utils import balancedClassIndices
+from geobind.utils import FeatureStore, decodeArray
 
 class NodeScaler(object):
     def __init__(self):
@@ -26,6 +27,55 @@ class NodeScaler(object):
     def scale(self, array):
         return self.scaler.transform(array)
 
+class MeshData(Data):
+    """Data object which may also hold a precomputed mesh pooling hierarchy (see 
+    `geobind.mesh.getMeshHierarchy`). Attributes 'pool<l>_<name>' index the vertices of level l
+    and are incremented accordingly when batching."""
+    def __inc__(self, key, value, *args, **kwargs):
+        if key.startswith("pool") and key.endswith(("_cluster", "_face", "_edge_index")):
+            return self["{}_pos".format(key.split("_")[0])].size(0)
+        return super().__inc__(key, value, *args, **kwargs)
+    
+    def __cat_dim__(self, key, value, *args, **kwargs):
+        if key.startswith("pool") and key.endswith(("_face", "_edge_index")):
+            return -1
+        return super().__cat_dim__(key, value, *args, **kwargs)
+
+def _loadHierarchy(data, data_arrays):
+    """Add any pooling hierarchy stored in the data arrays to a data object"""
+    for key in data_arrays.files:
+        if not key.startswith("pool") or key.endswith(("__scale", "__offset")):
+            continue
+        if key.endswith(("_face", "_edge_index")):
+            data[key] = torch.tensor(data_arrays[key].T, dtype=torch.int64)
+        elif key.endswith("_cluster"):
+            data[key] = torch.tensor(data_arrays[key], dtype=torch.int64)
+        else:
+            data[key] = torch.tensor(decodeArray(data_arrays, key), dtype=torch.float32)
+
+def _loadDataFile(f):
+    """Open a data file written by bin/processInterfaces.py, either an npz file or a feature store
+    directory (see `geobind.utils.FeatureStore`)"""
+    if FeatureStore.isStore(f):
+        return FeatureStore(f)
+    return np.load(f)
+
+def _loadFeatures(data_arrays, feature_columns=None):
+    """The feature matrix, restricted to the given feature names or indices. A feature store only
+    reads the selected columns from disk. Features stored with reduced precision are decoded."""
+    if feature_columns is None:
+        return decodeArray(data_arrays, 'X')
+    names = [str(_) for _ in data_arrays['feature_names']]
+    idx = [c if isinstance(c, (int, np.integer)) else names.index(c) for c in feature_columns]
+    if isinstance(data_arrays, FeatureStore):
+        X = data_arrays.read('X', columns=idx)
+    else:
+        X = data_arrays['X'][:,idx]
+    if 'X__scale' in data_arrays:
+        X = X.astype(np.float32)*data_arrays['X__scale'][idx].astype(np.float32) + data_arrays['X__offset'][idx].astype(np.float32)
+    
+    return X
+
 class ClassificationDatasetMemory(InMemoryDataset):
     def __init__(self, data_files, nc, labels_key, data_dir,
             save_dir=None,
@@ -37,7 +87,8 @@ class ClassificationDatasetMemory(InMemoryDataset):
             remove_mask=False,
             unmasked_class=0,
             scale=True,
-            scaler=None
+            scaler=None,
+            feature_columns=None
         ):
         if(save_dir is None):
             save_dir = data_dir
@@ -52,6 +103,7 @@ class ClassificationDatasetMemory(InMemoryDataset):
         self.unmasked_class = unmasked_class
         self.scale = scale
         self.scaler = scaler
+        self.feature_columns = feature_columns
         self.transform = transform
         self.pre_filter = pre_filter
         self.pre_transform = pre_transform
@@ -80,6 +132,8 @@ class ClassificationDatasetMemory(InMemoryDataset):
             self.unmasked_class,
             self.scale
         ]
+        if self.feature_columns is not None:
+            args.append(self.feature_columns)
         args = "".join([str(_) for _ in args] + list(sorted(self.data_files)))
         m.update(args.encode('utf-8'))
         self.hash_name = m.hexdigest()
@@ -101,6 +155,7 @@ class ClassificationDatasetMemory(InMemoryDataset):
             unmasked_class=self.unmasked_class,
             scaler=self.scaler,
             scale=self.scale,
+            feature_columns=self.feature_columns,
             pre_filter=self.pre_filter,
             pre_transform=self.pre_transform,
             transform=self.transform
@@ -124,13 +179,14 @@ def _processData(data_files, nc, labels_key,
         scale=True,
         transform=None,
         pre_filter=None,
-        pre_transform=None
+        pre_transform=None,
+        feature_columns=None
     ):
     data_list = []
     
     # read and process datafiles
     for f in data_files:
-        data_arrays = np.load(f)
+        data_arrays = _loadDataFile(f)
         
         if remove_mask:
             # remove any previous masking
@@ -145,16 +201,21 @@ def _processData(data_files, nc, labels_key,
         else:
             raise ValueError("Unrecognized value for `balance` keyword: {}".format(balance))
         
-        data = Data(
-            x=torch.tensor(data_arrays['X'], dtype=torch.float32),
+        data = MeshData(
+            x=torch.tensor(_loadFeatures(data_arrays, feature_columns), dtype=torch.float32),
             y=torch.tensor(data_arrays[labels_key], dtype=torch.int64),
-            pos=torch.tensor(data_arrays['V'], dtype=torch.float32),
-            norm=torch.tensor(data_arrays['N'], dtype=torch.float32),
+            pos=torch.tensor(decodeArray(data_arrays, 'V'), dtype=torch.float32),
+            norm=torch.tensor(decodeArray(data_arrays, 'N'), dtype=torch.float32),
             face=torch.tensor(data_arrays['F'].T, dtype=torch.int64),
             edge_attr=None,
             edge_index=None
         )
         data.mask = torch.tensor(idxb, dtype=torch.bool)
+        if 'edge_index' in data_arrays and 'edge_attr' in data_arrays:
+            # use precomputed geometric edge features
+            data.edge_index = torch.tensor(data_arrays['edge_index'].T, dtype=torch.int64)
+            data.edge_attr = torch.tensor(decodeArray(data_arrays, 'edge_attr'), dtype=torch.float32)
+        _loadHierarchy(data, data_arrays)
         data_list.append(data)
     
     # filter data
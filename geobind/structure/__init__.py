@@ -1,6 +1,6 @@
 from .clean_protein import ResidueMutator, cleanProtein
 from .get_atom_charge_radius import getAtomChargeRadius
-from .get_atom_sesa import getAtomSESA
+from .get_atom_sesa import getAtomSESA, getAtomSESAFromMesh, compareAtomAreas
 from .get_atom_sasa import getAtomSASA
 from .get_dssp import getDSSP
 from .get_achtley_factors import getAchtleyFactors
@@ -17,6 +17,8 @@ __all__ = [
     "ResidueMutator",
     "getAtomChargeRadius",
     "getAtomSESA",
+    "getAtomSESAFromMesh",
+    "compareAtomAreas",
     "getAtomSASA",
     "getDSSP",
     "getAchtleyFactors",
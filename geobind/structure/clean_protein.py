@@ -12,6 +12,7 @@ Bio.PDB.Atom.DisorderedAtom.copy=myCopy
 # built in modules
 import logging
 import os
+import shutil
 import subprocess
 
 # third party modules
@@ -20,6 +21,7 @@ from Bio.PDB import PDBParser
 from Bio.SVDSuperimposer import SVDSuperimposer
 
 # geobind modules
+from geobind.utils import tempWorkDir, runCached
 from .strip_hydrogens import stripHydrogens
 from .data import data
 from .structure import StructureData
@@ -142,10 +144,11 @@ def heavyAtomCount(residue):
 
 def cleanProtein(
         structure, mutator=None, regexes=None, hydrogens=True, pdb2pqr=True,
-        replace_hydrogens=False, add_charge_radius=True, keepPQR=True, min_radius=0.6
+        replace_hydrogens=False, add_charge_radius=True, keepPQR=True, min_radius=0.6, basedir='.'
     ):
     """ Perform any operations needed to modify the structure or sequence of a protein
-    chain.
+    chain. PDB2PQR is run in a private directory and the PQR file is moved to `basedir` if
+    `keepPQR` is set.
     """
     # set up needed objects
     if regexes is None:
@@ -194,54 +197,59 @@ def cleanProtein(
             stripHydrogens(structure)
         
         prefix = structure.name
-        # Write chain to temp file
-        pdbFile = "{}_temp.pdb".format(prefix)
-        pqrFile = "{}.pqr".format(prefix)
-        structure.save(pdbFile)
-        
-        # Run PDB2PQR
-        FNULL = open(os.devnull, 'w')
-        subprocess.call([
-                'pdb2pqr',
-                '--ff=amber',
-                '--chain',
-                pdbFile,
-                pqrFile
-            ],
-            stdout=FNULL,
-            stderr=FNULL
-        )
-        FNULL.close()
-        
-        parser = PDBParser(PERMISSIVE=1, QUIET=True)
-        if(not os.path.exists(pqrFile)):
-            raise FileNotFoundError("No PQR file was produced ({}). Try manually running PDB2PQR on the pbdfile file '{}' and verify output.".format(pqrFile, pdbFile))
-        structure = parser.get_structure("repaired", pqrFile)
-        model = structure[0]
-        
-        # Get radius and charge from PQR file
-        for line in open(pqrFile):
-            if(line[0:4] != "ATOM"):
-                continue
-            cid = line[21]
-            num = int(line[22:26].strip())
-            ins = line[26]
-            rid = (" ", num, ins)
-            crg = float(line[55:62].strip())
-            vdw = float(line[63:69].strip())
-            atm = line[12:16].strip()
-            if vdw == 0.0:
-                vdw = min_radius # 0 radius atoms causes issues - set to a minimum of 0.6
-            if rid in model[cid]:
-                if add_charge_radius and (atm in model[cid][rid]):
-                    model[cid][rid][atm].xtra["charge"] = crg 
-                    model[cid][rid][atm].xtra["radius"] = vdw
-        structure = StructureData(model, name=prefix)
+        with tempWorkDir(prefix="pdb2pqr_") as wdir:
+            # Write chain to temp file
+            pdbFile = os.path.join(wdir, "{}_temp.pdb".format(prefix))
+            pqrFile = os.path.join(wdir, "{}.pqr".format(prefix))
+            structure.save(pdbFile)
+            
+            # Run PDB2PQR, or reuse its output for an identical input file
+            def runPDB2PQR():
+                FNULL = open(os.devnull, 'w')
+                subprocess.call([
+                        'pdb2pqr',
+                        '--ff=amber',
+                        '--chain',
+                        pdbFile,
+                        pqrFile
+                    ],
+                    stdout=FNULL,
+                    stderr=FNULL,
+                    cwd=wdir
+                )
+                FNULL.close()
+            runCached(["pdb2pqr"], runPDB2PQR, wdir, inputs=[pdbFile], params={"ff": "amber", "chain": True}, outputs=[os.path.basename(pqrFile)])
+            
+            parser = PDBParser(PERMISSIVE=1, QUIET=True)
+            if(not os.path.exists(pqrFile)):
+                # keep the input file around for inspection
+                pdbFile = shutil.copy(pdbFile, basedir)
+                raise FileNotFoundError("No PQR file was produced ({}). Try manually running PDB2PQR on the pbdfile file '{}' and verify output.".format(pqrFile, pdbFile))
+            structure = parser.get_structure("repaired", pqrFile)
+            model = structure[0]
+            
+            # Get radius and charge from PQR file
+            for line in open(pqrFile):
+                if(line[0:4] != "ATOM"):
+                    continue
+                cid = line[21]
+                num = int(line[22:26].strip())
+                ins = line[26]
+                rid = (" ", num, ins)
+                crg = float(line[55:62].strip())
+                vdw = float(line[63:69].strip())
+                atm = line[12:16].strip()
+                if vdw == 0.0:
+                    vdw = min_radius # 0 radius atoms causes issues - set to a minimum of 0.6
+                if rid in model[cid]:
+                    if add_charge_radius and (atm in model[cid][rid]):
+                        model[cid][rid][atm].xtra["charge"] = crg 
+                        model[cid][rid][atm].xtra["radius"] = vdw
+            structure = StructureData(model, name=prefix)
             
-        # clean up
-        os.remove(pdbFile)
-        if(not keepPQR):
-            os.remove(pqrFile)
+            # keep the PQR file, everything else is removed with the directory
+            if(keepPQR):
+                pqrFile = shutil.move(pqrFile, os.path.join(basedir, os.path.basename(pqrFile)))
     
     # remove hydrogens if requested
     if(not hydrogens):
@@ -5,6 +5,7 @@ import os
 import freesasa
 
 # geobind modules
+from geobind.utils import tempWorkDir
 from .data import data
 
 class Radius(freesasa.Classifier):
@@ -78,16 +79,14 @@ class Radius(freesasa.Classifier):
             return name
 
 def getFreeSASAStructureFromModel(structure, classifier=None):
-    outFile = "gsfm.temp.pdb"
-    structure.save(outFile)
-    
-    if(classifier is not None):
-        freesasa_structure = freesasa.Structure(outFile, classifier=classifier)
-    else:
-        freesasa_structure = freesasa.Structure(outFile)
-    
-    if(os.access(outFile, os.R_OK)):
-        os.remove(outFile)
+    with tempWorkDir(prefix="freesasa_") as wdir:
+        outFile = os.path.join(wdir, "gsfm.temp.pdb")
+        structure.save(outFile)
+        
+        if(classifier is not None):
+            freesasa_structure = freesasa.Structure(outFile, classifier=classifier)
+        else:
+            freesasa_structure = freesasa.Structure(outFile)
     
     return freesasa_structure
     
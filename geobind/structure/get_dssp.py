@@ -1,7 +1,20 @@
+# builtin modules
+import os
+import json
+
+# third party modules
 from Bio.PDB.DSSP import DSSP
 
-def getDSSP(model, PDBFileName, dssp_map=None, feature_name='secondary_structure', formatstr="{}({})"):
-    
+# geobind modules
+from geobind.utils import tempWorkDir, runCached
+
+def _dsspKey(cid, rid):
+    return "{}|{}|{}|{}".format(cid, *rid)
+
+def getDSSP(model, PDBFileName=None, dssp_map=None, feature_name='secondary_structure', formatstr="{}({})"):
+    """Assign secondary structure to every atom. If `PDBFileName` is not given the structure is
+    written to a private directory for DSSP to read."""
+
     if(dssp_map is None):
         # map eight ss types to three
         dssp_map = {
@@ -15,17 +28,27 @@ def getDSSP(model, PDBFileName, dssp_map=None, feature_name='secondary_structure
             "-": formatstr.format(feature_name, "L")
         }
     
-    # run DSSP using the DSSP class from BioPython
-    dssp = DSSP(model, PDBFileName)
+    # run DSSP using the DSSP class from BioPython. The assignment is written to a file so it can
+    # be reused from the tool cache for an identical PDB file.
+    with tempWorkDir(prefix="dssp_") as wdir:
+        if(PDBFileName is None):
+            PDBFileName = model.save(os.path.join(wdir, "{}.pdb".format(model.name)))
+        ssFile = os.path.join(wdir, "dssp.json")
+        def runDSSP():
+            dssp = DSSP(model, PDBFileName)
+            with open(ssFile, "w") as FH:
+                json.dump({_dsspKey(*k): dssp[k][2] for k in dssp.keys()}, FH)
+        runCached(["dssp"], runDSSP, wdir, inputs=[PDBFileName], outputs=[os.path.basename(ssFile)])
+        with open(ssFile) as FH:
+            dssp = json.load(FH)
     
     # store secondary structure in each atom property dict
     for chain in model:
         cid = chain.get_id()
         for residue in chain:
-            rid = residue.get_id()
-            dkey = (cid, rid)
+            dkey = _dsspKey(cid, residue.get_id())
             if(dkey in dssp):
-                ss = dssp_map[dssp[dkey][2]]
+                ss = dssp_map[dssp[dkey]]
             else:
                 ss = dssp_map['-']
             
@@ -6,10 +6,13 @@ import shutil
 import logging 
 
 # geobind modules
-from geobind.utils import Interpolator, logOutput
+from geobind.utils import Interpolator, logOutput, tempWorkDir, getThreadScheduler, runCached
 
-def padCoordinates(pqrFile):
-    padded = open("tmp.pqr", "w")
+def padCoordinates(pqrFile, outFile=None):
+    """Write a copy of a PQR file with separated coordinate fields to `outFile`, or rewrite
+    `pqrFile` in place if not given"""
+    tmpFile = "{}.padded".format(pqrFile) if outFile is None else outFile
+    padded = open(tmpFile, "w")
     with open(pqrFile) as FH:
         for line in FH:
             s = line[:30]
@@ -19,62 +22,23 @@ def padCoordinates(pqrFile):
             z = line[46:54].strip()
             padded.write("{}{:>9s}{:>9s}{:>9s}{}".format(s, x, y, z, e))
     padded.close()
-    shutil.move("tmp.pqr", pqrFile)
-
-def runAPBS(structure, prefix="tmp", basedir='.', quiet=True, pqr=None, clean=True):
-    """ run APBS and return potential """
-    if(pqr is None):
-        tmp = os.path.join(basedir, "{}.pdb".format(prefix))
-        pqr = os.path.join(basedir, "{}.pqr".format(prefix))
-    
-        # write the chain to file
-        structure.save(tmp)
-    
-        # run PDB2PQR
-        logging.info("No PQR File Given. Running PDB2PQR on file: %s", tmp)
-        outpt = subprocess.check_output([
-            'pdb2pqr',
-            '--ff=amber',
-            '--chain',
-            tmp,
-            pqr
-            ],
-            stderr=subprocess.STDOUT
-        )
-        #logOutput(outpt, logging.info)
-    
-    # APBS will have issues reading PQR file if coordinate fields touch
-    padCoordinates(pqr)
-    
-    # run psize to get grid length parameters
-    stdout = subprocess.getoutput("psize --space 0.3 '{}'".format(pqr))
-    cglenMatch = re.search('Coarse grid dims = (\d*\.?\d+) x (\d*\.?\d+) x (\d*\.?\d+) A', stdout, re.MULTILINE)
-    cgx = cglenMatch.group(1)
-    cgy = cglenMatch.group(2)
-    cgz = cglenMatch.group(3)
-    fglenMatch = re.search('Fine grid dims = (\d*\.?\d+) x (\d*\.?\d+) x (\d*\.?\d+) A', stdout, re.MULTILINE)
-    fgx = fglenMatch.group(1)
-    fgy = fglenMatch.group(2)
-    fgz = fglenMatch.group(3)
-    dimeMatch = re.search('Num. fine grid pts. = (\d+) x (\d+) x (\d+)', stdout, re.MULTILINE)
-    dx = dimeMatch.group(1)
-    dy = dimeMatch.group(2)
-    dz = dimeMatch.group(3)
+    if(outFile is None):
+        shutil.move(tmpFile, pqrFile)
+        return pqrFile
     
-    # run APBS
-    pot = os.path.join(basedir, prefix+"_potential")
-    acc = os.path.join(basedir, prefix+"_access")
-    input_file = """READ
-    mol pqr {}
+    return outFile
+
+APBS_INPUT_TEMPLATE = """READ
+    mol pqr {pqr}
 END
 
 ELEC
     mg-auto
     mol 1
     
-    dime {}
-    cglen {}
-    fglen {}
+    dime {dime}
+    cglen {cglen}
+    fglen {fglen}
     cgcent mol 1
     fgcent mol 1
     
@@ -92,31 +56,100 @@ ELEC
     ion charge +1 conc 0.15 radius 2.0
     ion charge -1 conc 0.15 radius 1.8
     
-    write pot dx {}
-    write smol dx {}
-END""".format(
-        pqr,
-        " ".join([dx, dy, dx]),
-        " ".join([cgx, cgy, cgz]),
-        " ".join([fgx, fgy, fgz]),
-        pot,
-        acc
-    )
-    inFile = os.path.join(basedir, "{}.in".format(prefix))
-    FH = open(inFile, "w")
-    FH.write(input_file)
-    FH.close()
-    
-    logging.info("Running APBS on input file: %s", inFile)
-    outpt = subprocess.check_output(["apbs", inFile], stderr=subprocess.STDOUT)
-    #logOutput(outpt, logging.info)
-    
-    # cleanup
-    if(clean):
-        if(os.path.exists(os.path.join(basedir, "{}.pdb".format(prefix)))):
-            os.remove(os.path.join(basedir, "{}.pdb".format(prefix)))
-        os.remove(inFile)
-        if(os.access('io.mc', os.R_OK)):
-            os.remove('io.mc')
+    write pot dx {pot}
+    write smol dx {acc}
+END"""
+
+def runAPBS(structure, prefix="tmp", basedir='.', quiet=True, pqr=None, clean=True, num_threads=None):
+    """ run APBS and return potential. All tools are run in a private directory, only the 
+    potential and accessibility maps (and a generated PQR file) are written to `basedir`. APBS
+    is given `num_threads` OpenMP threads, reserved from the global thread budget. Outputs are
+    reused from the tool cache (see `geobind.utils.runCached`) for identical PQR input. """
+    basedir = os.path.abspath(basedir)
+    with tempWorkDir(prefix="apbs_") as wdir:
+        if(pqr is None):
+            tmp = os.path.join(wdir, "{}.pdb".format(prefix))
+            pqr = os.path.join(wdir, "{}.pqr".format(prefix))
+            
+            # write the chain to file
+            structure.save(tmp)
+            
+            # run PDB2PQR
+            logging.info("No PQR File Given. Running PDB2PQR on file: %s", tmp)
+            def runPDB2PQR():
+                outpt = subprocess.check_output([
+                    'pdb2pqr',
+                    '--ff=amber',
+                    '--chain',
+                    tmp,
+                    pqr
+                    ],
+                    stderr=subprocess.STDOUT,
+                    cwd=wdir
+                )
+                #logOutput(outpt, logging.info)
+            runCached(["pdb2pqr"], runPDB2PQR, wdir, inputs=[tmp], params={"ff": "amber", "chain": True}, outputs=[os.path.basename(pqr)])
+            pqr = shutil.move(pqr, os.path.join(basedir, os.path.basename(pqr)))
+            if(not clean):
+                shutil.move(tmp, os.path.join(basedir, os.path.basename(tmp)))
+        
+        # APBS will have issues reading PQR file if coordinate fields touch
+        pqr = padCoordinates(pqr, os.path.join(wdir, "{}_padded.pqr".format(prefix)))
+        
+        # maps are written to the work directory and moved to basedir when done
+        pot = prefix+"_potential"
+        acc = prefix+"_access"
+        inFile = os.path.join(wdir, "{}.in".format(prefix))
+        
+        def runTools():
+            # run psize to get grid length parameters
+            stdout = subprocess.run(["psize", "--space", "0.3", pqr],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                cwd=wdir
+            ).stdout
+            cglenMatch = re.search('Coarse grid dims = (\d*\.?\d+) x (\d*\.?\d+) x (\d*\.?\d+) A', stdout, re.MULTILINE)
+            cgx = cglenMatch.group(1)
+            cgy = cglenMatch.group(2)
+            cgz = cglenMatch.group(3)
+            fglenMatch = re.search('Fine grid dims = (\d*\.?\d+) x (\d*\.?\d+) x (\d*\.?\d+) A', stdout, re.MULTILINE)
+            fgx = fglenMatch.group(1)
+            fgy = fglenMatch.group(2)
+            fgz = fglenMatch.group(3)
+            dimeMatch = re.search('Num. fine grid pts. = (\d+) x (\d+) x (\d+)', stdout, re.MULTILINE)
+            dx = dimeMatch.group(1)
+            dy = dimeMatch.group(2)
+            dz = dimeMatch.group(3)
+            
+            # run APBS
+            input_file = APBS_INPUT_TEMPLATE.format(
+                pqr=os.path.basename(pqr),
+                dime=" ".join([dx, dy, dx]),
+                cglen=" ".join([cgx, cgy, cgz]),
+                fglen=" ".join([fgx, fgy, fgz]),
+                pot=pot,
+                acc=acc
+            )
+            FH = open(inFile, "w")
+            FH.write(input_file)
+            FH.close()
+            
+            logging.info("Running APBS on input file: %s", inFile)
+            with getThreadScheduler().threads(num_threads) as n:
+                env = dict(os.environ, OMP_NUM_THREADS=str(n))
+                outpt = subprocess.check_output(["apbs", inFile], stderr=subprocess.STDOUT, cwd=wdir, env=env)
+            #logOutput(outpt, logging.info)
+        runCached(["psize", "apbs"], runTools, wdir,
+            inputs=[pqr],
+            params={"space": 0.3, "template": APBS_INPUT_TEMPLATE},
+            outputs=[pot+".dx", acc+".dx"]
+        )
+        pot = shutil.move(os.path.join(wdir, pot+".dx"), os.path.join(basedir, pot+".dx"))
+        acc = shutil.move(os.path.join(wdir, acc+".dx"), os.path.join(basedir, acc+".dx"))
+        
+        # keep the input files if requested, everything else (io.mc etc.) is removed with the directory
+        if(not clean and os.path.exists(inFile)):
+            shutil.move(inFile, os.path.join(basedir, os.path.basename(inFile)))
     
-    return Interpolator("{}.dx".format(pot)), Interpolator("{}.dx".format(acc))
+    return Interpolator(pot), Interpolator(acc)
@@ -3,11 +3,41 @@ from .one_hot_encode import oneHotEncode
 from .clip_outliers import clipOutliers
 from .generate_uniform_sphere_points import generateUniformSpherePoints
 from .log_output import logOutput
+from .temp_work_dir import tempWorkDir
+from .thread_scheduler import ThreadScheduler, getThreadScheduler, setThreadScheduler, availableCores
+from .stage_cache import StageCache, hashArrays
+from .feature_store import FeatureStore
+from .tool_cache import ToolCache, getToolCache, setToolCache, runCached, toolVersion
+from .profiler import Profiler, problemSize, summarizeProfiles, formatProfileSummary
+from .storage_precision import encodeArrays, decodeArray, decodeArrays, summarizePrecisionReport
+from .work_queue import WorkQueue
 
 __all__ = [
     "Interpolator",
     "oneHotEncode",
     "clipOutliers",
     "generateUniformSpherePoints",
-    "logOutput"
+    "logOutput",
+    "tempWorkDir",
+    "ThreadScheduler",
+    "getThreadScheduler",
+    "setThreadScheduler",
+    "availableCores",
+    "StageCache",
+    "hashArrays",
+    "FeatureStore",
+    "encodeArrays",
+    "decodeArray",
+    "decodeArrays",
+    "summarizePrecisionReport",
+    "ToolCache",
+    "getToolCache",
+    "setToolCache",
+    "runCached",
+    "toolVersion",
+    "Profiler",
+    "problemSize",
+    "summarizeProfiles",
+    "formatProfileSummary",
+    "WorkQueue"
 ]
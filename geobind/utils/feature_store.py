@@ -0,0 +1,232 @@
+# builtin modules
+import os
+import io
+import json
+import zlib
+import shutil
+import hashlib
+
+# third party modules
+import numpy as np
+
+def _packChunk(array, level):
+    buf = io.BytesIO()
+    np.save(buf, array, allow_pickle=(array.dtype == object))
+
+    return zlib.compress(buf.getvalue(), level)
+
+def _unpackChunk(data):
+    return np.load(io.BytesIO(zlib.decompress(data)), allow_pickle=True)
+
+def _arrayHash(array):
+    if(array.dtype == object):
+        return hashlib.sha1(repr(array.tolist()).encode("utf-8")).hexdigest()
+    h = hashlib.sha1("{}:{}".format(array.dtype.str, array.shape).encode("utf-8"))
+    h.update(np.ascontiguousarray(array).tobytes())
+
+    return h.hexdigest()
+
+class FeatureStore(object):
+    """A directory holding the named arrays of one structure, as an alternative to a single npz
+    file which has to be rewritten whenever one array changes. Arrays are split along their first
+    axis into chunks of `chunk_size` rows which are compressed independently. Arrays written with
+    column names (e.g. the feature matrix X) store every column separately, so single columns can
+    be read, added or replaced without touching the others.
+
+    The layout is
+        <path>/meta.json               - dtype, shape, columns and content hash of every array
+        <path>/<name>/<i>.npy.z        - chunk i of a plain array
+        <path>/<name>/<c>_<i>.npy.z    - chunk i of column c of a columnar array
+
+    Reading mirrors `np.load` of an npz file: `store[name]` returns a full array and `store.files`
+    lists the array names, so code reading npz files works with a store unchanged."""
+    META = "meta.json"
+
+    def __init__(self, path, chunk_size=65536, compression_level=6):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        os.makedirs(path, exist_ok=True)
+
+        meta_file = os.path.join(path, self.META)
+        if(os.path.exists(meta_file)):
+            with open(meta_file) as FH:
+                self.meta = json.load(FH)
+        else:
+            self.meta = {"arrays": {}}
+
+    @staticmethod
+    def isStore(path):
+        return os.path.isdir(path) and os.path.exists(os.path.join(path, FeatureStore.META))
+
+    @property
+    def files(self):
+        return list(self.meta["arrays"].keys())
+
+    def __contains__(self, name):
+        return name in self.meta["arrays"]
+
+    def __getitem__(self, name):
+        return self.read(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def close(self):
+        pass
+
+    def columns(self, name):
+        """Names of the columns of an array, or None if it was not written with column names"""
+        info = self.meta["arrays"][name]
+        if(info["columns"] is None):
+            return None
+
+        return [c["name"] for c in info["columns"]]
+
+    def _chunkFile(self, name, i, column=None):
+        if(column is None):
+            return os.path.join(self.path, name, "{}.npy.z".format(i))
+        return os.path.join(self.path, name, "{}_{}.npy.z".format(column, i))
+
+    def _writeChunks(self, name, array, column=None):
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        if(array.ndim == 0):
+            splits = [array]
+        else:
+            splits = [array[i:i+self.chunk_size] for i in range(0, max(len(array), 1), self.chunk_size)]
+        for i, chunk in enumerate(splits):
+            with open(self._chunkFile(name, i, column), "wb") as FH:
+                FH.write(_packChunk(chunk, self.compression_level))
+
+        return len(splits)
+
+    def _readChunks(self, name, num_chunks, column=None):
+        chunks = []
+        for i in range(num_chunks):
+            with open(self._chunkFile(name, i, column), "rb") as FH:
+                chunks.append(_unpackChunk(FH.read()))
+        if(len(chunks) == 1):
+            return chunks[0]
+
+        return np.concatenate(chunks, axis=0)
+
+    def _saveMeta(self):
+        # write to a temporary file first so readers never see partial metadata
+        meta_file = os.path.join(self.path, self.META)
+        tmp = "{}.{}.tmp".format(meta_file, os.getpid())
+        with open(tmp, "w") as FH:
+            json.dump(self.meta, FH, indent=1)
+        os.replace(tmp, meta_file)
+
+    def write(self, name, array, columns=None):
+        """Write an array, replacing any existing array of that name. If `columns` gives a name for
+        every column of a 2D array, the columns are stored separately. An array equal to the one
+        stored is not rewritten."""
+        array = np.asarray(array)
+        if(name in self):
+            info = self.meta["arrays"][name]
+            if(columns is None and info["columns"] is None and info["hash"] == _arrayHash(array)):
+                return
+            self.remove(name)
+
+        info = {"dtype": array.dtype.str, "shape": list(array.shape), "columns": None}
+        if(columns is None):
+            info["num_chunks"] = self._writeChunks(name, array)
+            info["hash"] = _arrayHash(array)
+            self.meta["arrays"][name] = info
+            self._saveMeta()
+        else:
+            self.meta["arrays"][name] = dict(info, shape=[array.shape[0], 0], columns=[])
+            self.writeColumns(name, array, columns)
+
+    def writeColumns(self, name, array, columns):
+        """Add or replace columns of a columnar array, leaving its other columns untouched. Columns
+        whose content did not change are not rewritten. Returns the names of the columns written."""
+        array = np.asarray(array)
+        if(array.ndim == 1):
+            array = array.reshape(-1, 1)
+        if(array.ndim != 2 or array.shape[1] != len(columns)):
+            raise ValueError("Expected a 2D array with {} columns, got shape {}".format(len(columns), array.shape))
+        if(name not in self):
+            self.meta["arrays"][name] = {"dtype": array.dtype.str, "shape": [array.shape[0], 0], "columns": []}
+
+        info = self.meta["arrays"][name]
+        if(info["columns"] is None):
+            raise ValueError("Array `{}` was not written with column names".format(name))
+        if(array.shape[0] != info["shape"][0]):
+            raise ValueError("Array `{}` has {} rows, got {}".format(name, info["shape"][0], array.shape[0]))
+
+        existing = {c["name"]: c for c in info["columns"]}
+        next_id = max([c["id"] for c in info["columns"]], default=-1) + 1
+        written = []
+        for j, cname in enumerate(columns):
+            column = array[:,j]
+            chash = _arrayHash(column)
+            if(cname in existing):
+                c = existing[cname]
+                if(c["hash"] == chash):
+                    continue
+            else:
+                c = {"name": cname, "id": next_id}
+                next_id += 1
+                info["columns"].append(c)
+                existing[cname] = c
+            c["num_chunks"] = self._writeChunks(name, column, c["id"])
+            c["hash"] = chash
+            written.append(cname)
+
+        info["dtype"] = np.result_type(*[np.dtype(info["dtype"]), array.dtype]).str
+        info["shape"] = [array.shape[0], len(info["columns"])]
+        self._saveMeta()
+
+        return written
+
+    def read(self, name, columns=None):
+        """Read an array. For columnar arrays `columns` selects columns by name or index, only those
+        are read from disk."""
+        if(name not in self):
+            raise KeyError("{} is not an array in the store {}".format(name, self.path))
+        info = self.meta["arrays"][name]
+        if(info["columns"] is None):
+            if(columns is not None):
+                raise ValueError("Array `{}` was not written with column names".format(name))
+            return self._readChunks(name, info["num_chunks"])
+
+        if(columns is None):
+            selected = info["columns"]
+        else:
+            names = [c["name"] for c in info["columns"]]
+            selected = [info["columns"][c if isinstance(c, (int, np.integer)) else names.index(c)] for c in columns]
+        if(len(selected) == 0):
+            return np.zeros((info["shape"][0], 0), dtype=info["dtype"])
+
+        return np.stack([self._readChunks(name, c["num_chunks"], c["id"]) for c in selected], axis=1).astype(info["dtype"], copy=False)
+
+    def removeColumns(self, name, columns):
+        """Remove columns of a columnar array"""
+        info = self.meta["arrays"][name]
+        keep = []
+        for c in info["columns"]:
+            if(c["name"] in columns):
+                for i in range(c["num_chunks"]):
+                    os.remove(self._chunkFile(name, i, c["id"]))
+            else:
+                keep.append(c)
+        info["columns"] = keep
+        info["shape"][1] = len(keep)
+        self._saveMeta()
+
+    def remove(self, name):
+        """Remove an array"""
+        if(name in self):
+            del self.meta["arrays"][name]
+            self._saveMeta()
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def clear(self):
+        """Remove every array"""
+        for name in self.files:
+            self.remove(name)
@@ -0,0 +1,141 @@
+# builtin modules
+import os
+import json
+import time
+import inspect
+import resource
+import functools
+import threading
+from contextlib import contextmanager
+
+def _peakRSS(who=resource.RUSAGE_SELF):
+    """Peak resident set size in bytes"""
+    return resource.getrusage(who).ru_maxrss*1024
+
+def _childCPU():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def problemSize(args):
+    """Number of atoms and mesh vertices of the arguments of a call, where it can be determined"""
+    size = {}
+    for arg in args:
+        if("atoms" not in size and hasattr(arg, "atom_list")):
+            size["atoms"] = len(arg.atom_list)
+        elif("atoms" not in size and isinstance(arg, list) and len(arg) and hasattr(arg[0], "coord")):
+            size["atoms"] = len(arg)
+        elif("vertices" not in size and hasattr(arg, "vertices") and hasattr(arg, "faces")):
+            size["vertices"] = len(arg.vertices)
+
+    return size
+
+class Profiler(object):
+    """Record the wall time, CPU time (of this process and of the external tools it runs), peak
+    memory increase and problem size (atoms, vertices) of calls. Calls are timed with `measure` or
+    by instrumenting the functions of a module with `instrument`.
+
+    The peak RSS delta is how much a call raised the peak memory of the process, which is zero if
+    the call did not exceed an earlier peak. If calls run concurrently in threads, their times and
+    memory overlap."""
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+        self._patched = []
+
+    @contextmanager
+    def measure(self, name, size=None):
+        record = {"name": name}
+        record.update(size or {})
+        rss0 = _peakRSS()
+        child_rss0 = _peakRSS(resource.RUSAGE_CHILDREN)
+        cpu0 = time.process_time()
+        child_cpu0 = _childCPU()
+        t0 = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall"] = time.perf_counter() - t0
+            record["cpu"] = time.process_time() - cpu0
+            record["tool_cpu"] = _childCPU() - child_cpu0
+            record["peak_rss_delta"] = _peakRSS() - rss0
+            record["tool_peak_rss"] = max(_peakRSS(resource.RUSAGE_CHILDREN) - child_rss0, 0)
+            with self._lock:
+                self.records.append(record)
+
+    def wrap(self, fn, name=None):
+        """Return a version of `fn` which records every call"""
+        name = name or "{}.{}".format(fn.__module__, fn.__name__)
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.measure(name, problemSize(args)):
+                return fn(*args, **kwargs)
+        wrapper.__profiled__ = fn
+
+        return wrapper
+
+    def instrument(self, *modules):
+        """Replace the public functions of modules (those listed in __all__) by versions which
+        record every call"""
+        for module in modules:
+            prefix = module.__name__
+            for attr in getattr(module, "__all__", []):
+                fn = getattr(module, attr, None)
+                if(not inspect.isfunction(fn) or hasattr(fn, "__profiled__")):
+                    continue
+                setattr(module, attr, self.wrap(fn, name="{}.{}".format(prefix, attr)))
+                self._patched.append((module, attr, fn))
+
+    def restore(self):
+        """Undo `instrument`"""
+        for module, attr, fn in reversed(self._patched):
+            setattr(module, attr, fn)
+        self._patched = []
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def write(self, file_name, **info):
+        """Write the records to a JSON file together with any extra information"""
+        tmp = "{}.{}.tmp".format(file_name, os.getpid())
+        with open(tmp, "w") as FH:
+            json.dump(dict(info, records=self.records), FH, indent=1)
+        os.replace(tmp, file_name)
+
+def summarizeProfiles(profiles):
+    """Summary table of the records of several profiles (e.g. one per structure, as read from the
+    files written by `Profiler.write`). Returns a list of rows with the number of calls, total
+    and maximum wall time, total CPU time, largest peak RSS increase and the largest problem size
+    per function, sorted by total wall time."""
+    rows = {}
+    for profile in profiles:
+        records = profile["records"] if isinstance(profile, dict) else profile
+        for r in records:
+            row = rows.setdefault(r["name"], {
+                "name": r["name"], "calls": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0, "tool_cpu": 0.0,
+                "max_peak_rss_delta": 0, "max_atoms": 0, "max_vertices": 0
+            })
+            row["calls"] += 1
+            row["wall"] += r["wall"]
+            row["max_wall"] = max(row["max_wall"], r["wall"])
+            row["cpu"] += r["cpu"]
+            row["tool_cpu"] += r["tool_cpu"]
+            row["max_peak_rss_delta"] = max(row["max_peak_rss_delta"], r["peak_rss_delta"])
+            row["max_atoms"] = max(row["max_atoms"], r.get("atoms", 0))
+            row["max_vertices"] = max(row["max_vertices"], r.get("vertices", 0))
+
+    return sorted(rows.values(), key=lambda row: -row["wall"])
+
+def formatProfileSummary(rows):
+    """Format the rows returned by `summarizeProfiles` as a text table"""
+    header = "{:<50s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s} {:>9s}".format(
+        "function", "calls", "wall (s)", "max (s)", "cpu (s)", "tools (s)", "peak (MB)", "atoms", "vertices"
+    )
+    lines = [header, "-"*len(header)]
+    for row in rows:
+        lines.append("{:<50s} {:>6d} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f} {:>8d} {:>9d}".format(
+            row["name"], row["calls"], row["wall"], row["max_wall"], row["cpu"], row["tool_cpu"],
+            row["max_peak_rss_delta"]/2**20, row["max_atoms"], row["max_vertices"]
+        ))
+
+    return "\n".join(lines)
@@ -0,0 +1,86 @@
+# builtin modules
+import os
+import json
+import hashlib
+
+# third party modules
+import numpy as np
+
+def hashArrays(arrays, files=()):
+    """Content hash of a dict of arrays and of the contents of a list of files"""
+    h = hashlib.sha1()
+    for key in sorted(arrays):
+        value = np.ascontiguousarray(arrays[key])
+        h.update("{}:{}:{}".format(key, value.dtype.str, value.shape).encode("utf-8"))
+        h.update(value.tobytes())
+    for f in files:
+        with open(f, "rb") as FH:
+            for chunk in iter(lambda: FH.read(1 << 20), b""):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+class StageCache(object):
+    """Cache the results of the named stages of a processing pipeline. Every stage is stored in its
+    own file <directory>/<stage>.npz together with a key and a content hash of its output. The key
+    hashes the stage name, its parameters and the output hashes of the stages it depends on, so a
+    stage is recomputed exactly when its parameters or the content of one of its inputs changed.
+
+    Stages whose results are files (e.g. a mesh) list them in `files`. Their content is part of the
+    output hash, and the stage is recomputed if one is missing. Files without a record, e.g. written
+    before the cache was used, are not trusted since the parameters they were made with are unknown."""
+    def __init__(self, directory, refresh=False, refresh_stages=None):
+        self.directory = directory
+        self.refresh = refresh
+        self.refresh_stages = set(refresh_stages or [])
+        self.hashes = {} # output hash of every stage run so far
+        self.computed = set() # stages which were recomputed
+        os.makedirs(directory, exist_ok=True)
+
+    def fileName(self, name):
+        return os.path.join(self.directory, "{}.npz".format(name))
+
+    def key(self, name, inputs=(), params=None):
+        missing = [i for i in inputs if i not in self.hashes]
+        if(missing):
+            raise ValueError("Stage `{}` depends on stages which have not been run: {}".format(name, ", ".join(missing)))
+        info = {
+            "stage": name,
+            "params": params,
+            "inputs": {i: self.hashes[i] for i in inputs}
+        }
+
+        return hashlib.sha1(json.dumps(info, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def updated(self, name):
+        """Whether a cached stage was recomputed in this run"""
+        return name in self.computed
+
+    def run(self, name, fn, inputs=(), params=None, files=(), cache=True):
+        """Return the output of a stage, a dict of arrays, either from the cache or by calling `fn`.
+        Stages with `cache` unset are always run, their output only serves to detect changes
+        downstream."""
+        key = self.key(name, inputs, params)
+        fname = self.fileName(name)
+        force = self.refresh or (name in self.refresh_stages)
+        files_exist = all(os.path.exists(f) for f in files)
+
+        if(cache and not force and files_exist and os.path.exists(fname)):
+            with np.load(fname) as FH:
+                if(str(FH["__key__"]) == key):
+                    self.hashes[name] = str(FH["__hash__"])
+                    return {k: FH[k] for k in FH.files if k not in ("__key__", "__hash__")}
+
+        arrays = fn() or {}
+        self.hashes[name] = hashArrays(arrays, files)
+        if(cache):
+            self.computed.add(name)
+            self._write(fname, key, self.hashes[name], arrays)
+
+        return arrays
+
+    def _write(self, fname, key, output_hash, arrays):
+        # write to a temporary file first so readers never see a partial result
+        tmp = "{}.{}.tmp.npz".format(fname, os.getpid())
+        np.savez(tmp, __key__=np.array(key), __hash__=np.array(output_hash), **arrays)
+        os.replace(tmp, fname)
@@ -0,0 +1,187 @@
+# builtin modules
+import re
+
+# third party modules
+import numpy as np
+
+# presets for the config option STORAGE_PRECISION
+PRECISION_PRESETS = {
+    "full": {"features": None, "normals": None, "coordinates": None, "indices": None},
+    "compact": {"features": "float32", "normals": "float32", "coordinates": "float32", "indices": "int32"},
+    "half": {"features": "float16", "normals": "float16", "coordinates": "float32", "indices": "int32"}
+}
+
+FEATURE_ARRAYS = re.compile(r"^(X|edge_attr)$")
+NORMAL_ARRAYS = re.compile(r"^N$")
+COORDINATE_ARRAYS = re.compile(r"^(V|pool\d+_pos)$")
+INDEX_ARRAYS = re.compile(r"^(F|edge_index|pool\d+_(face|edge_index|cluster))$")
+
+def _isMeta(key):
+    return key.endswith(("__scale", "__offset"))
+
+def _nbytes(array):
+    return int(array.nbytes) if array.dtype != object else 0
+
+def _encodeScaled(x, dtype):
+    """Store each column as (x - offset)/scale in `dtype`, with offset and scale chosen to map the
+    column range to [-1, 1]"""
+    x2 = x.reshape(len(x), -1)
+    lo = np.nanmin(x2, axis=0) if len(x2) else np.zeros(x2.shape[1])
+    hi = np.nanmax(x2, axis=0) if len(x2) else np.zeros(x2.shape[1])
+    offset = (hi + lo)/2
+    scale = (hi - lo)/2
+    scale[scale == 0] = 1.0
+
+    return ((x2 - offset)/scale).astype(dtype).reshape(x.shape), scale, offset
+
+def _columnRange(x2):
+    """Range of the central 98% of the values of every column, so that a few outliers do not hide
+    a loss of resolution for the bulk of the values"""
+    if(len(x2) == 0):
+        return np.zeros(x2.shape[1])
+    lo, hi = np.nanpercentile(x2, [1, 99], axis=0)
+
+    return hi - lo
+
+def _encodeQuantized(x, step):
+    """Store each column as integer multiples of `step` relative to the column minimum"""
+    x2 = x.reshape(len(x), -1)
+    offset = np.nanmin(x2, axis=0) if len(x2) else np.zeros(x2.shape[1])
+    q = np.round((x2 - offset)/step)
+    if(q.size and q.max() > np.iinfo(np.int32).max):
+        raise ValueError("Quantization step {} is too small for the range of the coordinates".format(step))
+    scale = np.full(x2.shape[1], step, dtype=np.float64)
+
+    return q.astype(np.int32).reshape(x.shape), scale, offset
+
+def _encodeIndex(x, dtype):
+    """Cast an integer array if every value is representable in `dtype`, otherwise keep it"""
+    info = np.iinfo(dtype)
+    if(x.size == 0 or (x.min() >= info.min and x.max() <= info.max)):
+        return x.astype(dtype)
+
+    return x
+
+def decodeArray(arrays, key, dtype=np.float32):
+    """Read an array written by `encodeArrays`, undoing any scaling. `arrays` may be a dict, an
+    npz file or a `geobind.utils.FeatureStore`."""
+    x = arrays[key]
+    if(key + "__scale" in arrays):
+        x = x.astype(dtype)*arrays[key + "__scale"].astype(dtype) + arrays[key + "__offset"].astype(dtype)
+
+    return x
+
+def decodeArrays(arrays, dtype=np.float32):
+    """Decode every array written by `encodeArrays`"""
+    keys = arrays.files if hasattr(arrays, "files") else list(arrays.keys())
+
+    return {key: decodeArray(arrays, key, dtype=dtype) for key in keys if not _isMeta(key)}
+
+def encodeArrays(arrays, policy="full", tolerance=1e-3, coordinate_step=1e-3):
+    """Convert the arrays of a data file to compact storage types.
+
+    policy is the name of a preset in `PRECISION_PRESETS` or a dict with the keys
+        features    - X and edge_attr: None, 'float32' or 'float16'
+        normals     - N: None, 'float32' or 'float16'
+        coordinates - V and pooled positions: None, 'float32' or 'quantized'
+        indices     - faces, edges and clusters: None or 'int32'
+    and may override `tolerance` and `coordinate_step`. float16 arrays are stored per column as
+    (x - offset)/scale with the column range mapped to [-1, 1], the scale and offset are stored as
+    <key>__scale and <key>__offset. Quantized coordinates are stored as int32 multiples of
+    `coordinate_step` (in Angstroms) in the same way. Use `decodeArray` to read them.
+
+    Index arrays are only converted if this is lossless. float16 arrays with a column whose largest
+    error exceeds `tolerance` times the range of the central 98% of its values are stored as
+    float32 instead.
+
+    Returns the encoded arrays and a report giving, for every converted array, the stored dtype,
+    the size before and after, the largest error, whether the conversion was lossless and the
+    columns which exceeded the tolerance when falling back to float32."""
+    if(isinstance(policy, str)):
+        if(policy not in PRECISION_PRESETS):
+            raise ValueError("Unknown value of argument `policy`: {}".format(policy))
+        policy = PRECISION_PRESETS[policy]
+    tolerance = policy.get("tolerance", tolerance)
+    coordinate_step = policy.get("coordinate_step", coordinate_step)
+
+    encoded = {}
+    report = {}
+    for key, x in arrays.items():
+        x = np.asarray(x)
+        if(_isMeta(key)):
+            continue
+        if(FEATURE_ARRAYS.match(key)):
+            mode = policy.get("features")
+        elif(NORMAL_ARRAYS.match(key)):
+            mode = policy.get("normals")
+        elif(COORDINATE_ARRAYS.match(key)):
+            mode = policy.get("coordinates")
+        elif(INDEX_ARRAYS.match(key) or (x.dtype.kind in "iu" and x.ndim > 0)):
+            mode = policy.get("indices")
+        else:
+            mode = None
+
+        if(mode is None or x.dtype == object or x.ndim == 0):
+            encoded[key] = x
+            continue
+
+        scale = None
+        if(x.dtype.kind in "iu"):
+            if(mode != "int32"):
+                raise ValueError("Unknown storage type for integer array `{}`: {}".format(key, mode))
+            y = _encodeIndex(x, np.int32)
+        elif(mode == "float16"):
+            y, scale, offset = _encodeScaled(x, np.float16)
+        elif(mode == "quantized"):
+            y, scale, offset = _encodeQuantized(x, coordinate_step)
+        elif(mode == "float32"):
+            y = x.astype(np.float32)
+        else:
+            raise ValueError("Unknown storage type for array `{}`: {}".format(key, mode))
+
+        # validate the conversion
+        if(scale is None):
+            decoded = y
+        else:
+            decoded = y.astype(np.float64).reshape(len(y), -1)*scale + offset
+        error = np.abs(decoded.reshape(x.shape).astype(np.float64) - x)
+        error = float(np.nanmax(error)) if error.size else 0.0
+        lossless = bool(np.array_equal(decoded.reshape(x.shape), x, equal_nan=(x.dtype.kind == "f")))
+        fallback = None
+        if(mode == "float16" and x.size):
+            x2 = x.reshape(len(x), -1)
+            column_error = np.nanmax(np.abs(decoded - x2), axis=0)
+            exceeded = np.flatnonzero(column_error > tolerance*np.maximum(_columnRange(x2), 1e-12))
+            if(len(exceeded)):
+                # not precise enough, fall back to single precision
+                y, scale = x.astype(np.float32), None
+                error = float(np.nanmax(np.abs(y.astype(np.float64) - x)))
+                lossless = bool(np.array_equal(y, x, equal_nan=True))
+                mode = "float32"
+                fallback = exceeded.tolist()
+
+        encoded[key] = y
+        if(scale is not None):
+            encoded[key + "__scale"] = scale
+            encoded[key + "__offset"] = offset
+        report[key] = {
+            "dtype": "{}->{}".format(x.dtype.name, y.dtype.name),
+            "mode": mode,
+            "bytes": [_nbytes(x), _nbytes(y) + (0 if scale is None else scale.nbytes + offset.nbytes)],
+            "max_error": error,
+            "lossless": lossless,
+            "fallback_columns": fallback
+        }
+
+    return encoded, report
+
+def summarizePrecisionReport(report):
+    """One line summary of a report returned by `encodeArrays`"""
+    before = sum(r["bytes"][0] for r in report.values())
+    after = sum(r["bytes"][1] for r in report.values())
+    lossy = ["{} ({:.2e})".format(k, r["max_error"]) for k, r in report.items() if not r["lossless"]]
+    fallback = ["{} (columns {})".format(k, r["fallback_columns"]) for k, r in report.items() if r.get("fallback_columns")]
+
+    return "{:.1f}x smaller ({} -> {} bytes), lossy: {}, kept as float32: {}".format(
+        before/max(after, 1), before, after, ", ".join(lossy) if lossy else "none", ", ".join(fallback) if fallback else "none"
+    )
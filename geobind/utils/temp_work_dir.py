@@ -0,0 +1,14 @@
+# builtin modules
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+@contextmanager
+def tempWorkDir(prefix="geobind_", dir=None):
+    """Create a private directory to run an external tool in and remove it on exit. Tools which
+    write to fixed file names in their working directory can then run concurrently."""
+    path = tempfile.mkdtemp(prefix=prefix, dir=dir)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,82 @@
+# builtin modules
+import os
+import multiprocessing
+from contextlib import contextmanager
+
+def availableCores():
+    """Number of cores this process is allowed to run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class ThreadScheduler(object):
+    """Hands out thread counts to multithreaded external tools from a fixed core budget. Jobs
+    which can not get at least `minimum` threads wait until running jobs release theirs, so the
+    total never exceeds the budget. The counter is shared between processes which inherit the
+    scheduler (e.g. through a pool initializer, see `setThreadScheduler`)."""
+    def __init__(self, num_threads=None, max_per_job=None, context=None):
+        if(context is None):
+            context = multiprocessing.get_context()
+        if(num_threads is None):
+            num_threads = availableCores()
+        if(max_per_job is None):
+            max_per_job = num_threads
+        if(num_threads < 1):
+            raise ValueError("Thread budget must be at least one.")
+        
+        self.num_threads = num_threads
+        self.max_per_job = min(max_per_job, num_threads)
+        self._free = context.Value('i', num_threads, lock=False)
+        self._cond = context.Condition()
+    
+    @property
+    def free_threads(self):
+        with self._cond:
+            return self._free.value
+    
+    def acquire(self, requested=None, minimum=1):
+        """Block until at least `minimum` threads are free and reserve up to `requested` of them.
+        Returns the number of threads reserved."""
+        if(requested is None):
+            requested = self.max_per_job
+        requested = max(1, min(requested, self.num_threads))
+        minimum = max(1, min(minimum, requested))
+        
+        with self._cond:
+            while(self._free.value < minimum):
+                self._cond.wait()
+            n = min(requested, self._free.value)
+            self._free.value -= n
+        
+        return n
+    
+    def release(self, n):
+        """Return `n` threads to the budget"""
+        with self._cond:
+            self._free.value += n
+            self._cond.notify_all()
+    
+    @contextmanager
+    def threads(self, requested=None, minimum=1):
+        """Reserve threads for the duration of a with-block"""
+        n = self.acquire(requested, minimum)
+        try:
+            yield n
+        finally:
+            self.release(n)
+
+_scheduler = None
+
+def getThreadScheduler():
+    """Return the scheduler used by external tool wrappers, creating one spanning every available
+    core if none has been set."""
+    global _scheduler
+    if(_scheduler is None):
+        _scheduler = ThreadScheduler()
+    return _scheduler
+
+def setThreadScheduler(scheduler):
+    """Install a scheduler for this process. Pass it as a pool initializer so that workers share
+    the budget of the parent."""
+    global _scheduler
+    _scheduler = scheduler
@@ -0,0 +1,189 @@
+# builtin modules
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import logging
+import importlib.metadata
+
+def _fileHash(file_name, h=None):
+    if(h is None):
+        h = hashlib.sha1()
+    with open(file_name, "rb") as FH:
+        for chunk in iter(lambda: FH.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h
+
+_versions = {}
+def toolVersion(tool):
+    """Identify the installed version of an external tool: the package version for tools
+    installed as python packages (e.g. pdb2pqr), otherwise a hash of the executable"""
+    if(tool not in _versions):
+        try:
+            version = importlib.metadata.version(tool)
+        except importlib.metadata.PackageNotFoundError:
+            path = shutil.which(tool)
+            version = _fileHash(path).hexdigest() if path else None
+        _versions[tool] = version
+
+    return _versions[tool]
+
+class ToolCache(object):
+    """A content-addressed cache of the output files of external tools. An entry is keyed by the
+    content of the input files, the tool names and versions, the parameters and the names of the
+    output files, so a tool is only rerun if one of these changed. Entries are directories
+    <directory>/<key[:2]>/<key> holding the output files and a record of the run.
+
+    If `max_size` (in bytes) is given, the least recently used entries are removed whenever the
+    cache grows beyond it. Hits and misses are counted per tool in `stats`."""
+    RECORD = "_record.json"
+
+    def __init__(self, directory, max_size=None):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.stats = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, tools, inputs=(), params=None, outputs=()):
+        h = hashlib.sha1()
+        info = {
+            "tools": {t: toolVersion(t) for t in tools},
+            "params": params,
+            "outputs": list(outputs)
+        }
+        h.update(json.dumps(info, sort_keys=True, default=str).encode("utf-8"))
+        for f in inputs:
+            _fileHash(f, h)
+
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _count(self, tools, outcome):
+        name = "+".join(tools)
+        self.stats.setdefault(name, {"hits": 0, "misses": 0})
+        self.stats[name][outcome] += 1
+
+    def fetch(self, key, wdir):
+        """Copy the files of an entry into `wdir`. Returns False if there is no such entry."""
+        path = self.entry(key)
+        if(not os.path.exists(os.path.join(path, self.RECORD))):
+            return False
+        try:
+            for f in os.listdir(path):
+                if(f != self.RECORD):
+                    shutil.copy(os.path.join(path, f), wdir)
+            # mark as recently used
+            os.utime(os.path.join(path, self.RECORD))
+        except FileNotFoundError:
+            # evicted by another process while copying
+            return False
+
+        return True
+
+    def store(self, key, wdir, outputs, record=None):
+        """Store the files in `wdir` matching the patterns in `outputs`. A pattern with wildcards
+        (e.g. one file per pocket) may match no file, which is stored as such. Nothing is stored
+        if a plain file name is missing, i.e. the tool failed."""
+        files = []
+        for pattern in outputs:
+            matches = glob.glob(os.path.join(wdir, pattern))
+            if(len(matches) == 0 and not glob.has_magic(pattern)):
+                return False
+            files += matches
+
+        # copy to a temporary directory first so other processes never see a partial entry
+        path = self.entry(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        for f in files:
+            shutil.copy(f, tmp)
+        with open(os.path.join(tmp, self.RECORD), "w") as FH:
+            json.dump(dict(record or {}, time=time.time()), FH, default=str)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process stored the same entry
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        if(self.max_size is not None):
+            self.evict(self.max_size)
+
+        return True
+
+    def entries(self):
+        """List (last use, size, path) of every entry"""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "??", "*")):
+            record = os.path.join(path, self.RECORD)
+            if(path.endswith(".tmp") or not os.path.exists(record)):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(record), size, path))
+            except FileNotFoundError:
+                continue
+
+        return entries
+
+    def size(self):
+        return sum(e[1] for e in self.entries())
+
+    def evict(self, max_size):
+        """Remove the least recently used entries until the cache holds at most `max_size` bytes"""
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for _, size, path in entries:
+            if(total <= max_size):
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def run(self, tools, fn, wdir, inputs=(), params=None, outputs=()):
+        """Produce the output files of an external tool in `wdir`, either by copying them from the
+        cache or by calling `fn`. Returns True on a cache hit."""
+        key = self.key(tools, inputs, params, outputs)
+        try:
+            hit = self.fetch(key, wdir)
+        except OSError as e:
+            # the cache is an optimization, never fail a run because of it
+            logging.warning("Could not read from the tool cache: %s", e)
+            hit = False
+        if(hit):
+            self._count(tools, "hits")
+            return True
+
+        self._count(tools, "misses")
+        fn()
+        try:
+            self.store(key, wdir, outputs, record={"tools": tools, "params": params})
+        except OSError as e:
+            logging.warning("Could not write to the tool cache: %s", e)
+
+        return False
+
+_cache = None
+
+def getToolCache():
+    """Return the tool cache of this process, or None if tool outputs are not cached"""
+    return _cache
+
+def setToolCache(cache):
+    """Install a tool cache for this process (None disables caching)"""
+    global _cache
+    _cache = cache
+
+def runCached(tools, fn, wdir, inputs=(), params=None, outputs=()):
+    """Run an external tool through the tool cache of this process if one is installed. `fn` runs
+    the tools and writes files matching the glob patterns `outputs` to `wdir`, patterns with
+    wildcards may match no file. The inputs are files whose content determines the outputs
+    together with `params`. Returns True on a cache hit."""
+    if(_cache is None):
+        fn()
+        return False
+
+    return _cache.run(tools, fn, wdir, inputs=inputs, params=params, outputs=outputs)
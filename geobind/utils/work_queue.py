@@ -0,0 +1,287 @@
+# builtin modules
+import os
+import json
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+
+def _writeFile(file_name, content):
+    """Write a file atomically, readers see either the old or the new content"""
+    tmp = "{}.{}.tmp".format(file_name, uuid.uuid4().hex)
+    with open(tmp, "w") as FH:
+        FH.write(content)
+    os.replace(tmp, file_name)
+
+def _readFile(file_name):
+    try:
+        with open(file_name) as FH:
+            return FH.read()
+    except FileNotFoundError:
+        return None
+
+class WorkQueue(object):
+    """A queue of work items (e.g. structure file names) shared by workers on any number of nodes
+    through a directory on a shared filesystem, with no central service. The layout is
+        <directory>/config                - identifies the run, see `checkConfig`
+        <directory>/claims/<key>.claim    - the worker processing an item
+        <directory>/done/<key>.json       - the record of a finished item
+        <directory>/failed/<key>.json     - the record of the last failed attempt at an item
+        <directory>/workers/<worker_id>   - last heartbeat of every worker
+
+    An item is claimed by hard linking a file to its claim file, which fails if the item is already
+    claimed, so exactly one worker wins. This is atomic on NFS, unlike creating files with O_EXCL on
+    older versions. The claims a worker holds are touched every `lease_time/4` seconds by a
+    background thread, and a claim which has not been touched for `lease_time` seconds is
+    considered abandoned (its worker died) and can be broken by another worker. Ages are measured
+    with the clock of the filesystem, so clocks of the nodes need not agree.
+
+    A finished item is recorded in its own file, so workers never write to the same file. A failed
+    item is not finished, every worker (and hence every rerun on the same queue) tries it once."""
+    def __init__(self, directory, lease_time=600.0, worker_id=None):
+        self.directory = os.path.abspath(directory)
+        self.lease_time = lease_time
+        self.worker_id = worker_id or "{}.{}.{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.held = {} # key -> token of every claim this worker holds
+        self.failed = set() # keys of the items which failed in this worker
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        for d in ("claims", "done", "failed", "workers"):
+            os.makedirs(os.path.join(self.directory, d), exist_ok=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    @staticmethod
+    def key(item):
+        """File name safe key of an item"""
+        name = "".join(c if c.isalnum() or c in "-_." else "_" for c in os.path.basename(str(item)))
+
+        return "{}_{}".format(name[:64], hashlib.sha1(str(item).encode("utf-8")).hexdigest()[:12])
+
+    def _claimFile(self, key):
+        return os.path.join(self.directory, "claims", key + ".claim")
+
+    def _doneFile(self, key):
+        return os.path.join(self.directory, "done", key + ".json")
+
+    def _failedFile(self, key):
+        return os.path.join(self.directory, "failed", key + ".json")
+
+    def now(self):
+        """Current time of the filesystem clock, taken from the mtime of this worker's heartbeat file"""
+        fname = os.path.join(self.directory, "workers", self.worker_id)
+        with open(fname, "a"):
+            os.utime(fname)
+
+        return os.path.getmtime(fname)
+
+    def checkConfig(self, config):
+        """Record the configuration of the run (e.g. a hash of the options) the first time, and
+        raise a ValueError if a worker joins the queue with a different one"""
+        fname = os.path.join(self.directory, "config")
+        tmp = "{}.{}.tmp".format(fname, self.worker_id)
+        with open(tmp, "w") as FH:
+            FH.write(config)
+        try:
+            os.link(tmp, fname)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+        if _readFile(fname) != config:
+            raise ValueError("The work queue {} was created for a different configuration".format(self.directory))
+
+    def record(self, item):
+        """The record of a finished item, or None if it is not finished"""
+        content = _readFile(self._doneFile(self.key(item)))
+
+        return None if content is None else json.loads(content)
+
+    def isDone(self, item):
+        return os.path.exists(self._doneFile(self.key(item)))
+
+    def _keys(self, subdir, suffix):
+        return set(f[:-len(suffix)] for f in os.listdir(os.path.join(self.directory, subdir)) if f.endswith(suffix))
+
+    def remaining(self, items):
+        """Items which are not finished, whether or not they are claimed, leaving out those which
+        failed in this worker"""
+        done = self._keys("done", ".json") | self.failed
+
+        return [item for item in items if self.key(item) not in done]
+
+    def claim(self, items):
+        """Claim the first item which is neither finished nor claimed by a live worker, and which
+        has not failed in this worker. Returns None if there is no such item."""
+        done = self._keys("done", ".json") | self.failed
+        claimed = self._keys("claims", ".claim")
+        now = self.now()
+        for item in items:
+            key = self.key(item)
+            if key in done or key in self.held:
+                continue
+            if key in claimed:
+                try:
+                    if now - os.path.getmtime(self._claimFile(key)) < self.lease_time:
+                        continue
+                except FileNotFoundError:
+                    pass
+            if self._acquire(key):
+                if self.isDone(item):
+                    # finished by another worker after we listed the finished items
+                    self._release(key)
+                    continue
+                return item
+
+        return None
+
+    def _acquire(self, key):
+        claim = self._claimFile(key)
+        token = "{} {}".format(self.worker_id, uuid.uuid4().hex)
+        tmp = "{}.{}.tmp".format(claim, self.worker_id)
+        with open(tmp, "w") as FH:
+            FH.write(token)
+        try:
+            for attempt in range(2):
+                try:
+                    os.link(tmp, claim)
+                except FileExistsError:
+                    if attempt == 0 and self._breakStale(key):
+                        continue
+                    return False
+                with self._lock:
+                    self.held[key] = token
+                return True
+        finally:
+            os.remove(tmp)
+
+    def _breakStale(self, key):
+        """Remove a claim which has not been renewed within the lease time. Returns True if the
+        item is no longer claimed."""
+        claim = self._claimFile(key)
+        owner = _readFile(claim)
+        if owner is None:
+            # released in the meantime
+            return True
+        try:
+            age = self.now() - os.path.getmtime(claim)
+        except FileNotFoundError:
+            return True
+        if age < self.lease_time:
+            return False
+
+        # renaming is atomic, only one worker can break a given claim
+        stale = "{}.{}.stale".format(claim, self.worker_id)
+        try:
+            os.rename(claim, stale)
+        except FileNotFoundError:
+            return False
+        if _readFile(stale) != owner:
+            # another worker broke the stale claim and claimed the item again before us, put
+            # the new claim back
+            try:
+                os.link(stale, claim)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        logging.warning("Released the stale claim of %s held by %s (%.0f s old)", key, owner.split()[0], age)
+
+        return True
+
+    def owns(self, item):
+        """Check that this worker still holds the claim of an item"""
+        key = self.key(item)
+        with self._lock:
+            token = self.held.get(key)
+
+        return token is not None and _readFile(self._claimFile(key)) == token
+
+    def _release(self, key):
+        with self._lock:
+            token = self.held.pop(key, None)
+        if token is not None and _readFile(self._claimFile(key)) == token:
+            try:
+                os.remove(self._claimFile(key))
+            except FileNotFoundError:
+                pass
+
+    def release(self, item):
+        """Give up the claim of an item without finishing it"""
+        self._release(self.key(item))
+
+    def complete(self, item, record, failed=False):
+        """Record an item as finished, or as failed if `failed` is set, and release its claim. A
+        failed item is left for other workers to retry."""
+        key = self.key(item)
+        if not self.owns(item):
+            logging.warning("The claim of %s was lost before it finished, it may have been processed twice", item)
+        if failed:
+            self.failed.add(key)
+            _writeFile(self._failedFile(key), json.dumps(record))
+        else:
+            _writeFile(self._doneFile(key), json.dumps(record))
+            try:
+                os.remove(self._failedFile(key))
+            except FileNotFoundError:
+                pass
+        self._release(key)
+
+    def heartbeat(self):
+        """Renew every claim this worker holds"""
+        with self._lock:
+            held = list(self.held.items())
+        self.now()
+        for key, token in held:
+            claim = self._claimFile(key)
+            if _readFile(claim) == token:
+                os.utime(claim)
+
+    def start(self):
+        """Renew the claims of this worker in a background thread"""
+        if self._thread is not None:
+            return
+        def run():
+            while not self._stop.wait(self.lease_time/4):
+                try:
+                    self.heartbeat()
+                except OSError as e:
+                    logging.warning("Work queue heartbeat failed: %s", e)
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the heartbeat and release any claims still held"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        for key in list(self.held.keys()):
+            self._release(key)
+        try:
+            os.remove(os.path.join(self.directory, "workers", self.worker_id))
+        except FileNotFoundError:
+            pass
+
+    def records(self):
+        """Records of every finished item, and of the last failed attempt at items which are not
+        finished"""
+        records = {}
+        for subdir in ("failed", "done"):
+            for f in os.listdir(os.path.join(self.directory, subdir)):
+                if f.endswith(".json"):
+                    content = _readFile(os.path.join(self.directory, subdir, f))
+                    if content:
+                        records[f] = json.loads(content)
+
+        return list(records.values())